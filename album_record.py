@@ -0,0 +1,159 @@
+"""
+File that contains the records the scraped information of albums is kept in, from the chart page to the database.
+Every album is a single AlbumRecord with typed fields (ints and floats for numbers, tuples for genres and markets)
+instead of a value in a list of every column, and the details of an album page are an AlbumPage.
+The display names of the columns are only used when the records are exported, see to_columns()
+Authors: Yair Vagshal and Doron Reiffman
+"""
+from typing import NamedTuple
+
+
+class AlbumPage(NamedTuple):
+    """
+    The details scraped from a single album page, or stored in the database for it in incremental mode.
+    A page that could not be scraped gets missing(AlbumPage)
+    """
+    publisher: str = ''
+    genres: tuple = ()
+    critic_reviews: int = 0
+    user_reviews: int = 0
+    artist_link: str = ''
+    publisher_link: str = ''
+    cover_image: str = ''
+    user_reviews_link: str = ''
+    details_link: str = ''
+    critic_reviews_link: str = ''
+    amazon_link: str = ''
+    scraped_at: str = None
+
+
+class ReviewCounts(NamedTuple):
+    """
+    The review counts scraped from a single album page, the details of the page that change between runs.
+    A page that could not be scraped gets missing(ReviewCounts)
+    """
+    critic_reviews: int = 0
+    user_reviews: int = 0
+
+
+# The display name of every field of AlbumRecord, in the order of the exported columns
+COLUMNS = {'album': 'Album', 'artist': 'Artist', 'release_date': 'Release Date', 'summary': 'Summary',
+           'album_link': 'Link to Album Page', 'rank': 'Album Rank', 'metascore': 'Metascore',
+           'user_score': 'User Score', 'spotify_album_id': 'Spotify Album ID', 'tracks': 'Number of Tracks',
+           'markets': 'Available Markets', 'spotify_artist_id': 'Spotify Artist ID',
+           'artist_popularity': 'Spotify Artist Popularity', 'followers': 'Number of Spotify Followers',
+           'publisher': 'Publisher', 'genres': 'Album Genres', 'critic_reviews': 'No. of Critic Reviews',
+           'user_reviews': 'No. of User Reviews', 'artist_link': 'Link to Artist Page',
+           'publisher_link': 'Link to Publisher Page', 'cover_image': 'Album Cover Image',
+           'user_reviews_link': 'Link to User Reviews', 'details_link': 'Link to More Details and Album Credits',
+           'critic_reviews_link': 'Link to Critic Reviews', 'amazon_link': 'Amazon Link',
+           'details_scraped_at': 'Details Scraped At'}
+
+# The fields of an album page, in the order of AlbumPage
+PAGE_FIELDS = ['publisher', 'genres', 'critic_reviews', 'user_reviews', 'artist_link', 'publisher_link',
+               'cover_image', 'user_reviews_link', 'details_link', 'critic_reviews_link', 'amazon_link',
+               'details_scraped_at']
+
+
+class AlbumRecord:
+    """
+    All the scraped information of a single album on a chart. The chart page fields are set when the record is
+    created, and the Spotify and album page fields are added to it later in the run
+    """
+    __slots__ = tuple(COLUMNS.keys())
+
+    def __init__(self, album='', artist='', release_date=None, summary='', album_link='', rank=0, metascore=None,
+                 user_score=0.0):
+        self.album = album
+        self.artist = artist
+        self.release_date = release_date
+        self.summary = summary
+        self.album_link = album_link
+        self.rank = rank
+        self.metascore = metascore
+        self.user_score = user_score
+        self.set_spotify_album(None, 0, ())
+        self.set_spotify_artist(None, 0, 0)
+        self.set_album_page(AlbumPage())
+
+    def set_spotify_album(self, spotify_id, tracks, markets):
+        """
+        Adds the details of the album found on Spotify
+        :param spotify_id: a string with the Spotify ID of the album, or None if it was not found
+        :param tracks: an integer, the number of tracks, or None when it is not known
+        :param markets: a tuple of the codes of the markets the album is available in (empty when they are not known)
+        """
+        self.spotify_album_id = spotify_id
+        self.tracks = tracks
+        self.markets = markets
+
+    def set_spotify_artist(self, spotify_id, popularity, followers):
+        """
+        Adds the details of the artist found on Spotify
+        :param spotify_id: a string with the Spotify ID of the artist, or None if it was not found
+        :param popularity: an integer, the popularity of the artist, or None when it is not known
+        :param followers: an integer, the number of followers of the artist, or None when it is not known
+        """
+        self.spotify_artist_id = spotify_id
+        self.artist_popularity = popularity
+        self.followers = followers
+
+    def set_album_page(self, album_page):
+        """
+        Adds the details of the album page
+        :param album_page: an AlbumPage
+        """
+        for field, value in zip(PAGE_FIELDS, album_page):
+            setattr(self, field, value)
+
+    def has_album_page(self):
+        """
+        :return: True if the details of the album page are known, False if the page could not be scraped
+        """
+        return self.details_link is not None
+
+    def __eq__(self, other):
+        if not isinstance(other, AlbumRecord):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    def __repr__(self):
+        return f"AlbumRecord({self.album!r}, {self.artist!r}, rank={self.rank!r})"
+
+
+def missing(record_type):
+    """
+    Builds the record of a page that could not be scraped. Its fields are None (and its genres empty), so the
+    details stored in the database for the album are kept
+    :param record_type: AlbumPage or ReviewCounts
+    :return: a record of the given type
+    """
+    return record_type(**{field: () if field == 'genres' else None for field in record_type._fields})
+
+
+def to_columns(records, fields=None):
+    """
+    Turns records into columns named by their display names, e.g. to build a DataFrame. Genres and markets are
+    exported as lists
+    :param records: a list of AlbumRecord
+    :param fields: a list of the fields to export, all of them when not given
+    :return: a dictionary from display name to a list with the value of every record
+    """
+    if fields is None:
+        fields = COLUMNS.keys()
+    return {COLUMNS[field]: [list(value) if isinstance(value, tuple) else value
+                             for value in (getattr(record, field) for record in records)]
+            for field in fields}
+
+
+def to_int(text, default=0):
+    """
+    Converts scraped text to an integer
+    :param text: a string with a number, e.g. '12' or '1,234'
+    :param default: the value returned when the text is not a number
+    :return: an integer
+    """
+    try:
+        return int(str(text).replace(',', '').strip())
+    except ValueError:
+        return default
@@ -0,0 +1,112 @@
+"""
+Benchmark of the peak memory of scraping album pages.
+Reads the saved test album pages from cfg.TEST_PAGES_FOLDER once, and then parses them over and over until the number
+of pages of a run is reached (500 by default), in two modes:
+* trees - the parsed trees of a whole batch are kept alive while their details are extracted into dictionaries of
+  lists, the way use_grequests() and the album page scraper used to work
+* records - every page is parsed by parse_album_page(), which decomposes its tree right away and keeps only a compact
+  AlbumPage record
+Every mode runs in a process of its own, since the peak RSS of a process never goes down.
+Usage: python ./benchmark_memory.py [pages] [batch]
+Authors: Yair Vagshal and Doron Reiffman
+"""
+import metacritic_scraper as scrape
+import config as cfg
+import resource
+import subprocess
+import json
+import sys
+
+MODES = ['trees', 'records']
+
+
+def peak_rss():
+    """
+    :return: the peak resident set size of this process in MB
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS reports bytes
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_trees(pages_content, pages, batch):
+    """
+    Parses the pages a batch at a time, keeping the trees of the batch alive until all of them are extracted
+    :param pages_content: a list of tuples with the url and raw html bytes of album pages
+    :param pages: an integer, the number of pages of the run
+    :param batch: an integer, the number of pages of a batch
+    :return: a list with the details of every batch
+    """
+    batches_details = []
+    for start in range(0, pages, batch):
+        batch_content = [pages_content[page_num % len(pages_content)] for page_num in range(start, start + batch)]
+        soups = [scrape.make_soup(content) for _, content in batch_content]
+
+        album_details_dict = {}
+        for (page_url, _), soup in zip(batch_content, soups):
+            page_details = {**scrape.scrape_album_extra_details(soup, page_url),
+                            **scrape.scrape_album_links(soup, page_url)}
+            for field, value in page_details.items():
+                album_details_dict.setdefault(field, []).append(value)
+        batches_details.append(album_details_dict)
+    return batches_details
+
+
+def run_records(pages_content, pages, batch):
+    """
+    Parses the pages one at a time into compact records
+    :param pages_content: a list of tuples with the url and raw html bytes of album pages
+    :param pages: an integer, the number of pages of the run
+    :param batch: an integer, not used, pages are parsed as soon as they arrive
+    :return: a list with the AlbumPage of every page
+    """
+    return [scrape.parse_album_page(content, page_url)
+            for page_url, content in (pages_content[page_num % len(pages_content)] for page_num in range(pages))]
+
+
+def measure(mode, pages, batch):
+    """
+    Runs a single mode in this process
+    :param mode: a string, one of MODES
+    :param pages: an integer, the number of pages of the run
+    :param batch: an integer, the number of pages of a batch
+    :return: a dictionary with the number of pages and the peak RSS in MB before and after parsing them
+    """
+    pages_content = []
+    for page_url, file_name in cfg.TEST_PAGE_FILES.items():
+        with open(file_name, 'rb') as page_file:
+            pages_content.append((page_url, page_file.read()))
+    before = peak_rss()
+
+    # the details are held until the peak is measured, as they are held until the end of a run
+    run = run_trees if mode == 'trees' else run_records
+    details = run(pages_content, pages, batch)
+    after = peak_rss()
+    del details
+
+    return {'before': before, 'after': after, 'pages': pages}
+
+
+def main():
+    """
+    main() runs every mode in a process of its own and prints the peak memory of each
+    """
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    batch = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    # a process started with a mode measures that mode and reports to the parent process
+    if len(sys.argv) > 3:
+        print(json.dumps(measure(sys.argv[3], pages, batch)))
+        return
+
+    print(f'{"mode":<10} {"pages":>6} {"peak RSS before (MB)":>21} {"peak RSS after (MB)":>20} {"growth (MB)":>12}')
+    for mode in MODES:
+        output = subprocess.run([sys.executable, __file__, str(pages), str(batch), mode], capture_output=True,
+                                text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f'{mode:<10} {result["pages"]:>6} {result["before"]:>21.1f} {result["after"]:>20.1f} '
+              f'{result["after"] - result["before"]:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark of the HTML parser backends listed in cfg.HTML_PARSERS.
+Reads the saved test chart and album pages from cfg.TEST_PAGES_FOLDER, and then times how long every backend takes to
+parse them and extract the albums' information. The chart page is timed in full and cut at BENCHMARK_MAX albums (-m).
+Usage: python ./benchmark_parsers.py [repeats]
+Authors: Yair Vagshal and Doron Reiffman
+"""
+import metacritic_scraper as scrape
+import config as cfg
+import sys
+import time
+
+# The number of albums the cut chart page is parsed up to, as with -m 5
+BENCHMARK_MAX = 5
+
+
+def benchmark(parser, chart_content, pages_content, repeats):
+    """
+    Times parsing and extraction of the chart page and album pages with one parser backend
+    :param parser: a string with the name of the parser backend
+    :param chart_content: the raw html bytes of the chart page
+    :param pages_content: a list of tuples with the url and raw html bytes of album pages
+    :param repeats: an integer, the number of times every page is parsed
+    :return: the average number of seconds of the chart page, of the chart page cut at BENCHMARK_MAX albums and of a
+    single album page
+    """
+    cfg.HTML_PARSER = parser
+    args = scrape.parse_args(cfg.ARGS_4_TESTS)
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        scrape.scrape_chart(args, scrape.make_soup(chart_content, scrape.chart_strainer()))
+    chart_time = (time.perf_counter() - start) / repeats
+
+    max_args = scrape.parse_args(cfg.ARGS_4_TESTS + ['-m', str(BENCHMARK_MAX)])
+    start = time.perf_counter()
+    for _ in range(repeats):
+        scrape.scrape_chart(max_args, scrape.make_soup(chart_content, scrape.chart_strainer(BENCHMARK_MAX)))
+    max_chart_time = (time.perf_counter() - start) / repeats
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for page_url, content in pages_content:
+            scrape.parse_album_page(content, page_url)
+    page_time = (time.perf_counter() - start) / (repeats * len(pages_content))
+
+    return chart_time, max_chart_time, page_time
+
+
+def main():
+    """
+    main() reads the pages and prints the benchmark results of every installed parser backend
+    """
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    with open(cfg.TEST_CHART_FILE, 'rb') as chart_file:
+        chart_content = chart_file.read()
+    pages_content = []
+    for page_url, file_name in cfg.TEST_PAGE_FILES.items():
+        with open(file_name, 'rb') as page_file:
+            pages_content.append((page_url, page_file.read()))
+
+    results = {}
+    for parser in cfg.HTML_PARSERS:
+        cfg.HTML_PARSER = parser
+        if scrape.html_parser() != parser:
+            print(f'{parser:<12} not installed')
+            continue
+        results[parser] = benchmark(parser, chart_content, pages_content, repeats)
+
+    baseline_chart, _, baseline_page = results.get('html.parser', (None, None, None))
+    max_column = f'chart -m {BENCHMARK_MAX} (ms)'
+    print(f'{"parser":<12} {"chart page (ms)":>16} {max_column:>16} {"album page (ms)":>16} {"speedup":>8}')
+    for parser, (chart_time, max_chart_time, page_time) in results.items():
+        speedup = f'{baseline_page / page_time:.2f}x' if baseline_page else '-'
+        print(f'{parser:<12} {chart_time * 1000:>16.2f} {max_chart_time * 1000:>16.2f} {page_time * 1000:>16.2f} '
+              f'{speedup:>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+File that contains the export of the scraped charts to typed, compressed columnar files, Parquet or Arrow IPC.
+Every column keeps the type of its AlbumRecord field, and genres and markets are list columns, so the history of the
+charts can be scanned without parsing strings back.
+The files are partitioned in hive style folders, e.g. sort=meta_score/filter=year/year=2021/scrape_date=2022-08-01,
+and every chunk of a chart is written to a file of its own.
+pyarrow is optional, it is only needed for these formats
+Authors: Yair Vagshal and Doron Reiffman
+"""
+import config as cfg
+import album_record as ar
+import logging
+import os
+from datetime import datetime
+
+# Logging definition
+if cfg.LOGFILE_DEBUG:
+    logging.basicConfig(filename=cfg.LOGFILE_NAME, format="%(asctime)s %(levelname)s: %(message)s",
+                        level=logging.DEBUG)
+else:
+    logging.basicConfig(filename=cfg.LOGFILE_NAME, format="%(asctime)s %(levelname)s: %(message)s",
+                        level=logging.INFO)
+
+# pyarrow is optional, without it only csv files can be saved
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    ARROW_AVAILABLE = True
+except ImportError:
+    ARROW_AVAILABLE = False
+
+# The file extension of every columnar format
+EXTENSIONS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+# The format of the scrape time and of details_scraped_at
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def chart_schema():
+    """
+    :return: the pyarrow schema of the exported files, the fields of AlbumRecord and the time of the scrape.
+    The fields missing from types are strings
+    """
+    types = {'release_date': pa.date32(), 'rank': pa.int32(), 'metascore': pa.int32(), 'user_score': pa.float64(),
+             'tracks': pa.int32(), 'markets': pa.list_(pa.string()), 'artist_popularity': pa.int32(),
+             'followers': pa.int64(), 'genres': pa.list_(pa.string()), 'critic_reviews': pa.int32(),
+             'user_reviews': pa.int32(), 'details_scraped_at': pa.timestamp('ms')}
+    return pa.schema([pa.field(field, types.get(field, pa.string())) for field in ar.COLUMNS] +
+                     [pa.field('scrape_datetime', pa.timestamp('ms'))])
+
+
+def to_time(value):
+    """
+    :param value: a datetime, a string in the format TIME_FORMAT or None
+    :return: a datetime, or None
+    """
+    if isinstance(value, str):
+        return datetime.strptime(value, TIME_FORMAT)
+    return value
+
+
+def to_table(records, scrape_datetime):
+    """
+    Turns records into a typed pyarrow table
+    :param records: a list of AlbumRecord
+    :param scrape_datetime: a string with the time of the scrape, in the format TIME_FORMAT
+    :return: a pyarrow Table with the schema of chart_schema()
+    """
+    columns = {field: [getattr(record, field) for record in records] for field in ar.COLUMNS}
+    columns['release_date'] = [value.date() if isinstance(value, datetime) else value
+                               for value in columns['release_date']]
+    columns['details_scraped_at'] = [to_time(value) for value in columns['details_scraped_at']]
+    columns['scrape_datetime'] = [to_time(scrape_datetime)] * len(records)
+    return pa.Table.from_pydict(columns, schema=chart_schema())
+
+
+def partition_folder(sort, filter_by, year, scrape_datetime):
+    """
+    :param sort: a string with the sort method of the chart
+    :param filter_by: a string with the filter of the chart
+    :param year: a string with the year of the chart
+    :param scrape_datetime: a string with the time of the scrape, in the format TIME_FORMAT
+    :return: a string with the path of the chart's partition folder
+    """
+    return os.path.join(cfg.EXPORT_FOLDER, f'sort={sort}', f'filter={filter_by}', f'year={year}',
+                        f'scrape_date={to_time(scrape_datetime):%Y-%m-%d}')
+
+
+def save_chart(records, export_format, sort, filter_by, year, scrape_datetime, first_row=0):
+    """
+    save_chart() saves a chunk of a chart's albums to a file of its own in the chart's partition folder.
+    If the folder does not exist, it creates it
+    :param records: a list of AlbumRecord
+    :param export_format: a string, 'parquet' or 'arrow'
+    :param sort: a string with the sort method of the chart
+    :param filter_by: a string with the filter of the chart
+    :param year: a string with the year of the chart
+    :param scrape_datetime: a string with the time of the scrape, in the format TIME_FORMAT
+    :param first_row: an integer, the position of the first album of the chunk in the chart
+    :return: a string with the path of the file
+    """
+    logging.debug(f"save_chart() started")
+    if not ARROW_AVAILABLE:
+        raise ValueError(f"Saving {export_format} files requires pyarrow, install it with: pip install pyarrow")
+    if export_format not in EXTENSIONS:
+        raise ValueError(f"Unknown export format '{export_format}', use one of {list(EXTENSIONS.keys())}")
+
+    folder = partition_folder(sort, filter_by, year, scrape_datetime)
+    os.makedirs(folder, exist_ok=True)
+
+    # runs of the same day share the partition, so the time of the scrape is part of the file name
+    file_name = f'part-{to_time(scrape_datetime):%H%M%S}-{first_row:06d}' + EXTENSIONS[export_format]
+    fullname = os.path.join(folder, file_name)
+
+    table = to_table(records, scrape_datetime)
+    if export_format == 'parquet':
+        pq.write_table(table, fullname, compression=cfg.EXPORT_COMPRESSION)
+    else:
+        options = pa.ipc.IpcWriteOptions(compression=cfg.EXPORT_COMPRESSION)
+        with pa.OSFile(fullname, 'wb') as sink, pa.ipc.new_file(sink, table.schema, options=options) as writer:
+            writer.write_table(table)
+    logging.info(f"{export_format} file {fullname} was created with {len(records)} albums.")
+    return fullname
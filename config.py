@@ -1,5 +1,4 @@
 from datetime import date
-import requests
 
 # Logging configuration
 LOGFILE_NAME = "logfile.log"
@@ -13,12 +12,58 @@ SORT_BY = {'meta_score': '/browse/albums/score/metascore/', 'user_score': '/brow
 YEAR_RELEASE = {str(year): 'filtered?year_selected=' + str(year) for year in range(1999, date.today().year + 1)}
 DATA_FOLDER = 'data/'
 
+# HTTP client configuration
+USER_AGENT = 'Mozilla/5.0'
+HTTP_POOL_HOSTS = 4  # number of hosts that keep a pool of connections (metacritic.com, Spotify api and accounts)
+HTTP_POOL_SIZE = 20  # keep-alive connections kept per host
+HTTP_TIMEOUT = 30  # seconds
+HTTP_RETRIES = 3  # retries of a request that failed to connect or got one of HTTP_RETRY_STATUS
+HTTP_RETRY_STATUS = [429, 500, 502, 503, 504]
+HTTP_BACKOFF_FACTOR = 0.5  # retry number n waits about HTTP_BACKOFF_FACTOR * 2 ** (n - 1) seconds
+HTTP_BACKOFF_JITTER = 0.5  # the backoff is randomized by up to +-50%
+CIRCUIT_BREAKER_FAILURES = 10  # consecutive failed requests after which requests to a host are paused
+CIRCUIT_BREAKER_COOLDOWN = 60  # seconds requests to a failing host are paused
+RATE_LIMITS = {'www.metacritic.com': 5.0, 'api.spotify.com': 10.0}  # initial requests per second of every host
+RATE_LIMIT_DEFAULT = 5.0  # initial requests per second of hosts missing from RATE_LIMITS
+RATE_LIMIT_MAX_FACTOR = 4  # the rate of a host can grow up to this many times its initial rate
+RATE_LIMIT_MIN = 0.2  # requests per second, the rate of a host is never cut below it
+RATE_LIMIT_DECREASE = 0.5  # the rate of a host is multiplied by it when the host answers 429 or 503
+RATE_LIMIT_INCREASE = 0.05  # requests per second added to the rate of a host with every successful answer
+RATE_LIMIT_SLOW_DOWN_STATUS = [429, 503]
+FAILED_PAGES_FILE = DATA_FOLDER + 'failed_pages.csv'  # album pages that could not be scraped are recorded here
+
+# HTTP response cache configuration
+HTTP_CACHE_ENABLED = True
+HTTP_CACHE_FILE = DATA_FOLDER + 'http_cache.sqlite'
+HTTP_CACHE_MAX_AGE = {SITE_ADDRESS + '/browse/': 6 * 60 * 60,  # seconds a chart page is fresh
+                      SITE_ADDRESS + '/music/': 0}  # album pages hold the review counts, always revalidated
+HTTP_CACHE_MAX_BYTES = 500 * 1024 * 1024  # least recently used responses are evicted above this compressed size
+HTTP_CACHE_TIMEOUT = 30  # seconds to wait for another process that is writing to the cache
+
 #  requests status configuration
 REQ_STATUS_LOWER = 200
 REQ_STATUS_UPPER = 299
 
 #  Scraping configurations
-SCORE_INC = 2
+PAGE_WORKERS = 1  # default number of album pages requested at the same time
+INCREMENTAL_MAX_AGE_DAYS = 30  # in incremental mode album details stored longer ago are scraped again
+PIPELINE_CHUNK_SIZE = 250  # albums that go through Spotify, album pages and the database together
+PIPELINE_MEMO_SIZE = 20000  # albums, artists and album pages kept for reuse by later chunks, the oldest are dropped
+
+# Database configuration
+DB_BATCH_SIZE = 1000  # maximum number of names looked up by a single SELECT ... IN query
+DB_POOL_SIZE = 4  # idle connections kept open for reuse by every database
+DB_POOL_PING_AFTER = 60  # seconds a pooled connection may be idle before it is checked before reuse
+DB_CONNECT_TIMEOUT = 10  # seconds
+
+# BeautifulSoup parser backend: 'lxml' is several times faster than Python's built-in 'html.parser'
+HTML_PARSERS = ['html.parser', 'lxml']
+HTML_PARSER = 'lxml'
+
+# Export configuration: csv files are written to DATA_FOLDER, the columnar formats need pyarrow
+EXPORT_FORMATS = ['csv', 'parquet', 'arrow']
+EXPORT_FOLDER = DATA_FOLDER + 'charts/'  # columnar files are partitioned under it by sort/filter/year/scrape_date
+EXPORT_COMPRESSION = 'zstd'
 
 # strings to strip from longer strings of text
 STRIP_BEG = "\n by "
@@ -57,9 +102,11 @@ TEST_PAGES = [
     'https://www.metacritic.com/music/this-is-happening/lcd-soundsystem'
 ]
 
-ALBUM_PAGE_COLUMNS = ['Publisher', 'Album Genres', 'No. of Critic Reviews', 'No. of User Reviews',
-                      'Link to Artist Page', 'Link to Publisher Page', 'Album Cover Image', 'Link to User Reviews',
-                      'Link to More Details and Album Credits', 'Link to Critic Reviews', 'Amazon Link']
+# saved copies of the test chart and of the first test album pages, parsed by the tests and benchmarks offline
+TEST_PAGES_FOLDER = 'test_pages/'
+TEST_CHART_FILE = TEST_PAGES_FOLDER + 'chart_metascore_year_2021.html'
+TEST_PAGE_FILES = {page_url: TEST_PAGES_FOLDER + page_url.split('/music/')[1].replace('/', '__') + '.html'
+                   for page_url in TEST_PAGES[:5]}
 
 CHART_PAGE_COLUMNS1 = ['Album', 'Artist', 'Release Date', 'Summary', 'Link to Album Page']
 
@@ -72,15 +119,21 @@ CLIENT_SECRET = '271c34473cfc42b993bde54c906b3c41'
 
 AUTH_URL = 'https://accounts.spotify.com/api/token'
 BASE_URL = 'https://api.spotify.com/v1'
-AUTH_RESPONSE = requests.post(AUTH_URL, {
-    'grant_type': 'client_credentials',
-    'client_id': CLIENT_ID,
-    'client_secret': CLIENT_SECRET})
-
-# convert the response to JSON
-AUTH_RESPONSE_DATA = AUTH_RESPONSE.json()
-
-# save the access token
-ACCESS_TOKEN = AUTH_RESPONSE_DATA['access_token']
 
-HEADERS = {'Authorization': 'Bearer {token}'.format(token=ACCESS_TOKEN)}
+# Spotify access token configuration (the token is requested on the first Spotify call, not at import)
+SPOTIFY_TOKEN_FILE = DATA_FOLDER + 'spotify_token.json'
+SPOTIFY_TOKEN_MARGIN = 60  # seconds before expiry in which the token is already refreshed
+SPOTIFY_TOKEN_DEFAULT_TTL = 3600  # seconds, used when Spotify does not return expires_in
+SPOTIFY_TOKEN_LOCK_TIMEOUT = 10  # seconds to wait for another process that is refreshing the token
+SPOTIFY_TIMEOUT = 10  # seconds
+
+# Spotify API enrichment configuration
+SPOTIFY_WORKERS = 8  # default number of Spotify requests in flight at the same time
+SPOTIFY_BATCH_SIZE = {'artists': 50, 'albums': 20}  # maximum number of IDs of the multi-ID endpoints
+
+# Spotify search cache configuration
+SPOTIFY_CACHE_ENABLED = True
+SPOTIFY_CACHE_FILE = DATA_FOLDER + 'spotify_cache.sqlite'
+SPOTIFY_CACHE_TTL = 7 * 24 * 60 * 60  # seconds an entry is considered fresh
+SPOTIFY_CACHE_MAX_ENTRIES = 50000  # least recently used entries are evicted above this size
+SPOTIFY_CACHE_TIMEOUT = 30  # seconds to wait for another process that is writing to the cache
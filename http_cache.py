@@ -0,0 +1,198 @@
+"""
+File that contains functions related to the persistent cache of Metacritic responses.
+Response bodies are stored zlib compressed in a SQLite file together with their ETag and Last-Modified headers.
+A response younger than the max age of its URL class (cfg.HTTP_CACHE_MAX_AGE) is answered from the cache without
+any request, an older one (or any one, when the max age is 0) is revalidated with If-None-Match/If-Modified-Since so
+an unchanged page costs a bodiless 304 answer, and the least recently used responses are evicted once the cache grows
+beyond cfg.HTTP_CACHE_MAX_BYTES
+Authors: Yair Vagshal and Doron Reiffman
+"""
+import config as cfg
+import logging
+import sqlite3
+import threading
+import json
+import time
+import zlib
+import os
+
+# Logging definition
+if cfg.LOGFILE_DEBUG:
+    logging.basicConfig(filename=cfg.LOGFILE_NAME, format="%(asctime)s %(levelname)s: %(message)s",
+                        level=logging.DEBUG)
+else:
+    logging.basicConfig(filename=cfg.LOGFILE_NAME, format="%(asctime)s %(levelname)s: %(message)s",
+                        level=logging.INFO)
+
+# Response headers that are stored with the body
+STORED_HEADERS = ['Content-Type', 'ETag', 'Last-Modified']
+
+# sqlite3 connections can't be shared between threads, so every thread opens its own connection
+_local = threading.local()
+
+# counters of the current process
+_stats = {'hits': 0, 'revalidated': 0, 'misses': 0, 'bytes_saved': 0}
+_stats_lock = threading.Lock()
+
+
+def max_age(url):
+    """
+    Finds the URL class of a url
+    :param url: a string with the url of the request
+    :return: the number of seconds a response of the url is fresh, or None if the url is not cached
+    """
+    for prefix, seconds in cfg.HTTP_CACHE_MAX_AGE.items():
+        if url.startswith(prefix):
+            return seconds
+    return None
+
+
+def get_connection():
+    """
+    Returns this thread's connection to the cache file, creating the file and the table on first use
+    :return: a sqlite3 connection
+    """
+    connection = getattr(_local, 'connection', None)
+    if connection is not None and getattr(_local, 'file_name', None) == cfg.HTTP_CACHE_FILE:
+        return connection
+
+    folder = os.path.dirname(cfg.HTTP_CACHE_FILE)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+
+    connection = sqlite3.connect(cfg.HTTP_CACHE_FILE, timeout=cfg.HTTP_CACHE_TIMEOUT)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("CREATE TABLE IF NOT EXISTS response_cache (\
+                            url TEXT PRIMARY KEY,\
+                            headers TEXT,\
+                            body BLOB,\
+                            size INTEGER,\
+                            stored_at REAL,\
+                            last_used REAL\
+                            )")
+    connection.execute("CREATE INDEX IF NOT EXISTS response_cache_last_used ON response_cache (last_used)")
+    connection.commit()
+
+    _local.connection = connection
+    _local.file_name = cfg.HTTP_CACHE_FILE
+    return connection
+
+
+def count(stat, value=1):
+    """
+    Increments one of the cache counters
+    :param stat: a string, 'hits', 'revalidated', 'misses' or 'bytes_saved'
+    :param value: an integer to add to the counter
+    """
+    with _stats_lock:
+        _stats[stat] += value
+
+
+def cache_lookup(url):
+    """
+    Looks up the cached response of a url
+    :param url: a string with the url of the request
+    :return: a dictionary with the 'headers' and the 'body' of the cached response, and 'fresh' which is true if the
+    response can be used without revalidating it. None if the url is not cached
+    """
+    seconds = max_age(url)
+    if not cfg.HTTP_CACHE_ENABLED or seconds is None:
+        return None
+
+    try:
+        row = get_connection().execute("SELECT headers, body, stored_at FROM response_cache WHERE url = ?",
+                                       (url,)).fetchone()
+    except sqlite3.Error as e:
+        logging.warning(f"HTTP cache lookup for {url} failed. \n {e}")
+        return None
+
+    if row is None:
+        count('misses')
+        return None
+
+    return {'headers': json.loads(row[0]), 'body': zlib.decompress(row[1]),
+            'fresh': time.time() - row[2] < seconds}
+
+
+def cache_hit(url, body, revalidated=False):
+    """
+    Marks a cached response as used. A revalidated response is fresh again for the max age of its URL class
+    :param url: a string with the url of the request
+    :param body: the bytes of the cached body, counted as transfer saved
+    :param revalidated: a boolean, true if the server confirmed the cached response with 304 Not Modified
+    """
+    now = time.time()
+    count('revalidated' if revalidated else 'hits')
+    count('bytes_saved', len(body))
+    try:
+        connection = get_connection()
+        with connection:
+            if revalidated:
+                connection.execute("UPDATE response_cache SET stored_at = ?, last_used = ? WHERE url = ?",
+                                   (now, now, url))
+            else:
+                connection.execute("UPDATE response_cache SET last_used = ? WHERE url = ?", (now, url))
+    except sqlite3.Error as e:
+        logging.warning(f"Updating {url} in the HTTP cache failed. \n {e}")
+
+
+def cache_store(url, headers, body):
+    """
+    Stores a response, and evicts the least recently used responses if the cache is larger than
+    cfg.HTTP_CACHE_MAX_BYTES
+    :param url: a string with the url of the request
+    :param headers: the headers of the response
+    :param body: the bytes of the decoded response body
+    """
+    if not cfg.HTTP_CACHE_ENABLED or max_age(url) is None:
+        return
+
+    stored_headers = {name: headers[name] for name in STORED_HEADERS if name in headers}
+    compressed = zlib.compress(body)
+    now = time.time()
+    try:
+        connection = get_connection()
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO response_cache (url, headers, body, size, stored_at, last_used)"
+                               " VALUES (?, ?, ?, ?, ?, ?)",
+                               (url, json.dumps(stored_headers), compressed, len(compressed), now, now))
+
+            excess = connection.execute("SELECT COALESCE(SUM(size), 0) FROM response_cache").fetchone()[0] \
+                - cfg.HTTP_CACHE_MAX_BYTES
+            if excess > 0:
+                evicted = []
+                for evicted_url, size in connection.execute("SELECT url, size FROM response_cache "
+                                                            "ORDER BY last_used").fetchall():
+                    if excess <= 0:
+                        break
+                    evicted.append((evicted_url,))
+                    excess -= size
+                connection.executemany("DELETE FROM response_cache WHERE url = ?", evicted)
+                logging.debug(f"Evicted {len(evicted)} responses from the HTTP cache")
+    except sqlite3.Error as e:
+        logging.warning(f"Saving {url} to the HTTP cache failed. \n {e}")
+
+
+def total_size():
+    """
+    :return: the number of compressed bytes stored in the cache
+    """
+    return get_connection().execute("SELECT COALESCE(SUM(size), 0) FROM response_cache").fetchone()[0]
+
+
+def cache_stats():
+    """
+    :return: a dictionary with the number of fresh hits, revalidated hits and misses in this process, and the number
+    of body bytes that were not transferred thanks to the cache
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_stats():
+    """
+    Resets the counters of this process
+    """
+    with _stats_lock:
+        for stat in _stats:
+            _stats[stat] = 0
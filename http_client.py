@@ -0,0 +1,335 @@
+"""
+File that contains the HTTP client shared by all the requests of the program, to Metacritic and to Spotify's API.
+A single requests Session keeps a pool of keep-alive connections per host, so the TCP and TLS handshakes are paid
+once per connection instead of once per request.
+Failed requests are retried with jittered exponential backoff, and a host that keeps failing is not requested
+again until a cool down period passes (circuit breaker). This is the only layer that retries requests.
+Requests to every host, retries included, are spaced by a token bucket rate limiter, that slows down when the host
+answers 429 or 503 and speeds up again while it answers successfully.
+Metacritic pages are answered from the on-disk response cache of http_cache.py while they are fresh, and are
+revalidated with conditional requests once they are not
+Authors: Yair Vagshal and Doron Reiffman
+"""
+import config as cfg
+import http_cache as hc
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+from urllib.parse import urlparse
+import logging
+import threading
+import random
+import time
+
+# Logging definition
+if cfg.LOGFILE_DEBUG:
+    logging.basicConfig(filename=cfg.LOGFILE_NAME, format="%(asctime)s %(levelname)s: %(message)s",
+                        level=logging.DEBUG)
+else:
+    logging.basicConfig(filename=cfg.LOGFILE_NAME, format="%(asctime)s %(levelname)s: %(message)s",
+                        level=logging.INFO)
+
+# brotli is optional, responses are only requested brotli compressed when urllib3 is able to decode them
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+# requests sent and connections opened by this process
+_stats = {'requests': 0, 'connections': 0}
+_stats_lock = threading.Lock()
+
+_session = None
+_session_lock = threading.Lock()
+
+# consecutive failures of every host, and the time until which requests to the host are not sent
+_circuits = {}
+_circuits_lock = threading.Lock()
+
+# token bucket of every host
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """
+    Raised instead of sending a request to a host that failed too many times in a row
+    """
+
+
+def count(stat):
+    """
+    Increments one of the connection counters
+    :param stat: a string, 'requests' or 'connections'
+    """
+    with _stats_lock:
+        _stats[stat] += 1
+
+
+class CountingHTTPConnection(HTTPConnection):
+    """
+    HTTP connection that counts every socket it opens, also when it reconnects after the host closed the last one
+    """
+
+    def _new_conn(self):
+        count('connections')
+        return super()._new_conn()
+
+
+class CountingHTTPSConnection(HTTPSConnection):
+    """
+    HTTPS connection that counts every socket it opens, also when it reconnects after the host closed the last one
+    """
+
+    def _new_conn(self):
+        count('connections')
+        return super()._new_conn()
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    """
+    HTTP connection pool that counts the connections it opens
+    """
+    ConnectionCls = CountingHTTPConnection
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    """
+    HTTPS connection pool that counts the connections it opens
+    """
+    ConnectionCls = CountingHTTPSConnection
+
+
+class JitterRetry(Retry):
+    """
+    Retry configuration whose exponential backoff is randomized, so requests that failed together are not all
+    retried at the same moment. Retries are sent by urllib3 without going through the adapter, so every retry
+    waits for the rate limiter of its host here, after the backoff (or the Retry-After the host asked for)
+    """
+    # the host of the request that is retried, set by increment()
+    host = None
+
+    def get_backoff_time(self):
+        return super().get_backoff_time() * random.uniform(1 - cfg.HTTP_BACKOFF_JITTER, 1 + cfg.HTTP_BACKOFF_JITTER)
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        # responses that are retried never reach the adapter, so the rate limiter learns about them here
+        if response is not None and _pool is not None:
+            adapt_rate(_pool.host, response.status)
+        new_retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        new_retry.host = _pool.host if _pool is not None else self.host
+        return new_retry
+
+    def sleep(self, response=None):
+        super().sleep(response)
+        if self.host is not None:
+            acquire(self.host)
+            count('requests')
+
+
+def get_bucket(host):
+    """
+    Returns the token bucket of the host, creating it on first use. Must be called while holding _buckets_lock
+    :param host: a string with the host name
+    :return: a dictionary with the current rate (requests per second), the available tokens and the last refill time
+    """
+    if host not in _buckets:
+        rate = cfg.RATE_LIMITS.get(host, cfg.RATE_LIMIT_DEFAULT)
+        _buckets[host] = {'rate': rate, 'max_rate': rate * cfg.RATE_LIMIT_MAX_FACTOR, 'tokens': 1.0,
+                          'updated': time.time()}
+    return _buckets[host]
+
+
+def acquire(host):
+    """
+    Waits until the rate limiter of the host allows one more request
+    :param host: a string with the host name
+    """
+    while True:
+        with _buckets_lock:
+            bucket = get_bucket(host)
+            now = time.time()
+
+            # the bucket refills at the current rate and holds at most one second of requests
+            bucket['tokens'] = min(max(bucket['rate'], 1.0),
+                                   bucket['tokens'] + (now - bucket['updated']) * bucket['rate'])
+            bucket['updated'] = now
+            if bucket['tokens'] >= 1:
+                bucket['tokens'] -= 1
+                return
+            wait = (1 - bucket['tokens']) / bucket['rate']
+
+        # sleep without holding the lock, so requests to other hosts are not delayed
+        time.sleep(wait)
+
+
+def adapt_rate(host, status_code):
+    """
+    Adapts the rate of the host to its answer: the rate is cut when the host asks to slow down (429 or 503), and is
+    raised a little with every successful answer, up to cfg.RATE_LIMIT_MAX_FACTOR times the configured rate
+    :param host: a string with the host name
+    :param status_code: an integer, the status code of the host's answer
+    """
+    with _buckets_lock:
+        bucket = get_bucket(host)
+        if status_code in cfg.RATE_LIMIT_SLOW_DOWN_STATUS:
+            bucket['rate'] = max(cfg.RATE_LIMIT_MIN, bucket['rate'] * cfg.RATE_LIMIT_DECREASE)
+            bucket['tokens'] = min(bucket['tokens'], 0.0)
+            logging.warning(f"{host} answered {status_code}. Slowing down to {bucket['rate']:.2f} requests per second.")
+        elif cfg.REQ_STATUS_LOWER <= status_code <= cfg.REQ_STATUS_UPPER:
+            bucket['rate'] = min(bucket['max_rate'], bucket['rate'] + cfg.RATE_LIMIT_INCREASE)
+
+
+def current_rate(host):
+    """
+    :param host: a string with the host name
+    :return: the current rate of requests per second allowed to the host
+    """
+    with _buckets_lock:
+        return get_bucket(host)['rate']
+
+
+def check_circuit(host):
+    """
+    Makes sure requests to the host are allowed. After the cool down period one request is let through, and its
+    result decides whether the circuit is closed again
+    :param host: a string with the host name
+    """
+    with _circuits_lock:
+        circuit = _circuits.get(host)
+        if circuit is None or circuit['failures'] < cfg.CIRCUIT_BREAKER_FAILURES:
+            return
+        if time.time() < circuit['open_until']:
+            raise CircuitOpenError(f"{host} failed {circuit['failures']} times in a row. Requests to it are paused.")
+
+        # half open: let one request through and wait for its result before letting more
+        circuit['open_until'] = time.time() + cfg.CIRCUIT_BREAKER_COOLDOWN
+
+
+def record_result(host, success):
+    """
+    Updates the circuit of the host with the result of a request
+    :param host: a string with the host name
+    :param success: a boolean, false if the request raised or the server answered with an error
+    """
+    with _circuits_lock:
+        circuit = _circuits.setdefault(host, {'failures': 0, 'open_until': 0})
+        if success:
+            circuit['failures'] = 0
+            return
+
+        circuit['failures'] += 1
+        if circuit['failures'] >= cfg.CIRCUIT_BREAKER_FAILURES:
+            circuit['open_until'] = time.time() + cfg.CIRCUIT_BREAKER_COOLDOWN
+            logging.warning(f"{host} failed {circuit['failures']} times in a row. "
+                            f"Pausing requests to it for {cfg.CIRCUIT_BREAKER_COOLDOWN} seconds.")
+
+
+class PooledAdapter(HTTPAdapter):
+    """
+    Transport adapter that keeps up to cfg.HTTP_POOL_SIZE keep-alive connections per host, spaces the requests to
+    every host by its rate limiter, retries failed requests and stops sending requests to hosts that keep failing
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': CountingHTTPConnectionPool,
+                                                   'https': CountingHTTPSConnectionPool}
+
+    def send(self, request, **kwargs):
+        cached = hc.cache_lookup(request.url) if request.method == 'GET' else None
+        if cached is not None and cached['fresh']:
+            hc.cache_hit(request.url, cached['body'])
+            return self.cached_response(request, cached)
+
+        # a stale cached response is revalidated, the server answers 304 without a body if it did not change
+        if cached is not None:
+            if 'ETag' in cached['headers']:
+                request.headers['If-None-Match'] = cached['headers']['ETag']
+            if 'Last-Modified' in cached['headers']:
+                request.headers['If-Modified-Since'] = cached['headers']['Last-Modified']
+
+        host = urlparse(request.url).hostname
+        check_circuit(host)
+        acquire(host)
+
+        count('requests')
+        try:
+            response = super().send(request, **kwargs)
+        except requests.RequestException:
+            record_result(host, False)
+            raise
+
+        record_result(host, response.status_code < 500)
+        adapt_rate(host, response.status_code)
+
+        if cached is not None and response.status_code == 304:
+            hc.cache_hit(request.url, cached['body'], revalidated=True)
+            return self.cached_response(request, cached)
+        if cached is not None:
+            hc.count('misses')
+        if request.method == 'GET' and response.status_code == 200:
+            hc.cache_store(request.url, response.headers, response.content)
+        return response
+
+    def cached_response(self, request, cached):
+        """
+        Builds the response of a request from its cached response
+        :param request: the PreparedRequest that was sent
+        :param cached: a dictionary with the 'headers' and the 'body' of the cached response
+        :return: a requests Response
+        """
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict(cached['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = cached['body']
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+
+def create_session():
+    """
+    Creates a requests Session with pooled keep-alive connections and compressed responses
+    :return: a requests Session
+    """
+    session = requests.Session()
+    retries = JitterRetry(total=cfg.HTTP_RETRIES, backoff_factor=cfg.HTTP_BACKOFF_FACTOR,
+                          status_forcelist=cfg.HTTP_RETRY_STATUS, raise_on_status=False)
+    adapter = PooledAdapter(pool_connections=cfg.HTTP_POOL_HOSTS, pool_maxsize=cfg.HTTP_POOL_SIZE,
+                            max_retries=retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({'User-Agent': cfg.USER_AGENT, 'Accept-Encoding': ACCEPT_ENCODING,
+                            'Connection': 'keep-alive'})
+    return session
+
+
+def get_session():
+    """
+    Returns the Session shared by all the requests of this process, creating it on first use
+    :return: a requests Session
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+    return _session
+
+
+def connection_stats():
+    """
+    :return: a dictionary with the number of requests sent, connections opened and connections reused
+    """
+    with _stats_lock:
+        return {'requests': _stats['requests'], 'opened': _stats['connections'],
+                'reused': max(_stats['requests'] - _stats['connections'], 0)}
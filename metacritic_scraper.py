@@ -22,7 +22,7 @@ Author: Doron Reiffman & Yair Vagshal
 """
 
 import grequests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, FeatureNotFound, SoupStrainer
 import pandas as pd
 import config as cfg
 import logging
@@ -31,10 +31,24 @@ import os
 from argparse import RawTextHelpFormatter
 import sys
 from datetime import datetime
+import time
 import json
+import csv
 import top_albums_db as ta
+import album_record as ar
+import chart_export as ce
+import spotify_api as sp
+import spotify_cache as sc
+import http_cache as hc
+import http_client as http
 import requests
 from urllib.parse import urlencode
+import multiprocessing
+import itertools
+import atexit
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from collections.abc import Sequence
 
 # Logging definition
 if cfg.LOGFILE_DEBUG:
@@ -44,13 +58,64 @@ else:
     logging.basicConfig(filename=cfg.LOGFILE_NAME, format="%(asctime)s %(levelname)s: %(message)s",
                         level=logging.INFO)
 
+# Pages that could not be scraped in this run, as tuples of the url and the reason
+failed_pages = []
 
-def save_csv(args, albums_df):
+# Maps the configured HTML parser to the parser that is actually installed
+_available_parsers = {}
+
+
+def review_counts_tag(name, attrs):
+    """
+    Checks whether a tag of an album page holds one of the review counts that scrape_review_counts() reads
+    :param name: a string with the tag name
+    :param attrs: a dictionary with the tag attributes
+    :return: True if the tag and its content should be parsed, otherwise False
+    """
+    classes = attrs.get('class') or ''
+    if not isinstance(classes, str):
+        classes = ' '.join(classes)
+    return attrs.get('itemprop') == 'reviewCount' or 'userscore_wrap' in classes.split()
+
+
+# The parts of the album page that scrape_review_counts() reads
+REVIEW_COUNTS_STRAINER = SoupStrainer(review_counts_tag)
+
+
+def chart_strainer(max_rows=None):
+    """
+    Builds a SoupStrainer of the parts of a chart page that scrape_chart() and chart_page_count() read: the cell of
+    every album and the page navigation. Only the cells of the first max_rows albums are built into the tree, so a
+    page that is cut at args.max albums costs a fraction of a full parse
+    :param max_rows: an integer, the number of albums to build, all of them when None
+    :return: a SoupStrainer. It counts the albums it let through, so every page is parsed with a strainer of its own
+    """
+    rows_num = 0
+
+    def chart_tag(name, attrs):
+        nonlocal rows_num
+        classes = attrs.get('class') or ''
+        if not isinstance(classes, str):
+            classes = ' '.join(classes)
+        if name == 'ul' and 'pages' in classes.split():
+            return True
+        if name != 'td' or 'clamp-summary-wrap' not in classes.split():
+            return False
+        if max_rows is not None and rows_num >= max_rows:
+            return False
+        rows_num += 1
+        return True
+
+    return SoupStrainer(chart_tag)
+
+
+def save_csv(args, albums_df, *, append=False):
     """
     save_csv() gets a Dataframe with the albums information and saves it to csv file.
     If the folder cfg.DATA_FOLDER does not exist, it creates it
     :param args: a Struct with all the input arguments of the py file
     :param albums_df: a Dataframe with the albums information
+    :param append: a boolean, when true the albums are added to the end of the chart's file without a header
     """
     logging.debug(f"save_csv() started")
 
@@ -62,37 +127,112 @@ def save_csv(args, albums_df):
     file_name = args.sort + '_' + args.filter + '_' + args.year + '.csv'
     fullname = os.path.join(cfg.DATA_FOLDER, file_name)
 
-    # Saves the chart information to csv file
-    albums_df.to_csv(fullname)
+    # Saves the chart information to csv file, a chart that is written in chunks appends every chunk after the first
+    if append:
+        albums_df.to_csv(fullname, mode='a', header=False)
+    else:
+        albums_df.to_csv(fullname)
     logging.info(f"CSV file was created. Initial information added.")
 
 
-def use_grequests(page_url):
+def html_parser():
+    """
+    Returns the BeautifulSoup tree builder to use, according to cfg.HTML_PARSER.
+    Falls back to Python's built-in 'html.parser' when the configured backend is not installed
+    :return: a string with the name of the tree builder
+    """
+    if cfg.HTML_PARSER not in cfg.HTML_PARSERS:
+        logging.critical(f"HTML parser is {cfg.HTML_PARSER} but it must be one of {cfg.HTML_PARSERS}. Exiting program.")
+        raise ValueError(f'HTML parser is {cfg.HTML_PARSER} but it must be one of {cfg.HTML_PARSERS}')
+
+    if cfg.HTML_PARSER not in _available_parsers:
+        try:
+            BeautifulSoup('', cfg.HTML_PARSER)
+            _available_parsers[cfg.HTML_PARSER] = cfg.HTML_PARSER
+        except FeatureNotFound:
+            logging.warning(f"HTML parser {cfg.HTML_PARSER} is not installed. Using html.parser instead.")
+            _available_parsers[cfg.HTML_PARSER] = 'html.parser'
+
+    return _available_parsers[cfg.HTML_PARSER]
+
+
+def make_soup(content, parse_only=None):
+    """
+    Parses html with the configured parser backend
+    :param content: the raw html of the page
+    :param parse_only: a SoupStrainer, when given only the matching parts of the page are built into the tree
+    :return: an object with the page content
+    """
+    return BeautifulSoup(content, html_parser(), parse_only=parse_only)
+
+
+def use_grequests(page_url, *, parse_only=None):
     """
     The function gets a list of urls and gets the page/s html
     :param page_url: a list of link/s to required web page/s
+    :param parse_only: a SoupStrainer, when given only the matching parts of the pages are parsed
     :return: a list of strings with html of the page/s
     """
     logging.debug(f"use_grequests() started")
 
     # Creates a generator of grequests from the page_url list and gets the html/s
-    rs = (grequests.get(u, headers={'User-Agent': 'Mozilla/5.0'}) for u in page_url)
+    rs = (grequests.get(u, session=http.get_session(), timeout=cfg.HTTP_TIMEOUT) for u in page_url)
     pages = grequests.map(rs)
 
     # Check if the request status is valid
     soups = []
     for i, page in enumerate(pages):
-        # check if there was a successful response
-        if hasattr(page, 'status_code') and (cfg.REQ_STATUS_LOWER <= page.status_code <= cfg.REQ_STATUS_UPPER):
-            logging.info(f"{page_url[i]} was requested successfully.")
-        else:
-            logging.warning(f"{page_url[i]} was not requested successfully. Exiting program.")
-            raise AttributeError(f'The link was not valid for scraping\n{page_url[i]}')
-        soups.append(BeautifulSoup(page.content, 'html.parser'))
+        check_response(page, page_url[i])
+        soups.append(make_soup(page.content, parse_only))
 
     return soups
 
 
+def response_error(page):
+    """
+    Describes why a page was not requested successfully
+    :param page: the response of the request, the exception it raised, or None if the request failed
+    :return: a string with the reason of the failure, or None if the page was requested successfully
+    """
+    if isinstance(page, Exception):
+        return f'{type(page).__name__}: {page}'
+    if not hasattr(page, 'status_code'):
+        return 'No response'
+    if not cfg.REQ_STATUS_LOWER <= page.status_code <= cfg.REQ_STATUS_UPPER:
+        return f'Status code {page.status_code}'
+    return None
+
+
+def check_response(page, url):
+    """
+    Checks that a page was requested successfully
+    :param page: the response of the request, or None if the request failed
+    :param url: a string with the link of the page
+    """
+    # check if there was a successful response
+    if response_error(page) is None:
+        logging.info(f"{url} was requested successfully.")
+    else:
+        logging.warning(f"{url} was not requested successfully. Exiting program.")
+        raise AttributeError(f'The link was not valid for scraping\n{url}')
+
+
+def record_failure(url, reason):
+    """
+    Records a page that could not be scraped in cfg.FAILED_PAGES_FILE, so the run goes on without it
+    :param url: a string with the link of the page
+    :param reason: a string with the reason of the failure
+    """
+    logging.warning(f"{url} could not be scraped and was skipped. {reason}")
+    failed_pages.append((url, reason))
+
+    folder = os.path.dirname(cfg.FAILED_PAGES_FILE)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+    with open(cfg.FAILED_PAGES_FILE, 'a', newline='') as outfile:
+        csv.writer(outfile).writerow([datetime.now().isoformat(sep=' ', timespec='seconds'), url, reason])
+
+
 def spotify_search(query, search_type):
     """
     Searches Spotify with given query and search_type using Spotify's API, returns json with results
@@ -111,13 +251,18 @@ def spotify_search(query, search_type):
     if search_type not in allowable_search_types:
         raise ValueError(f"The search type must be one of : {allowable_search_types}")
 
+    # repeated searches are answered from the persistent cache
+    cached_search = sc.cache_get(search_type, query)
+    if cached_search is not None:
+        return cached_search
+
     # save parameters as url to search
     endpoint = f"{cfg.BASE_URL}/search"
     search_params = urlencode({"q": query, "type": search_type.lower()})
     lookup_url = f"{endpoint}?{search_params}"
 
     try:
-        r = requests.get(lookup_url, headers=cfg.HEADERS)
+        r = sp.spotify_get(lookup_url)
     except Exception as e:
         logging.warning(f"Search for {query} was unsuccessful. \n {e}")
         r = requests.models.Response()
@@ -125,52 +270,254 @@ def spotify_search(query, search_type):
     # check that our search was successful
     if r.status_code not in range(200, 299):
         logging.warning(f"Could not complete search for {query}.")
-        r = requests.models.Response()
+        return requests.models.Response().json()
 
-    return r.json()
+    search_result = r.json()
+    sc.cache_put(search_type, query, search_result)
 
+    return search_result
 
-def scrape_albums_details(args, soup):
+
+def element_text(element):
     """
-    Take given url and scrape:
-    Album name, Artist name, Album release date, Link to individual album page, album descriptions
+    Returns the text of an element without the surrounding 'by' and whitespace, or '' if the element is missing
+    :param element: an object with part of the page content, or None
+    :return: a string with the text of the element
+    """
+    if element is None:
+        return ''
+    return element.get_text().lstrip(cfg.STRIP_BEG).rstrip(cfg.STRIP_END)
+
+
+def extract_chart_row(row):
+    """
+    Scrapes all the information of a single album from its row in the chart page.
+    Every field is looked up inside the row only, so a missing field never shifts the fields of other albums
+    :param row: an object with the content of the album's cell (td.clamp-summary-wrap) of the chart page
+    :return: an AlbumRecord with the information of the album
+    """
+    title = row.find('a', class_='title')
+    release_date = row.find('div', class_='clamp-details')
+    metascore = row.find('div', class_=lambda value: value and value.startswith('metascore_w large'))
+    userscore = row.find('div', class_=lambda value: value and value.startswith('metascore_w user'))
+
+    album = title.find('h3').get_text() if title is not None and title.find('h3') is not None else ''
+    try:
+        release_date = datetime.strptime(release_date.find('span').get_text(), "%B %d, %Y")
+    except (AttributeError, ValueError):
+        logging.warning(f"Release date of '{album}' was not found")
+        release_date = None
+    try:
+        user_score = float(userscore.get_text())
+    except (AttributeError, ValueError):
+        logging.warning(f"User score was not found")
+        user_score = 0.0
+
+    return ar.AlbumRecord(album=album,
+                          artist=element_text(row.find('div', class_='artist')),
+                          release_date=release_date,
+                          summary=element_text(row.find('div', class_='summary')),
+                          album_link=cfg.SITE_ADDRESS + title["href"] if title is not None else '',
+                          rank=ar.to_int(element_text(row.find('span', class_='title numbered')).rstrip('.')),
+                          metascore=ar.to_int(metascore.get_text(), None) if metascore is not None else None,
+                          user_score=user_score)
+
+
+def scrape_chart(args, soup):
+    """
+    Take given chart page and scrape, in a single pass over its rows:
+    Album name, Artist name, Album release date, Album descriptions, Link to individual album page,
+    Album rank, Meta score, user score
     :param args: a Struct with all the input arguments of the py file
     :param soup: an object with the page content
-    :returns soup: an object with the page content
-    :returns a dictionary with information of albums from the chart's url page
+    :returns a list with an AlbumRecord of every album on the chart's url page
     """
-
-    logging.debug(f"scrape_albums_details() started")
+    logging.debug(f"scrape_chart() started")
 
     # Test input validation
     if args.max is not None and args.max <= 0:
         logging.critical(f"args.max is {args.max} but it must be greater than 0. Exiting program.")
         raise ValueError(f'args.max is {args.max} but it must be greater than 0')
 
-    #  Scraping album name
-    album_name_text = soup.find_all('a', class_='title')
-    album_names = [i.find("h3").get_text() for n, i in enumerate(album_name_text) if args.max is None or n < args.max]
+    # Every album on the chart has its own cell that holds all its information, the search stops after args.max cells
+    rows = soup.find_all('td', class_='clamp-summary-wrap', limit=args.max)
+    if not rows:
+        logging.critical(f"No albums were found on the chart page. Exiting program.")
+        raise AttributeError(f'No albums were found on the chart page')
 
-    # Scraping artist name
-    artist_name_text = soup.find_all('div', class_='artist')
-    artist_names = [i.get_text().lstrip(cfg.STRIP_BEG).rstrip(cfg.STRIP_END) for n, i in enumerate(artist_name_text)
-                    if args.max is None or n < args.max]
+    return [extract_chart_row(row) for row in rows]
 
-    # Scraping release dates
-    release_date_text = soup.find_all("div", class_="clamp-details")
-    release_dates = [datetime.strptime(i.find("span").get_text(), "%B %d, %Y") for n, i in enumerate(release_date_text)
-                     if args.max is None or n < args.max]
 
-    # Scraping album descriptions
-    descriptions_text = soup.find_all("div", class_="summary")
-    summaries = [i.get_text().lstrip(cfg.STRIP_BEG).rstrip(cfg.STRIP_END) for n, i in enumerate(descriptions_text)
-                 if args.max is None or n < args.max]
+def chart_page_count(soup):
+    """
+    Finds the number of pages of the chart from the chart's page navigation
+    :param soup: an object with the content of the first page of the chart
+    :return: an integer, the number of pages of the chart (1 if the chart has no page navigation)
+    """
+    last_page = soup.find('li', class_='last_page')
+    if last_page is None:
+        return 1
+
+    try:
+        return int(last_page.get_text().strip())
+    except ValueError:
+        logging.warning(f"Could not read the number of chart pages. Only the first page is scraped.")
+        return 1
+
+
+def chart_page_url(chart_url, page_num):
+    """
+    Builds the url of one page of the chart. Metacritic numbers the chart pages from 0
+    :param chart_url: a string with the url of the first page of the chart
+    :param page_num: an integer, the number of the page
+    :return: a string with the url of the page
+    """
+    if page_num == 0:
+        return chart_url
+    separator = '&' if '?' in chart_url else '?'
+    return f'{chart_url}{separator}page={page_num}'
+
+
+def chart_pages_needed(args, page_count, page_size):
+    """
+    Finds how many pages of a chart are needed to reach args.max albums
+    :param args: a Struct with all the input arguments of the py file
+    :param page_count: an integer, the number of pages of the chart
+    :param page_size: an integer, the number of albums on the first page of the chart
+    :return: an integer, the number of pages to scrape
+    """
+    if args.max is None or page_size == 0:
+        return page_count
+    return min(page_count, -(-args.max // page_size))
+
+
+def iter_chart_pages(args, charts_url):
+    """
+    Scrapes all the pages of several charts through one pool of requests, and yields every page as soon as it is
+    parsed. The first pages of all the charts are requested together and tell how many pages every chart has, and then
+    the rest of the pages needed to reach args.max albums per chart are requested together, up to args.batch pages at
+    the same time. Pages arrive out of order, and every tree is decomposed as soon as its albums are extracted.
+    A chart page that can't be requested or has no albums is recorded in cfg.FAILED_PAGES_FILE and skipped, and only
+    if none of the charts could be scraped the program stops
+    :param args: a Struct with all the input arguments of the py file
+    :param charts_url: a list with the urls of the first pages of the charts
+    :return: a generator of tuples with the chart index, the page number and a list with an AlbumRecord of every
+    album of the page
+    """
+    logging.debug(f"iter_chart_pages() started")
+
+    # Getting the first page of every chart, only the albums up to args.max and page navigation are built into the tree
+    pages_url = []
+    page_size = {}
+    failures = []
+    for chart_num, content in stream_pages(charts_url, args.batch, failures):
+        soup = make_soup(content, chart_strainer(args.max))
+        try:
+            records = scrape_chart(args, soup)
+            page_count = chart_pages_needed(args, chart_page_count(soup), len(records))
+        except AttributeError as e:
+            record_failure(charts_url[chart_num], f'Not a chart page: {e}')
+            failures.append((chart_num, e))
+            continue
+        finally:
+            soup.decompose()
+        page_size[chart_num] = len(records)
+        logging.info(f"Scraping {page_count} pages of {charts_url[chart_num]}")
+
+        pages_url += [(chart_num, page_num, chart_page_url(charts_url[chart_num], page_num))
+                      for page_num in range(1, page_count)]
+        yield chart_num, 0, records
+
+    if charts_url and len(failures) == len(charts_url):
+        logging.critical(f"None of the {len(charts_url)} charts could be scraped. Exiting program.")
+        raise AttributeError(f'None of the {len(charts_url)} charts could be scraped')
+
+    # Getting the rest of the pages of all the charts, the last page of a chart is parsed only up to args.max albums
+    page_failures = []
+    for index, content in stream_pages([page_url for _, _, page_url in pages_url], args.batch, page_failures):
+        chart_num, page_num, page_url = pages_url[index]
+        if args.url:
+            print(page_url)
+        max_rows = None if args.max is None else args.max - page_num * page_size[chart_num]
+        soup = make_soup(content, chart_strainer(max_rows))
+        try:
+            records = scrape_chart(args, soup)
+        except AttributeError as e:
+            record_failure(page_url, f'Not a chart page: {e}')
+            page_failures.append((index, e))
+            continue
+        finally:
+            soup.decompose()
+        yield chart_num, page_num, records
+
+    if page_failures:
+        logging.warning(f"{len(page_failures)} of the {len(pages_url)} further chart pages could not be scraped, "
+                        f"the albums of pages {sorted(pages_url[index][1] + 1 for index, _ in page_failures)} "
+                        f"are missing from their charts. See {cfg.FAILED_PAGES_FILE}")
+
+
+def scrape_charts(args, charts_url):
+    """
+    Scrapes all the pages of several charts through one pool of requests, see iter_chart_pages()
+    :param args: a Struct with all the input arguments of the py file
+    :param charts_url: a list with the urls of the first pages of the charts
+    :returns a list with the AlbumRecords from all the pages of each chart, in the chart order
+    """
+    logging.debug(f"scrape_charts() started")
 
-    # Scraping links to individual album pages (for use later)
-    links = [(cfg.SITE_ADDRESS + i["href"]) for n, i in enumerate(album_name_text) if args.max is None or n < args.max]
+    charts_pages = [dict() for _ in charts_url]
+    for chart_num, page_num, records in iter_chart_pages(args, charts_url):
+        charts_pages[chart_num][page_num] = records
 
-    return {"Album": album_names, "Artist": artist_names, "Release Date": release_dates, "Summary": summaries,
-            "Link to Album Page": links}
+    # The pages arrive out of order, so each chart is put together only after all the pages are parsed
+    return [[record for page_num in sorted(chart_pages) for record in chart_pages[page_num]]
+            for chart_pages in charts_pages]
+
+
+def iter_chart_chunks(args, charts_url):
+    """
+    Groups the chart pages into chunks of at least cfg.PIPELINE_CHUNK_SIZE albums (the last chunk may be smaller),
+    so the rest of the pipeline works on a bounded number of albums at a time
+    :param args: a Struct with all the input arguments of the py file
+    :param charts_url: a list with the urls of the first pages of the charts
+    :return: a generator of dictionaries from chart index to a list with the chunk's AlbumRecords of that chart
+    """
+    chunk = {}
+    chunk_size = 0
+    for chart_num, _, records in iter_chart_pages(args, charts_url):
+        chunk.setdefault(chart_num, []).extend(records)
+        chunk_size += len(records)
+
+        if chunk_size >= cfg.PIPELINE_CHUNK_SIZE:
+            yield chunk
+            chunk = {}
+            chunk_size = 0
+
+    if chunk:
+        yield chunk
+
+
+def scrape_chart_pages(args, chart_url):
+    """
+    Scrapes all the pages of the chart, see scrape_charts()
+    :param args: a Struct with all the input arguments of the py file
+    :param chart_url: a string with the url of the first page of the chart
+    :returns a list with the AlbumRecords from all the chart's pages, in the chart order
+    """
+    return scrape_charts(args, [chart_url])[0]
+
+
+def scrape_albums_details(args, soup):
+    """
+    Take given url and scrape:
+    Album name, Artist name, Album release date, Link to individual album page, album descriptions
+    :param args: a Struct with all the input arguments of the py file
+    :param soup: an object with the page content
+    :returns a dictionary with information of albums from the chart's url page
+    """
+    logging.debug(f"scrape_albums_details() started")
+
+    return ar.to_columns(scrape_chart(args, soup), ['album', 'artist', 'release_date', 'summary', 'album_link'])
 
 
 def scrape_albums_scores(args, soup, chart_length):
@@ -179,300 +526,649 @@ def scrape_albums_scores(args, soup, chart_length):
     Album rank, Meta score, user score
     :param args: a Struct with all the input arguments of the py file
     :param soup: an object with the page content
-    :param chart_length: Integer of length of chart
+    :param chart_length: Integer of length of chart (no longer needed to align the scores, only validated)
     :returns a dictionary with scores and rank of albums from the chart's url page
     """
     logging.debug(f"scrape_albums_scores() started")
 
     # Test input validation
-    if args.max is not None and args.max <= 0:
-        logging.critical(f"args.max is {args.max} but it must be greater than 0. Exiting program.")
-        raise ValueError(f'args.max is {args.max} but it must be greater than 0')
     if type(chart_length) != int:
         logging.critical(f"chart_length should be integer and not {type(chart_length)}. Exiting program.")
         raise TypeError(f'chart_length should be integer and not {type(chart_length)}')
 
-    # Scraping ranks
-    ranks_text = soup.find_all('span', class_='title numbered')
-    ranks = [i.get_text().lstrip(cfg.STRIP_BEG).rstrip(cfg.STRIP_END).rstrip('.') for n, i in enumerate(ranks_text)
-             if args.max is None or n < args.max]
-
-    # Scraping critic score (Metascore)
-    metascore_text = soup.find_all('div', class_=lambda value: value and value.startswith('metascore_w large'))
-    if len(metascore_text) == chart_length * 2:
-        metascore_text = metascore_text[::cfg.SCORE_INC]
-    metascores = [i.get_text() for n, i in enumerate(metascore_text) if args.max is None or n < args.max]
-
-    # Scraping user score
-    userscore_text = soup.find_all('div', class_=lambda value: value and value.startswith('metascore_w user'))
-    if len(userscore_text) == chart_length * 2:
-        userscore_text = userscore_text[::cfg.SCORE_INC]
-    userscore_strings = [i.get_text() for n, i in enumerate(userscore_text) if args.max is None or n < args.max]
-    userscores = []
-    for userscore in userscore_strings:
-        try:
-            score_float = float(userscore)
-            userscores.append(score_float)
-        except ValueError:
-            score_float = 0.0
-            userscores.append(score_float)
-            logging.warning(f"User score was not found")
+    return ar.to_columns(scrape_chart(args, soup), ['rank', 'metascore', 'user_score'])
 
-    return {"Album Rank": ranks, "Metascore": metascores, "User Score": userscores}
 
+def search_spotify_artist(args, artist_name):
+    """
+    Searches Spotify's API for a single artist and takes the top search result
+    :param args: a Struct with all the input arguments of the py file
+    :param artist_name: a string with the artist's name
+    :return: a tuple with the artist's Spotify ID (None when there was no result), popularity and number of
+    followers (0 when there was no result)
+    """
+    if args.progress:
+        print(f"Calling Spotify API, searching for '{artist_name}' in artists")
+
+    # call spotify_search function
+    api_search = spotify_search(artist_name, 'artist')
+
+    # insert top search result on Spotify, inserts 0 if we got no results
+    try:
+        top_result = api_search['artists']['items'][0]
+    except IndexError:
+        logging.warning(f"No result found in Spotify API for '{artist_name}'. added 0 instead")
+        return None, 0, 0
+
+    return top_result['id'], top_result['popularity'], top_result['followers']['total']
+
+
+def search_spotify_album(args, album_name, artist_name):
+    """
+    Searches Spotify's API for a single album and takes the top search result
+    :param args: a Struct with all the input arguments of the py file
+    :param album_name: a string with the album's name
+    :param artist_name: a string with the album's artist name
+    :return: a tuple with the album's Spotify ID (None when there was no result), number of tracks (0 when there
+    was no result) and available markets
+    """
+    if args.progress:
+        print(f"Calling Spotify API, searching for '{album_name} {artist_name}' in albums")
 
-def scrape_spotify_api_artists(args, artist_names):
+    # call spotify_search function
+    api_search = spotify_search(album_name + ' ' + (''.join(artist_name.split('&'))), 'album')
+
+    # insert top search result on Spotify, inserts 0 if we got no results
+    try:
+        top_result = api_search['albums']['items'][0]
+    except (IndexError, TypeError):
+        logging.warning(
+            f"No result found in Spotify API for '{album_name} {artist_name}'. added 0 tracks and None markets instead")
+        return None, 0, ['None']
+
+    return top_result['id'], top_result['total_tracks'], top_result['available_markets']
+
+
+def spotify_workers(args):
+    """
+    Returns the number of Spotify requests that are allowed to be in flight at the same time
+    :param args: a Struct with all the input arguments of the py file
+    :return: an integer greater than 0
+    """
+    workers = getattr(args, 'spotify_workers', cfg.SPOTIFY_WORKERS)
+    if workers <= 0:
+        logging.critical(f"Number of Spotify workers is {workers} but it must be greater than 0. Exiting program.")
+        raise ValueError(f'Number of Spotify workers is {workers} but it must be greater than 0')
+    return workers
+
+
+def scrape_spotify_api_artists(args, artist_names, known_ids=None):
     """
-    Calls Spotify API for additional attributes
+    Calls Spotify API for additional attributes.
+    Artists without a known Spotify ID are searched concurrently, at most args.spotify_workers at a time, and then
+    popularity and followers of all the artists are refreshed in bulk with the multi-ID artists endpoint
     :param args: a Struct with all the input arguments of the py file
     :param artist_names: a list of artists of the albums in the searched chart
-    :return: a dictionary with the data scraped from Spotify api
+    :param known_ids: a dictionary from artist name to an already known Spotify ID (e.g. stored in the database)
+    :return: a dictionary from artist name to a tuple with the artist's Spotify ID (None when it was not found),
+    popularity and number of followers. Popularity and followers of a known ID that Spotify did not return are None,
+    so the stored values are kept
     """
     logging.debug(f"scrape_spotify_api_artists() started")
 
-    # queries spotify api for artist for popularity and number of followers
-    artist_popularity = []
-    followers_num = []
-    for artist_name in artist_names:
-        if args.progress:
-            print(f"Calling Spotify API, searching for '{artist_name}' in artists")
+    if known_ids is None:
+        known_ids = {}
 
-        # call spotify_search function
-        api_search = spotify_search(artist_name, 'artist')
+    # queries spotify api for artists without a known ID
+    names_to_search = [artist_name for artist_name in dict.fromkeys(artist_names) if artist_name not in known_ids]
+    with ThreadPoolExecutor(max_workers=spotify_workers(args)) as executor:
+        searched = dict(zip(names_to_search,
+                            executor.map(lambda artist_name: search_spotify_artist(args, artist_name),
+                                         names_to_search)))
+    results = {artist_name: (known_ids[artist_name], None, None) if artist_name in known_ids
+               else searched[artist_name] for artist_name in dict.fromkeys(artist_names)}
 
-        # insert top search result on Spotify, inserts 0 if we got no results
-        # popularity
-        try:
-            artist_popularity.append(api_search['artists']['items'][0]['popularity'])
-        except IndexError:
-            logging.warning(f"No result found in Spotify API for '{artist_name}' - 'popularity'. added 0 instead")
-            artist_popularity.append(0)
+    # refresh popularity and number of followers of all the artists with as few requests as possible
+    details = sp.get_several('artists', [artist_id for artist_id, _, _ in results.values()])
 
-        # number of followers
-        try:
-            followers_num.append(api_search['artists']['items'][0]['followers']['total'])
-        except IndexError:
-            logging.warning(
-                f"No result found in Spotify API for '{artist_name}' - 'number of followers'. added 0 instead")
-            followers_num.append(0)
+    artists = {}
+    for artist_name, (artist_id, popularity, followers) in results.items():
+        if artist_id in details:
+            popularity = details[artist_id]['popularity']
+            followers = details[artist_id]['followers']['total']
+        artists[artist_name] = (artist_id, popularity, followers)
 
-    return {"Spotify Artist Popularity": artist_popularity, "Number of Spotify Followers": followers_num}
+    return artists
 
 
-def scrape_spotify_api_albums(args, album_names, artist_names):
+def scrape_spotify_api_albums(args, album_names, artist_names, known_ids=None):
     """
-    Calls Spotify API for additional attributes
+    Calls Spotify API for additional attributes.
+    Albums without a known Spotify ID are searched concurrently, at most args.spotify_workers at a time, and then
+    number of tracks and markets of all the albums are refreshed in bulk with the multi-ID albums endpoint
     :param args: a Struct with all the input arguments of the py file
     :param album_names: a list of albums in the searched chart
     :param artist_names: a list of artists of the albums in the searched chart
-    :return: a dictionary with the data scraped from Spotify api
+    :param known_ids: a dictionary from (album name, artist name) to an already known Spotify ID
+    :return: a dictionary from (album name, artist name) to a tuple with the album's Spotify ID (None when it was
+    not found), number of tracks and a tuple of the markets it is available in. The number of tracks of a known ID
+    that Spotify did not return is None and its markets are empty, so the stored values are kept
     """
     logging.debug(f"scrape_spotify_api_albums() started")
 
-    # queries spotify api for album for number of tracks and available markets
-    num_of_tracks = []
-    markets = []
-    for album_name, artist_name in zip(album_names, artist_names):
-        if args.progress:
-            print(f"Calling Spotify API, searching for '{album_name} {artist_name}' in albums")
+    if known_ids is None:
+        known_ids = {}
 
-        # call spotify_search function
-        api_search = spotify_search(album_name + ' ' + (''.join(artist_name.split('&'))), 'album')
+    # queries spotify api for albums without a known ID
+    unique_albums = list(dict.fromkeys(zip(album_names, artist_names)))
+    albums_to_search = [album for album in unique_albums if album not in known_ids]
+    with ThreadPoolExecutor(max_workers=spotify_workers(args)) as executor:
+        searched = dict(zip(albums_to_search,
+                            executor.map(lambda album: search_spotify_album(args, *album), albums_to_search)))
+    results = {album: (known_ids[album], None, ()) if album in known_ids else searched[album]
+               for album in unique_albums}
 
-        # insert top search result on Spotify, inserts 0 if we got no results
-        # total tracks
-        try:
-            num_of_tracks.append(api_search['albums']['items'][0]['total_tracks'])
-        except (IndexError, TypeError):
-            logging.warning(
-                f"No result found in Spotify API for '{album_name} {artist_name}' - 'number of tracks'.added 0 instead")
-            num_of_tracks.append(0)
+    # refresh number of tracks and available markets of all the albums with as few requests as possible
+    details = sp.get_several('albums', [album_id for album_id, _, _ in results.values()])
 
-        # available markets
-        try:
-            markets.append(api_search['albums']['items'][0]['available_markets'])
-        except (IndexError, TypeError):
-            logging.warning(
-                f"No result found in Spotify API for '{album_name} {artist_name}' - 'markets'. added None instead")
-            markets.append(['None'])
+    albums = {}
+    for album, (album_id, tracks, album_markets) in results.items():
+        if album_id in details:
+            tracks = details[album_id]['total_tracks']
+            album_markets = details[album_id]['available_markets']
+        albums[album] = (album_id, tracks, tuple(album_markets))
 
-    return {"Number of Tracks": num_of_tracks, "Available Markets": markets}
+    return albums
 
 
-def scrape_album_links(soup, soup_num, pages_url, album_details_dict):
+def scrape_album_links(soup, page_url):
     """
     Receives each page soup object from main chart page and scrapes additional details from given url:
     Link to artist page, Link to image of album cover, Link to user review page, Link to critic review page,
     Link to page with additional details and album credits, Link to Amazon purchase page,
     Link to publisher's Metacritic page
     :param soup: an object with the page content
-    :param soup_num: an index of the current soup object within the list of objects
-    :param album_details_dict: a dictionary with information from all the albums' url pages
-    :param pages_url: a list with albums' url pages
+    :param page_url: a string with the link of the album page
+    :return: a dictionary from AlbumPage field to the scraped value
     """
     logging.debug(f"scrape_album_links() started")
 
-    # Scraping the link to the artist page
-    album_details_dict.setdefault('Link to Artist Page', []).append(
-        cfg.SITE_ADDRESS + soup.find('div', class_='product_artist').a['href'])
-    # Scraping the link to the publisher's Metacritic page
     publisher_html = soup.find('span', class_='data', itemprop='publisher')
-    album_details_dict.setdefault('Link to Publisher Page', []).append(
-        cfg.SITE_ADDRESS + publisher_html.a['href'].lstrip("['").rstrip("']"))
-    # Scraping the link to the image of the album cover
-    album_details_dict.setdefault('Album Cover Image', []).append(
-        soup.find('img', class_='product_image large_image')['src'])
-    # Scraping link to the user review page
-    album_details_dict.setdefault('Link to User Reviews', []).append(
-        cfg.SITE_ADDRESS + soup.find('li', class_='nav nav_user_reviews').span.span.a["href"])
-    # Scraping the link to page with more album details and album credits
-    album_details_dict.setdefault('Link to More Details and Album Credits', []).append(
-        cfg.SITE_ADDRESS + soup.find('li', class_="nav nav_details last_nav").span.span.a["href"])
-    # Scraping the link to the critic review page
-    album_details_dict.setdefault('Link to Critic Reviews', []).append(
-        cfg.SITE_ADDRESS + soup.find('li', class_="nav nav_critic_reviews").span.span.a["href"])
+    album_links = {
+        # Scraping the link to the artist page
+        'artist_link': cfg.SITE_ADDRESS + soup.find('div', class_='product_artist').a['href'],
+        # Scraping the link to the publisher's Metacritic page
+        'publisher_link': cfg.SITE_ADDRESS + publisher_html.a['href'].lstrip("['").rstrip("']"),
+        # Scraping the link to the image of the album cover
+        'cover_image': soup.find('img', class_='product_image large_image')['src'],
+        # Scraping link to the user review page
+        'user_reviews_link': cfg.SITE_ADDRESS + soup.find('li', class_='nav nav_user_reviews').span.span.a["href"],
+        # Scraping the link to page with more album details and album credits
+        'details_link': cfg.SITE_ADDRESS + soup.find('li', class_="nav nav_details last_nav").span.span.a["href"],
+        # Scraping the link to the critic review page
+        'critic_reviews_link': cfg.SITE_ADDRESS + soup.find('li', class_="nav nav_critic_reviews").span.span.a["href"]}
+
     # Scraping the link to the Amazon page to buy the album
     # If there is no Amazon link, add an empty cell
     buy_album_link = soup.find('td', class_="esite_img_wrapper")
     if buy_album_link:
-        album_details_dict.setdefault('Amazon Link', []).append(buy_album_link.a["href"])
+        album_links['amazon_link'] = buy_album_link.a["href"]
     else:
-        logging.warning(
-            f"There was no Amazon link found on {pages_url[soup_num]}. Added an empty cell instead.")
-        album_details_dict.setdefault('Amazon Link', []).append('')
+        logging.warning(f"There was no Amazon link found on {page_url}. Added an empty cell instead.")
+        album_links['amazon_link'] = ''
 
+    return album_links
 
-def scrape_album_extra_details(soup, soup_num, pages_url, album_details_dict):
+
+def scrape_album_extra_details(soup, page_url):
     """
     Receives each page url from main chart page and scrapes additional details from given url:
     Listed genres on album, Number of critic reviews, Number of user reviews,  Publisher name
-    Link to user review page, Link to page with additional details and album credits, Link to Amazon purchase page
     :param soup: an object with the page content
-    :param soup_num: an index of the current soup object within the list of objects
-    :param album_details_dict: a dictionary with information from all the albums' url pages
-    :param pages_url: a list with albums' url pages
+    :param page_url: a string with the link of the album page
+    :return: a dictionary from AlbumPage field to the scraped value
     """
     logging.debug(f"scrape_album_extra_details() started")
 
     # Scraping the publisher name
     publisher_html = soup.find('span', class_='data', itemprop='publisher')
-    album_details_dict.setdefault('Publisher', []).append(publisher_html.a.span.text.strip())
+    extra_details = {'publisher': publisher_html.a.span.text.strip()}
 
     # Scraping the genres listed on the album
     genres = soup.find('li', class_='summary_detail product_genre')
     if genres:
-        genres = [genre.text for genre in genres.findAll('span') if "Genre(s)" not in genre.text]
-        album_details_dict.setdefault('Album Genres', []).append(genres)
+        extra_details['genres'] = tuple(genre.text for genre in genres.findAll('span') if "Genre(s)" not in genre.text)
     else:
-        logging.warning(f"There is no genre define in the album's page{pages_url[soup_num]}")
-        album_details_dict.setdefault('Album Genres', []).append('')
+        logging.warning(f"There is no genre define in the album's page{page_url}")
+        extra_details['genres'] = ()
+
+    extra_details.update(scrape_review_counts(soup, page_url))
+    return extra_details
+
+
+def scrape_review_counts(soup, page_url):
+    """
+    Receives each page soup object from main chart page and scrapes the details that change between runs:
+    Number of critic reviews, Number of user reviews
+    :param soup: an object with the page content
+    :param page_url: a string with the link of the album page
+    :return: a dictionary from ReviewCounts field to the scraped value
+    """
+    logging.debug(f"scrape_review_counts() started")
 
     # Scraping number of critic reviews
-    album_details_dict.setdefault('No. of Critic Reviews', []).append(
-        soup.find('span', itemprop="reviewCount").text.strip())
+    review_counts = {'critic_reviews': ar.to_int(soup.find('span', itemprop="reviewCount").text)}
 
     # Scraping number of user reviews
     # If there is no number of user scores, add an empty cell
     try:
         user_score_html = soup.find('div', class_="userscore_wrap feature_userscore")
-        album_details_dict.setdefault('No. of User Reviews', []).append(
-            int(user_score_html.find('span', class_='count').a.text.rstrip(' Ratings')))
+        user_reviews = user_score_html.find('span', class_='count').a.text.rstrip(' Ratings')
+        review_counts['user_reviews'] = ar.to_int(user_reviews)
     except AttributeError:
-        logging.warning(
-            f"There was no number of user reviews found on {pages_url[soup_num]}. Added an empty cell instead.")
-        album_details_dict.setdefault('No. of User Reviews', []).append(0)
+        logging.warning(f"There was no number of user reviews found on {page_url}. Added an empty cell instead.")
+        review_counts['user_reviews'] = 0
+
+    return review_counts
+
+
+def stream_pages(pages_url, size, failures=None):
+    """
+    Requests the pages and yields them as soon as each one arrives, keeping up to size requests in flight
+    continuously instead of waiting for the slowest page of every batch
+    :param pages_url: a list of links to required web pages
+    :param size: an integer, the number of requests in flight at the same time
+    :param failures: a list, when given pages that were not requested successfully are recorded and added to it as
+    tuples of the page index and the reason, instead of stopping the program
+    :return: a generator of tuples with the index of the page within pages_url and its raw html bytes
+    """
+    logging.debug(f"stream_pages() started")
+
+    rs = (grequests.get(u, session=http.get_session(), timeout=cfg.HTTP_TIMEOUT) for u in pages_url)
+    for index, page in grequests.imap_enumerated(rs, size=size, exception_handler=lambda request, e: e):
+        if failures is not None and response_error(page) is not None:
+            record_failure(pages_url[index], response_error(page))
+            failures.append((index, response_error(page)))
+            continue
+
+        check_response(page, pages_url[index])
+        yield index, page.content
+
+
+def parse_album_page(content, page_url):
+    """
+    Parses the html of a single album page into a record of its details. The tree is decomposed as soon as the
+    details are extracted, so it is freed right away instead of waiting for the garbage collector to find its cycles.
+    It may run in a worker process, so it gets and returns only plain picklable objects
+    :param content: the raw html bytes of the album page
+    :param page_url: a string with the link of the album page
+    :returns an AlbumPage with the details of the album page
+    """
+    soup = make_soup(content)
+    try:
+        return ar.AlbumPage(**scrape_album_extra_details(soup, page_url), **scrape_album_links(soup, page_url))
+    finally:
+        soup.decompose()
+
+
+def parse_review_counts(content, page_url):
+    """
+    Parses only the review counts of a single album page, the details that change between runs.
+    It may run in a worker process, so it gets and returns only plain picklable objects
+    :param content: the raw html bytes of the album page
+    :param page_url: a string with the link of the album page
+    :returns a ReviewCounts with the review counts of the album page
+    """
+    soup = make_soup(content, parse_only=REVIEW_COUNTS_STRAINER)
+    try:
+        return ar.ReviewCounts(**scrape_review_counts(soup, page_url))
+    finally:
+        soup.decompose()
+
+
+# Pools of parse worker processes by their number of workers, started once and shared by all the scrape_album_page()
+# calls of the run
+_parse_pools = {}
+
+
+def get_parse_pool(parse_workers):
+    """
+    Returns the pool of parse_workers worker processes, and starts it on the first call.
+    grequests monkey-patches the process with gevent, and a forked worker inherits the patched modules and blocks
+    forever (gevent LoopExit), so the workers are started as fresh interpreters
+    :param parse_workers: the number of worker processes, greater than 0
+    :return: a ProcessPoolExecutor
+    """
+    if parse_workers not in _parse_pools:
+        _parse_pools[parse_workers] = ProcessPoolExecutor(max_workers=parse_workers,
+                                                          mp_context=multiprocessing.get_context('spawn'))
+    return _parse_pools[parse_workers]
+
+
+def shutdown_parse_pools():
+    """
+    Stops the worker processes of all the parse pools
+    """
+    for executor in _parse_pools.values():
+        executor.shutdown(cancel_futures=True)
+    _parse_pools.clear()
+
+
+atexit.register(shutdown_parse_pools)
 
 
-def scrape_album_page(args, pages_url):
+def scrape_album_page(args, pages_url, *, parse_page=parse_album_page):
     """
     Receives each page url from main chart page and scrapes additional details from given url:
     Link to artist page, Publisher name, Link to publisher's Metacritic page, Link to image of album cover,
     Listed genres on album, Number of critic reviews, Link to critic review page, Number of user reviews,
-    Link to user review page, Link to page with additional details and album credits, Link to Amazon purchase page
+    Link to user review page, Link to page with additional details and album credits, Link to Amazon purchase page.
+    Up to args.batch pages are requested at the same time, and every page is parsed as soon as it arrives, on the
+    main thread or, when args.parse_workers is greater than 0, in a pool of worker processes.
+    A page that can't be requested or parsed is recorded in cfg.FAILED_PAGES_FILE and gets missing details (see
+    album_record.missing()), and only if none of the pages could be scraped the program stops
     :param args: a Struct with all the input arguments of the py file
     :param pages_url: a list with albums' url pages
-    :returns a dictionary with information from all the albums' url pages
+    :param parse_page: the function that parses every page, parse_album_page() or parse_review_counts()
+    :returns a dictionary from album page url to the AlbumPage (or ReviewCounts) of the page
     """
     logging.debug(f"scrape_album_page() started")
 
-    # According to the configuration, we create batch size
-    if args.batch > 0:
-        logging.debug(f"According to the configuration, we create batch size")
-        pages_url_batch = [pages_url[i:i + args.batch] for i in range(0, len(pages_url), args.batch)]
-    else:
+    # Test input validation
+    if args.batch <= 0:
         logging.critical(f"Batch size is {args.batch} but it must be greater than 0. Exiting program.")
         raise ValueError(f'Batch size is {args.batch} but it must be greater than 0')
+    parse_workers = getattr(args, 'parse_workers', 0)
+    if parse_workers < 0:
+        logging.critical(f"Number of parse workers is {parse_workers} but it can't be negative. Exiting program.")
+        raise ValueError(f"Number of parse workers is {parse_workers} but it can't be negative")
+    if not isinstance(pages_url, Sequence):
+        logging.critical(f"pages_url should be a list and not {type(pages_url)}. Exiting program.")
+        raise TypeError(f'pages_url should be a list and not {type(pages_url)}')
+
+    # The pages are parsed out of order, so each page's record is kept apart until all the pages are parsed
+    pages_details = [None] * len(pages_url)
+    parsed_pages = 0
+
+    failures = []
+
+    executor = get_parse_pool(parse_workers) if parse_workers > 0 else None
+    futures = {}
+    try:
+        # iterate over urls found on main page
+        for page_num, content in stream_pages(pages_url, args.batch, failures):
+
+            # Prints url list when the flag args.url is true
+            if args.url:
+                print(pages_url[page_num])
+
+            if executor is not None:
+                futures[executor.submit(parse_page, content, pages_url[page_num])] = page_num
+                continue
+
+            try:
+                pages_details[page_num] = parse_page(content, pages_url[page_num])
+            except (AttributeError, TypeError, KeyError) as e:
+                record_failure(pages_url[page_num], f'Not an album page: {e}')
+                failures.append((page_num, e))
+            parsed_pages += 1
+
+            # Prints Scraping Progress when the flag args.progress is true
+            if args.progress:
+                print(f'Scraping Progress: {round(100 * parsed_pages / len(pages_url), 2)}%')
+
+        for future in as_completed(futures):
+            try:
+                pages_details[futures[future]] = future.result()
+            except (AttributeError, TypeError, KeyError) as e:
+                record_failure(pages_url[futures[future]], f'Not an album page: {e}')
+                failures.append((futures[future], e))
+            parsed_pages += 1
+
+            # Prints Scraping Progress when the flag args.progress is true
+            if args.progress:
+                print(f'Scraping Progress: {round(100 * parsed_pages / len(pages_url), 2)}%')
+    except BrokenProcessPool:
+        # a pool whose worker died can't take new pages, so the next call starts a new one
+        _parse_pools.pop(parse_workers, None)
+        executor.shutdown(cancel_futures=True)
+        raise
+    finally:
+        # the pool is kept for the next call, without the pages of this call that were not parsed yet
+        for future in futures:
+            future.cancel()
+
+    if pages_url and len(failures) == len(pages_url):
+        logging.critical(f"None of the {len(pages_url)} album pages could be scraped. Exiting program.")
+        raise AttributeError(f'None of the {len(pages_url)} album pages could be scraped')
+
+    # Pages that could not be scraped get missing details, so the details stored for them are not overwritten
+    records = [record for record in pages_details if record is not None]
+    if not records:
+        return {}
+    record_type = type(records[0])
+    return {page_url: ar.missing(record_type) if record is None else record
+            for page_url, record in zip(pages_url, pages_details)}
+
+
+def scrape_album_pages_incremental(args, login_info, pages_url):
+    """
+    Scrapes the album pages like scrape_album_page(), but albums whose details are already stored in the database
+    and are younger than cfg.INCREMENTAL_MAX_AGE_DAYS days take their details from the database, and only their
+    review counts are parsed from their pages
+    :param args: a Struct with all the input arguments of the py file
+    :param login_info: a dictionary with the user's login information
+    :param pages_url: a list with albums' url pages
+    :returns a dictionary from album page url to the AlbumPage of the page. The scraped_at of the pages that were
+    scraped in full in this run is None. Albums with stored details whose page could not be scraped keep the stored
+    details and have no review counts
+    """
+    logging.debug(f"scrape_album_pages_incremental() started")
+
+    stored_albums = ta.get_stored_albums(login_info, pages_url, cfg.INCREMENTAL_MAX_AGE_DAYS)
+    new_pages = [page_url for page_url in pages_url if page_url not in stored_albums]
+    stored_pages = [page_url for page_url in pages_url if page_url in stored_albums]
+    logging.info(f"Incremental scraping: {len(new_pages)} new or stale album pages, "
+                 f"{len(stored_pages)} album pages with stored details")
+    print(f"Incremental scraping: {len(new_pages)} new or stale album pages, "
+          f"{len(stored_pages)} album pages with stored details")
+
+    album_pages = scrape_album_page(args, new_pages) if new_pages else {}
+    if stored_pages:
+        # the stored details are still valid when none of the pages could be scraped, only the review counts are missing
+        try:
+            review_counts = scrape_album_page(args, stored_pages, parse_page=parse_review_counts)
+        except AttributeError:
+            logging.warning(f"None of the {len(stored_pages)} album pages with stored details could be scraped. "
+                            f"Their stored details are kept without review counts.")
+            review_counts = {page_url: ar.missing(ar.ReviewCounts) for page_url in stored_pages}
+        album_pages.update({page_url: stored_albums[page_url]._replace(**review_counts[page_url]._asdict())
+                            for page_url in stored_pages})
 
-    # Build the dictionary of details we're scraping from each individual album page
-    album_details_dict = {}
+    return {page_url: album_pages[page_url] for page_url in pages_url}
 
-    # iterate over urls found on main page
-    current_progress = 0
-    for pages_url in pages_url_batch:
 
-        # Getting pages html
-        soup_list = use_grequests(pages_url)
+def enrich_chunk(args, login_info, records, memos):
+    """
+    Adds the Spotify details and the album page details to the albums of a chunk. Albums, artists and album pages
+    are scraped once per run: keys scraped for an earlier chunk are taken from the memos. Every memo keeps the last
+    cfg.PIPELINE_MEMO_SIZE keys, so a long sweep doesn't hold the results of all its albums
+    :param args: a Struct with all the input arguments of the py file
+    :param login_info: a dictionary with the user's login information
+    :param records: a list with the AlbumRecords of the chunk, updated in place
+    :param memos: a dictionary with the results of the run so far for the 'albums', 'artists' and 'pages', as
+    returned by scrape_spotify_api_albums(), scrape_spotify_api_artists() and scrape_album_page()
+    :return: a dictionary with the number of 'albums', 'artists' and 'pages' that were scraped for the chunk
+    """
+    unique_albums = [album for album in dict.fromkeys((record.album, record.artist) for record in records)
+                     if album not in memos['albums']]
+    unique_artists = [artist for artist in dict.fromkeys(record.artist for record in records)
+                      if artist not in memos['artists']]
+
+    # Spotify IDs stored in the database are not searched again
+    if unique_albums or unique_artists:
+        known_artist_ids, known_album_ids = ta.get_spotify_ids(
+            login_info, [album for album, _ in unique_albums],
+            list(dict.fromkeys(unique_artists + [artist for _, artist in unique_albums])))
+        if unique_albums:
+            memos['albums'].update(scrape_spotify_api_albums(args, [album for album, _ in unique_albums],
+                                                             [artist for _, artist in unique_albums], known_album_ids))
+        if unique_artists:
+            memos['artists'].update(scrape_spotify_api_artists(args, unique_artists, known_artist_ids))
+
+    # Individual album pages
+    unique_pages = [page_url for page_url in dict.fromkeys(record.album_link for record in records)
+                    if page_url not in memos['pages']]
+    if unique_pages:
+        if getattr(args, 'incremental', False):
+            memos['pages'].update(scrape_album_pages_incremental(args, login_info, unique_pages))
+        else:
+            memos['pages'].update(scrape_album_page(args, unique_pages))
 
-        # Prints Scraping Progress when the flag args.progress is true
-        if len(pages_url_batch) > 0 and args.progress:
-            total_progress = len(pages_url_batch) * args.batch
-            current_progress += len(pages_url)
-            print(f'Scraping Progress: {round(100 * current_progress / total_progress, 2)}%')
+    for record in records:
+        record.set_spotify_album(*memos['albums'][(record.album, record.artist)])
+        record.set_spotify_artist(*memos['artists'][record.artist])
+        record.set_album_page(memos['pages'][record.album_link])
 
-        count_batch_url = 0
-        for soup_num, soup in enumerate(soup_list):
+    # the keys that were scraped first are dropped first
+    for memo in memos.values():
+        for key in list(itertools.islice(memo, max(len(memo) - cfg.PIPELINE_MEMO_SIZE, 0))):
+            del memo[key]
 
-            # Prints url list when the flag args.url is true
-            if args.url:
-                print(pages_url[count_batch_url])
-                count_batch_url += 1
+    return {'albums': len(unique_albums), 'artists': len(unique_artists), 'pages': len(unique_pages)}
 
-            # update the dictionary album_details_dict with data from the album page
-            scrape_album_extra_details(soup, soup_num, pages_url, album_details_dict)
-            scrape_album_links(soup, soup_num, pages_url, album_details_dict)
 
-    if args.progress:
-        print("Scraping Progress: 100.0%")
+def print_summary(albums_num, scraped_num):
+    """
+    Prints and logs a summary of the scraping run
+    :param albums_num: an integer, the number of scraped albums of all the charts
+    :param scraped_num: a dictionary with the number of unique 'albums', 'artists' and 'pages' scraped in the run
+    """
+    unique_artists_num = scraped_num['artists']
+    dedup_ratio = albums_num / unique_artists_num if unique_artists_num else 1.0
+    cache_stats = sc.cache_stats()
+    http_cache_stats = hc.cache_stats()
+    connection_stats = http.connection_stats()
+
+    summary = f"Run summary: {albums_num} albums, {scraped_num['albums']} unique albums, " \
+              f"{unique_artists_num} unique artists (artist dedup ratio {dedup_ratio:.2f}), " \
+              f"{scraped_num['pages']} album pages ({len(failed_pages)} failed), " \
+              f"Spotify cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, " \
+              f"HTTP: {connection_stats['requests']} requests, {connection_stats['opened']} connections opened, " \
+              f"{connection_stats['reused']} reused, " \
+              f"HTTP cache: {http_cache_stats['hits']} hits, {http_cache_stats['revalidated']} revalidated, " \
+              f"{http_cache_stats['misses']} misses, {http_cache_stats['bytes_saved'] / 1024 ** 2:.1f} MB saved"
+    logging.info(summary)
+    print(summary)
+
+
+def parse_years(years_range):
+    """
+    Parses the --years argument
+    :param years_range: a string with a single year ('2021') or an inclusive range of years ('2010-2022')
+    :return: a list of strings with the years
+    """
+    first_year, _, last_year = years_range.partition('-')
+    try:
+        years = [str(year) for year in range(int(first_year), int(last_year or first_year) + 1)]
+    except ValueError:
+        logging.critical(f"Years range {years_range} is not valid. Exiting program.")
+        raise ValueError(f'Years range {years_range} is not valid, use the format 2010-2022')
 
-    return album_details_dict
+    if not years or any(year not in cfg.YEAR_RELEASE for year in years):
+        logging.critical(f"Years range {years_range} is not valid. Exiting program.")
+        raise ValueError(f'Years must be between {min(cfg.YEAR_RELEASE.keys())} and {max(cfg.YEAR_RELEASE.keys())}')
+    return years
 
 
-def scrape(args, login_info):
+def plan_charts(args):
     """
-    Takes given chart link and scrape relevant information of the albums
+    Lists the charts to scrape. Without --all or --years it is the single chart chosen by --filter, --year and
+    --sort. In a sweep it is the chart of every year in range by every sort method (or by --sort, when given)
     :param args: a Struct with all the input arguments of the py file
-    :param login_info: a dictionary with the user's login information
+    :return: a list of tuples with the sort method, filter method and year of every chart
     """
-    logging.debug(f"scrape() started")
+    if not args.all and args.years is None:
+        return [(args.sort, args.filter, args.year)]
 
-    # Create the chart url
-    chart_url = cfg.SITE_ADDRESS + cfg.SORT_BY[args.sort] + cfg.FILTER_BY[args.filter] + cfg.YEAR_RELEASE[args.year]
-    print(f'main url: {chart_url}')
-    # Getting chart html
-    soup = use_grequests([chart_url])[0]
+    years = list(cfg.YEAR_RELEASE.keys()) if args.all else parse_years(args.years)
+    sorts = [args.sort] if args.sort else list(cfg.SORT_BY.keys())
+    filter_by = args.filter if args.filter else 'year'
+    return [(sort, filter_by, year) for year in years for sort in sorts]
 
-    # Scrape albums' information from chart page
-    albums_dict = scrape_albums_details(args, soup)
-    albums_dict.update(scrape_albums_scores(args, soup, len(albums_dict["Artist"])))
 
-    # update dictionary with results from spotify api
-    albums_dict.update(scrape_spotify_api_albums(args, albums_dict["Album"], albums_dict["Artist"]))
-    albums_dict.update(scrape_spotify_api_artists(args, albums_dict["Artist"]))
-
-    # Update dictionary with results of individual album page scraping
-    albums_dict.update(scrape_album_page(args, albums_dict["Link to Album Page"]))
-
-    logging.info(f"Scraping information from {chart_url} and all the albums urls was done successfully")
+def chart_url(sort, filter_by, year):
+    """
+    Builds the url of the first page of a chart
+    :param sort: a string with the sorting method, one of cfg.SORT_BY
+    :param filter_by: a string with the filter method, one of cfg.FILTER_BY
+    :param year: a string with the year, one of cfg.YEAR_RELEASE
+    :return: a string with the chart's url
+    """
+    return cfg.SITE_ADDRESS + cfg.SORT_BY[sort] + cfg.FILTER_BY[filter_by] + cfg.YEAR_RELEASE[year]
 
-    # Turn dictionary with all details into DataFrame (can be removed if pandas is forbidden)
-    albums_df = pd.DataFrame(albums_dict)
 
-    # Create csv file from DataFrame (for better organization)
-    if args.save:
-        save_csv(args, albums_df)
+def scrape(args, login_info):
+    """
+    Takes given chart link, or all the charts of a sweep, and scrape relevant information of the albums.
+    The albums flow through the pipeline in chunks of about cfg.PIPELINE_CHUNK_SIZE albums: chart pages, Spotify,
+    album pages and then the database, so memory use does not grow with the number of charts and the rows of every
+    chunk are committed while the rest of the sweep is still scraped.
+    All the charts share one pool of requests, albums, artists and album pages that appear several times are
+    scraped once, and everything is written to the database through one connection
+    :param args: a Struct with all the input arguments of the py file
+    :param login_info: a dictionary with the user's login information
+    """
+    logging.debug(f"scrape() started")
 
-    # Adding data to Database
-    ta.add_data(albums_df, login_info, args.filter, args.year, args.sort)
+    # Create the charts urls
+    charts = plan_charts(args)
+    charts_url = [chart_url(*chart) for chart in charts]
+    for url in charts_url:
+        print(f'main url: {url}')
+
+    # all the chunks of a chart share the same scrape time in chart_history
+    scrape_datetime = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    memos = {name: {} for name in ['albums', 'artists', 'pages']}
+    scraped_num = {name: 0 for name in memos}
+    chart_rows = [0] * len(charts)
+    albums_num = 0
+    db_stats = {'rows': 0, 'seconds': 0.0}
+
+    with ta.pooled_connection(login_info) as connection:
+        for chunk in iter_chart_chunks(args, charts_url):
+            # All the chunk's albums are enriched together, with as few requests as possible
+            chunk_scraped = enrich_chunk(args, login_info, [record for records in chunk.values() for record in records],
+                                         memos)
+            scraped_num = {name: scraped_num[name] + chunk_scraped[name] for name in scraped_num}
+
+            for chart_num, records in chunk.items():
+                sort, filter_by, year = charts[chart_num]
+
+                # Create csv file from DataFrame (for better organization), or a typed columnar file
+                if args.save and args.format == 'csv':
+                    albums_df = pd.DataFrame(ar.to_columns(records),
+                                             index=range(chart_rows[chart_num], chart_rows[chart_num] + len(records)))
+                    save_csv(argparse.Namespace(**{**vars(args), 'sort': sort, 'filter': filter_by, 'year': year}),
+                             albums_df, append=chart_rows[chart_num] > 0)
+                elif args.save:
+                    ce.save_chart(records, args.format, sort, filter_by, year, scrape_datetime, chart_rows[chart_num])
+                chart_rows[chart_num] += len(records)
+
+                # Adding data to Database
+                db_start = time.perf_counter()
+                db_stats['rows'] += ta.add_chart_data(connection, records, filter_by, year, sort, scrape_datetime)
+                db_stats['seconds'] += time.perf_counter() - db_start
+
+            chunk_size = sum(len(records) for records in chunk.values())
+            albums_num += chunk_size
+            logging.info(f"Chunk of {chunk_size} albums was scraped and written. {albums_num} albums so far.")
+
+    logging.info(f"Scraping information from {len(charts_url)} charts and all the albums urls was done successfully")
+    print_summary(albums_num, scraped_num)
+    print(f"Database: {db_stats['rows']} albums written in {db_stats['seconds']:.2f} seconds "
+          f"({db_stats['rows'] / db_stats['seconds'] if db_stats['seconds'] else 0:.0f} rows/sec), "
+          f"{ta.pool_stats()['connects']} connections opened, {ta.pool_stats()['reuses']} reused")
 
 
 def parse_args(args_string_list):
@@ -498,19 +1194,53 @@ def parse_args(args_string_list):
 
     settings = subparser.add_parser('settings', help=f'Change Settings. "settings -h" for more information')
     settings.add_argument('-i', '--init', help=f'Initiates the database', action='store_true')
+    settings.add_argument('-U', '--upgrade', help=f'Upgrades the schema of a database created by an older version',
+                          action='store_true')
 
     update = subparser.add_parser('update', help=f'Update database. "update -h" for more information')
-    update.add_argument('-f', '--filter', type=str, required=True, help=f'Filter albums: {list(cfg.FILTER_BY.keys())}')
-    update.add_argument('-y', '--year', type=str, required=True,
+    update.add_argument('-f', '--filter', type=str, help=f'Filter albums: {list(cfg.FILTER_BY.keys())}')
+    update.add_argument('-y', '--year', type=str,
                         help=f'Albums year release: {min(cfg.YEAR_RELEASE.keys())} to {max(cfg.YEAR_RELEASE.keys())}')
-    update.add_argument('-s', '--sort', type=str, required=True, help=f'Sort albums: {list(cfg.SORT_BY.keys())}')
-    update.add_argument('-b', '--batch', type=int, help='grequests batch size', default=1)
+    update.add_argument('-s', '--sort', type=str, help=f'Sort albums: {list(cfg.SORT_BY.keys())}')
+    update.add_argument('-a', '--all', action='store_true',
+                        help='Sweep the charts of all the years by all the sort methods (or by --sort)')
+    update.add_argument('-Y', '--years', type=str,
+                        help='Sweep the charts of a range of years, e.g. 2010-2022, by all the sort methods '
+                             '(or by --sort)')
+    update.add_argument('-b', '--batch', type=int, help='Number of album pages requested at the same time',
+                        default=cfg.PAGE_WORKERS)
     update.add_argument('-m', '--max', type=int, help="Maximum number of albums to scrape")
+    update.add_argument('-P', '--parse-workers', type=int, default=0,
+                        help='Number of processes parsing album pages (0 parses on the main thread)')
+    update.add_argument('-w', '--spotify-workers', type=int, default=cfg.SPOTIFY_WORKERS,
+                        help='Number of Spotify API requests in flight at the same time')
+    update.add_argument('-I', '--incremental', action='store_true',
+                        help=f'Scrape in full only the album pages not stored in the database (or stored more than '
+                             f'{cfg.INCREMENTAL_MAX_AGE_DAYS} days ago), and only the review counts of the rest')
     update.add_argument('-p', '--progress', help=f'Shows scraping progress', action='store_true')
     update.add_argument('-u', '--url', help=f'Shows scraped urls', action='store_true')
     update.add_argument('-S', '--save', help=f'Saves csv file with the data', action='store_true')
+    update.add_argument('-F', '--format', type=str, choices=cfg.EXPORT_FORMATS,
+                        help='Saves the data in this format (implies --save): csv (default), or parquet or arrow '
+                             'files partitioned by sort/filter/year/scrape_date (requires pyarrow)')
+
+    args = parser.parse_args(args_string_list)
+
+    # --filter, --year and --sort are required unless sweeping several charts
+    if args.command == 'update' and not args.all and args.years is None:
+        missing = [option for option, value in (('--filter', args.filter), ('--year', args.year), ('--sort', args.sort))
+                   if value is None]
+        if missing:
+            update.error(f"the following arguments are required: {', '.join(missing)} (or --all / --years)")
+
+    # --format implies --save, and the columnar formats can only be saved when pyarrow is installed
+    if args.command == 'update':
+        args.save = args.save or args.format is not None
+        args.format = args.format or 'csv'
+        if args.format != 'csv' and not ce.ARROW_AVAILABLE:
+            update.error(f"--format {args.format} requires pyarrow, install it with: pip install pyarrow")
 
-    return parser.parse_args(args_string_list)
+    return args
 
 
 def main():
@@ -547,6 +1277,9 @@ def main():
     if args.command == 'settings':
         if args.init:
             ta.create_top_albums_db(login_info)
+        if args.upgrade:
+            upgraded = ta.upgrade_top_albums_db(login_info)
+            print(f"Database schema upgraded with {len(upgraded)} changes.")
         return
 
     # Run scrape() by user's criteria
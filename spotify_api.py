@@ -0,0 +1,243 @@
+"""
+File that contains functions related to authenticating against and querying Spotify's API.
+The client-credentials access token is requested lazily on the first Spotify call, cached on disk together with
+its expiry time and refreshed ahead of expiry, so every process on the machine shares the same token.
+Authors: Yair Vagshal and Doron Reiffman
+"""
+import config as cfg
+import http_client as http
+import requests
+import logging
+import json
+import os
+import time
+import threading
+from urllib.parse import urlencode
+
+# Logging definition
+if cfg.LOGFILE_DEBUG:
+    logging.basicConfig(filename=cfg.LOGFILE_NAME, format="%(asctime)s %(levelname)s: %(message)s",
+                        level=logging.DEBUG)
+else:
+    logging.basicConfig(filename=cfg.LOGFILE_NAME, format="%(asctime)s %(levelname)s: %(message)s",
+                        level=logging.INFO)
+
+# The token currently used by this process, and a lock so only one thread refreshes it at a time
+_token = {}
+_token_lock = threading.Lock()
+
+
+def token_is_fresh(token):
+    """
+    Checks whether a cached token can still be used for at least cfg.SPOTIFY_TOKEN_MARGIN seconds
+    :param token: a dictionary with 'access_token' and 'expires_at' keys (may be empty)
+    :return: True if the token is usable, otherwise False
+    """
+    return bool(token) and token.get('expires_at', 0) - cfg.SPOTIFY_TOKEN_MARGIN > time.time()
+
+
+def read_token_file():
+    """
+    Reads the token shared between processes from cfg.SPOTIFY_TOKEN_FILE
+    :return: a dictionary with the cached token, or an empty dictionary if there is no valid cache file
+    """
+    try:
+        with open(cfg.SPOTIFY_TOKEN_FILE, "r") as openfile:
+            token = json.load(openfile)
+    except (OSError, ValueError):
+        return {}
+
+    if not isinstance(token, dict) or 'access_token' not in token or 'expires_at' not in token:
+        return {}
+    return token
+
+
+def write_token_file(token):
+    """
+    Writes the token to cfg.SPOTIFY_TOKEN_FILE. The file is replaced atomically so other processes never read a
+    partially written token
+    :param token: a dictionary with 'access_token' and 'expires_at' keys
+    """
+    folder = os.path.dirname(cfg.SPOTIFY_TOKEN_FILE)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+
+    temp_name = f"{cfg.SPOTIFY_TOKEN_FILE}.{os.getpid()}.tmp"
+    with open(temp_name, "w") as outfile:
+        json.dump(token, outfile)
+    os.replace(temp_name, cfg.SPOTIFY_TOKEN_FILE)
+
+
+def acquire_token_file_lock():
+    """
+    Takes the lock file that makes sure only one process requests a new token at a time.
+    A lock file older than cfg.SPOTIFY_TOKEN_LOCK_TIMEOUT seconds is considered abandoned and is removed
+    :return: True if the lock was taken, False if waiting for it timed out
+    """
+    lock_name = cfg.SPOTIFY_TOKEN_FILE + '.lock'
+    folder = os.path.dirname(lock_name)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+
+    deadline = time.time() + cfg.SPOTIFY_TOKEN_LOCK_TIMEOUT
+    while time.time() < deadline:
+        try:
+            os.close(os.open(lock_name, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_name) > cfg.SPOTIFY_TOKEN_LOCK_TIMEOUT:
+                    logging.warning(f"Removing abandoned Spotify token lock file {lock_name}")
+                    os.remove(lock_name)
+                    continue
+            except OSError:
+                continue
+            time.sleep(0.1)
+
+    logging.warning(f"Timed out waiting for Spotify token lock file {lock_name}")
+    return False
+
+
+def release_token_file_lock():
+    """
+    Removes the lock file taken by acquire_token_file_lock()
+    """
+    try:
+        os.remove(cfg.SPOTIFY_TOKEN_FILE + '.lock')
+    except OSError:
+        pass
+
+
+def request_token():
+    """
+    Requests a new client-credentials access token from Spotify's accounts service
+    :return: a dictionary with the access token and the epoch time it expires at
+    """
+    logging.debug(f"request_token() started")
+
+    response = http.get_session().post(cfg.AUTH_URL, {
+        'grant_type': 'client_credentials',
+        'client_id': cfg.CLIENT_ID,
+        'client_secret': cfg.CLIENT_SECRET}, timeout=cfg.SPOTIFY_TIMEOUT)
+    response.raise_for_status()
+    response_data = response.json()
+
+    logging.info(f"A new Spotify access token was requested successfully.")
+    return {'access_token': response_data['access_token'],
+            'expires_at': time.time() + int(response_data.get('expires_in', cfg.SPOTIFY_TOKEN_DEFAULT_TTL))}
+
+
+def get_access_token(force_refresh=False):
+    """
+    Returns a valid Spotify access token. The token is taken from memory, then from the shared cache file,
+    and only if both are missing or about to expire a new token is requested from Spotify
+    :param force_refresh: a boolean, when true the cached token is ignored (e.g. after Spotify answered 401)
+    :return: a string with the access token
+    """
+    global _token
+
+    if not force_refresh and token_is_fresh(_token):
+        return _token['access_token']
+
+    with _token_lock:
+        # Another thread may have refreshed the token while we were waiting for the lock
+        if not force_refresh and token_is_fresh(_token):
+            return _token['access_token']
+
+        token = {} if force_refresh else read_token_file()
+        if not token_is_fresh(token):
+            locked = acquire_token_file_lock()
+            try:
+                # Another process may have refreshed the token while we were waiting for the lock file
+                shared_token = read_token_file()
+                if token_is_fresh(shared_token) and shared_token.get('access_token') != _token.get('access_token'):
+                    token = shared_token
+                else:
+                    token = request_token()
+                    write_token_file(token)
+            finally:
+                if locked:
+                    release_token_file_lock()
+
+        _token = token
+
+    return _token['access_token']
+
+
+def invalidate_token():
+    """
+    Forgets the token held in memory, so the next call to get_access_token() checks the cache file again
+    """
+    global _token
+    with _token_lock:
+        _token = {}
+
+
+def get_headers(force_refresh=False):
+    """
+    Builds the authorization headers required by Spotify's API
+    :param force_refresh: a boolean, when true a new access token is requested
+    :return: a dictionary with the request headers
+    """
+    return {'Authorization': 'Bearer {token}'.format(token=get_access_token(force_refresh))}
+
+
+def spotify_get(url):
+    """
+    Sends an authorized GET request to Spotify's API.
+    A rejected token (401) is refreshed once. Rate limited requests (429) are retried by the HTTP client, after the
+    number of seconds Spotify asks for in the Retry-After header and through the rate limiter of the host
+    :param url: a string with the full url of the API endpoint
+    :return: the response from the website
+    """
+    logging.debug(f"spotify_get() started")
+
+    response = http.get_session().get(url, headers=get_headers(), timeout=cfg.SPOTIFY_TIMEOUT)
+
+    # the cached token was revoked or expired early, request a new one and try again once
+    if response.status_code == 401:
+        logging.info(f"Spotify access token was rejected. Requesting a new one.")
+        response = http.get_session().get(url, headers=get_headers(force_refresh=True), timeout=cfg.SPOTIFY_TIMEOUT)
+
+    if response.status_code == 429:
+        logging.warning(f"Spotify API rate limit reached. {url} was retried {cfg.HTTP_RETRIES} times.")
+
+    return response
+
+
+def get_several(item_type, spotify_ids):
+    """
+    Fetches full Spotify objects of known IDs with the multi-ID endpoints (/v1/artists?ids=, /v1/albums?ids=),
+    cfg.SPOTIFY_BATCH_SIZE[item_type] IDs per request
+    :param item_type: a string, 'artists' or 'albums'
+    :param spotify_ids: a list of Spotify IDs (duplicates and empty IDs are ignored)
+    :return: a dictionary from Spotify ID to the object returned by Spotify
+    """
+    logging.debug(f"get_several() started")
+
+    if item_type not in cfg.SPOTIFY_BATCH_SIZE:
+        raise ValueError(f"The item type must be one of : {list(cfg.SPOTIFY_BATCH_SIZE.keys())}")
+
+    batch_size = cfg.SPOTIFY_BATCH_SIZE[item_type]
+    unique_ids = [spotify_id for spotify_id in dict.fromkeys(spotify_ids) if spotify_id]
+
+    items = {}
+    for i in range(0, len(unique_ids), batch_size):
+        lookup_url = f"{cfg.BASE_URL}/{item_type}?{urlencode({'ids': ','.join(unique_ids[i:i + batch_size])})}"
+        try:
+            response = spotify_get(lookup_url)
+        except requests.RequestException as e:
+            logging.warning(f"Fetching {item_type} from Spotify was unsuccessful. \n {e}")
+            continue
+
+        if not cfg.REQ_STATUS_LOWER <= response.status_code <= cfg.REQ_STATUS_UPPER:
+            logging.warning(f"Could not fetch {item_type} from Spotify. Status code {response.status_code}.")
+            continue
+
+        # Spotify returns null in place of IDs it doesn't know
+        for item in response.json().get(item_type, []):
+            if item:
+                items[item['id']] = item
+
+    logging.info(f"Fetched {len(items)} {item_type} from Spotify in {-(-len(unique_ids) // batch_size)} requests.")
+    return items
@@ -0,0 +1,156 @@
+"""
+File that contains functions related to the persistent cache of Spotify API search results.
+Results are stored in a SQLite file keyed by the search type and the normalized query, each entry expires after
+cfg.SPOTIFY_CACHE_TTL seconds and the least recently used entries are evicted once the cache grows beyond
+cfg.SPOTIFY_CACHE_MAX_ENTRIES
+Authors: Yair Vagshal and Doron Reiffman
+"""
+import config as cfg
+import logging
+import sqlite3
+import threading
+import unicodedata
+import json
+import time
+import os
+
+# Logging definition
+if cfg.LOGFILE_DEBUG:
+    logging.basicConfig(filename=cfg.LOGFILE_NAME, format="%(asctime)s %(levelname)s: %(message)s",
+                        level=logging.DEBUG)
+else:
+    logging.basicConfig(filename=cfg.LOGFILE_NAME, format="%(asctime)s %(levelname)s: %(message)s",
+                        level=logging.INFO)
+
+# sqlite3 connections can't be shared between threads, so every thread opens its own connection
+_local = threading.local()
+
+# hit/miss counters of the current process
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def normalize_query(query):
+    """
+    Normalizes a free text query so different spellings of the same name share one cache entry
+    :param query: a string of the free text search
+    :return: the query in NFKC form, case folded and with collapsed whitespace
+    """
+    return ' '.join(unicodedata.normalize('NFKC', query).casefold().split())
+
+
+def get_connection():
+    """
+    Returns this thread's connection to the cache file, creating the file and the table on first use
+    :return: a sqlite3 connection
+    """
+    connection = getattr(_local, 'connection', None)
+    if connection is not None and getattr(_local, 'file_name', None) == cfg.SPOTIFY_CACHE_FILE:
+        return connection
+
+    folder = os.path.dirname(cfg.SPOTIFY_CACHE_FILE)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+
+    connection = sqlite3.connect(cfg.SPOTIFY_CACHE_FILE, timeout=cfg.SPOTIFY_CACHE_TIMEOUT)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("CREATE TABLE IF NOT EXISTS search_cache (\
+                            search_type TEXT,\
+                            query TEXT,\
+                            response TEXT,\
+                            created_at REAL,\
+                            last_used REAL,\
+                            PRIMARY KEY (search_type, query)\
+                            )")
+    connection.execute("CREATE INDEX IF NOT EXISTS search_cache_last_used ON search_cache (last_used)")
+    connection.commit()
+
+    _local.connection = connection
+    _local.file_name = cfg.SPOTIFY_CACHE_FILE
+    return connection
+
+
+def count(stat):
+    """
+    Increments one of the hit/miss counters
+    :param stat: a string, 'hits' or 'misses'
+    """
+    with _stats_lock:
+        _stats[stat] += 1
+
+
+def cache_get(search_type, query):
+    """
+    Looks up a cached Spotify search result
+    :param search_type: a string of the search type
+    :param query: a string of the free text search
+    :return: the cached json result, or None if there is no fresh entry
+    """
+    if not cfg.SPOTIFY_CACHE_ENABLED:
+        return None
+
+    key = normalize_query(query)
+    now = time.time()
+    try:
+        connection = get_connection()
+        row = connection.execute("SELECT response, created_at FROM search_cache WHERE search_type = ? AND query = ?",
+                                 (search_type, key)).fetchone()
+        if row is None or now - row[1] > cfg.SPOTIFY_CACHE_TTL:
+            count('misses')
+            return None
+
+        with connection:
+            connection.execute("UPDATE search_cache SET last_used = ? WHERE search_type = ? AND query = ?",
+                               (now, search_type, key))
+    except sqlite3.Error as e:
+        logging.warning(f"Spotify cache lookup for '{query}' failed. \n {e}")
+        count('misses')
+        return None
+
+    count('hits')
+    return json.loads(row[0])
+
+
+def cache_put(search_type, query, response):
+    """
+    Stores a Spotify search result, and evicts the least recently used entries if the cache is full
+    :param search_type: a string of the search type
+    :param query: a string of the free text search
+    :param response: the json result of the search
+    """
+    if not cfg.SPOTIFY_CACHE_ENABLED:
+        return
+
+    now = time.time()
+    try:
+        connection = get_connection()
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO search_cache (search_type, query, response, created_at, "
+                               "last_used) VALUES (?, ?, ?, ?, ?)",
+                               (search_type, normalize_query(query), json.dumps(response), now, now))
+
+            entries = connection.execute("SELECT COUNT(*) FROM search_cache").fetchone()[0]
+            if entries > cfg.SPOTIFY_CACHE_MAX_ENTRIES:
+                connection.execute("DELETE FROM search_cache WHERE rowid IN "
+                                   "(SELECT rowid FROM search_cache ORDER BY last_used LIMIT ?)",
+                                   (entries - cfg.SPOTIFY_CACHE_MAX_ENTRIES,))
+                logging.debug(f"Evicted {entries - cfg.SPOTIFY_CACHE_MAX_ENTRIES} entries from the Spotify cache")
+    except sqlite3.Error as e:
+        logging.warning(f"Saving '{query}' to the Spotify cache failed. \n {e}")
+
+
+def cache_stats():
+    """
+    :return: a dictionary with the number of cache hits and misses in this process
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_stats():
+    """
+    Resets the hit/miss counters of this process
+    """
+    with _stats_lock:
+        _stats['hits'] = 0
+        _stats['misses'] = 0
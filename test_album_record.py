@@ -0,0 +1,84 @@
+import album_record as ar
+import pickle
+import pytest
+
+
+# ---------------  AlbumRecord  --------------- #
+
+def test_album_record_has_no_dict():
+    record = ar.AlbumRecord(album='album', artist='artist')
+
+    assert not hasattr(record, '__dict__')
+    with pytest.raises(AttributeError):
+        record.unknown_field = 1
+
+
+def test_album_record_defaults():
+    record = ar.AlbumRecord()
+
+    assert (record.rank, record.metascore, record.user_score) == (0, None, 0.0)
+    assert (record.spotify_album_id, record.tracks, record.markets) == (None, 0, ())
+    assert (record.genres, record.critic_reviews, record.details_scraped_at) == ((), 0, None)
+
+
+def test_album_record_set_album_page():
+    record = ar.AlbumRecord(album='album')
+
+    record.set_album_page(ar.AlbumPage(publisher='publisher', genres=('Rock',), critic_reviews=7,
+                                       amazon_link='amazon', scraped_at='2022-08-01 00:00:00'))
+
+    assert (record.publisher, record.genres, record.critic_reviews) == ('publisher', ('Rock',), 7)
+    assert (record.amazon_link, record.details_scraped_at) == ('amazon', '2022-08-01 00:00:00')
+
+
+def test_album_record_missing_album_page():
+    record = ar.AlbumRecord(album='album')
+
+    record.set_album_page(ar.missing(ar.AlbumPage))
+
+    assert not record.has_album_page()
+    assert (record.publisher, record.genres, record.critic_reviews, record.details_scraped_at) == (None, (), None, None)
+    assert ar.missing(ar.ReviewCounts) == ar.ReviewCounts(None, None)
+
+
+def test_album_record_equality():
+    assert ar.AlbumRecord(album='album', rank=1) == ar.AlbumRecord(album='album', rank=1)
+    assert ar.AlbumRecord(album='album', rank=1) != ar.AlbumRecord(album='album', rank=2)
+
+
+def test_album_page_picklable():
+    album_page = ar.AlbumPage(publisher='publisher', genres=('Rock', 'Pop'))
+
+    assert pickle.loads(pickle.dumps(album_page)) == album_page
+
+
+def test_page_fields_match_album_page():
+    assert len(ar.PAGE_FIELDS) == len(ar.AlbumPage._fields)
+    assert all(field in ar.COLUMNS for field in ar.PAGE_FIELDS)
+
+
+# ---------------  to_columns  --------------- #
+
+def test_to_columns():
+    records = [ar.AlbumRecord(album='first', rank=1), ar.AlbumRecord(album='second', rank=2)]
+    records[0].set_spotify_album('id', 10, ('IL', 'US'))
+
+    columns = ar.to_columns(records)
+
+    assert list(columns.keys()) == list(ar.COLUMNS.values())
+    assert columns['Album'] == ['first', 'second']
+    assert columns['Album Rank'] == [1, 2]
+    assert columns['Available Markets'] == [['IL', 'US'], []]
+
+
+def test_to_columns_some_fields():
+    assert ar.to_columns([ar.AlbumRecord(album='first')], ['album', 'rank']) == {'Album': ['first'], 'Album Rank': [0]}
+
+
+# ---------------  to_int  --------------- #
+
+def test_to_int():
+    assert ar.to_int('12') == 12
+    assert ar.to_int(' 1,234 ') == 1234
+    assert ar.to_int('tbd') == 0
+    assert ar.to_int('', None) is None
@@ -0,0 +1,101 @@
+import chart_export as ce
+import album_record as ar
+import config as cfg
+import pytest
+from datetime import datetime
+import os
+
+pa = pytest.importorskip('pyarrow')
+pq = pytest.importorskip('pyarrow.parquet')
+ds = pytest.importorskip('pyarrow.dataset')
+
+SCRAPE_DATETIME = '2022-08-01 12:30:00'
+
+
+@pytest.fixture
+def export_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(cfg, 'EXPORT_FOLDER', str(tmp_path / 'charts'))
+    return tmp_path / 'charts'
+
+
+def chart_records(n):
+    """
+    :param n: an integer, the number of albums
+    :return: a list of n AlbumRecord with all their fields filled
+    """
+    records = []
+    for i in range(n):
+        record = ar.AlbumRecord(album=f'album {i}', artist=f'artist {i}', release_date=datetime(2021, 1, i + 1),
+                                summary='summary', album_link=f'link {i}', rank=i + 1, metascore=90 - i,
+                                user_score=8.5)
+        record.set_spotify_album(f'album id {i}', 10, ('IL', 'US'))
+        record.set_spotify_artist(f'artist id {i}', 50, 1000)
+        record.set_album_page(ar.AlbumPage(publisher='publisher', genres=('Rock', 'Pop'), critic_reviews=12,
+                                           user_reviews=30, scraped_at='2022-07-01 00:00:00'))
+        records.append(record)
+    return records
+
+
+# ---------------  to_table  --------------- #
+
+def test_to_table_types():
+    table = ce.to_table(chart_records(2), SCRAPE_DATETIME)
+
+    assert table.schema == ce.chart_schema()
+    assert table.schema.field('genres').type == pa.list_(pa.string())
+    assert table.schema.field('markets').type == pa.list_(pa.string())
+    assert table.column('genres').to_pylist() == [['Rock', 'Pop'], ['Rock', 'Pop']]
+    assert table.column('rank').to_pylist() == [1, 2]
+    assert table.column('release_date').to_pylist()[1] == datetime(2021, 1, 2).date()
+    assert table.column('scrape_datetime').to_pylist() == [datetime(2022, 8, 1, 12, 30)] * 2
+
+
+def test_to_table_missing_values():
+    table = ce.to_table([ar.AlbumRecord(album='album')], SCRAPE_DATETIME)
+
+    assert table.column('metascore').to_pylist() == [None]
+    assert table.column('release_date').to_pylist() == [None]
+    assert table.column('details_scraped_at').to_pylist() == [None]
+    assert table.column('genres').to_pylist() == [[]]
+
+
+# ---------------  save_chart  --------------- #
+
+def test_save_chart_parquet_partitioned(export_folder):
+    fullname = ce.save_chart(chart_records(3), 'parquet', 'meta_score', 'year', '2021', SCRAPE_DATETIME)
+
+    assert os.path.dirname(fullname) == str(export_folder / 'sort=meta_score' / 'filter=year' / 'year=2021' /
+                                            'scrape_date=2022-08-01')
+    assert pq.read_metadata(fullname).row_group(0).column(0).compression == cfg.EXPORT_COMPRESSION.upper()
+    assert pq.read_table(fullname).equals(ce.to_table(chart_records(3), SCRAPE_DATETIME))
+
+
+def test_save_chart_chunks_read_as_dataset(export_folder):
+    records = chart_records(5)
+    ce.save_chart(records[:3], 'parquet', 'meta_score', 'year', '2021', SCRAPE_DATETIME, 0)
+    ce.save_chart(records[3:], 'parquet', 'meta_score', 'year', '2021', SCRAPE_DATETIME, 3)
+
+    table = ds.dataset(str(export_folder), format='parquet', partitioning='hive').to_table()
+
+    assert sorted(table.column('rank').to_pylist()) == [1, 2, 3, 4, 5]
+    assert set(table.column('sort').to_pylist()) == {'meta_score'}
+
+
+def test_save_chart_arrow(export_folder):
+    fullname = ce.save_chart(chart_records(2), 'arrow', 'user_score', 'year', '2020', SCRAPE_DATETIME)
+
+    assert fullname.endswith('.arrow')
+    with pa.memory_map(fullname) as source:
+        assert pa.ipc.open_file(source).read_all().equals(ce.to_table(chart_records(2), SCRAPE_DATETIME))
+
+
+def test_save_chart_exception_unknown_format(export_folder):
+    with pytest.raises(ValueError):
+        ce.save_chart(chart_records(1), 'csv', 'meta_score', 'year', '2021', SCRAPE_DATETIME)
+
+
+def test_save_chart_exception_without_pyarrow(export_folder, monkeypatch):
+    monkeypatch.setattr(ce, 'ARROW_AVAILABLE', False)
+
+    with pytest.raises(ValueError):
+        ce.save_chart(chart_records(1), 'parquet', 'meta_score', 'year', '2021', SCRAPE_DATETIME)
@@ -0,0 +1,94 @@
+import http_cache as hc
+import pytest
+import time
+import config as cfg
+
+ALBUM_PAGE = cfg.SITE_ADDRESS + '/music/album/artist'
+CHART_PAGE = cfg.SITE_ADDRESS + '/browse/albums/score/metascore/all/'
+
+
+@pytest.fixture(autouse=True)
+def cache_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(cfg, 'HTTP_CACHE_FILE', str(tmp_path / 'http_cache.sqlite'))
+    hc.reset_stats()
+
+
+# ---------------  max_age  --------------- #
+
+def test_max_age_per_url_class():
+    assert hc.max_age(ALBUM_PAGE) == cfg.HTTP_CACHE_MAX_AGE[cfg.SITE_ADDRESS + '/music/']
+    assert hc.max_age(CHART_PAGE) == cfg.HTTP_CACHE_MAX_AGE[cfg.SITE_ADDRESS + '/browse/']
+    assert hc.max_age(cfg.BASE_URL + '/search') is None
+
+
+# ---------------  cache_lookup & cache_store  --------------- #
+
+def test_cache_lookup_miss():
+    assert hc.cache_lookup(ALBUM_PAGE) is None
+    assert hc.cache_stats()['misses'] == 1
+
+
+def test_cache_store_then_lookup():
+    hc.cache_store(CHART_PAGE, {'ETag': '"abc"', 'Set-Cookie': 'id=1'}, b'<html></html>')
+
+    cached = hc.cache_lookup(CHART_PAGE)
+    assert cached == {'headers': {'ETag': '"abc"'}, 'body': b'<html></html>', 'fresh': True}
+
+
+def test_cache_lookup_album_page_is_always_revalidated():
+    hc.cache_store(ALBUM_PAGE, {'ETag': '"abc"'}, b'album')
+
+    cached = hc.cache_lookup(ALBUM_PAGE)
+    assert cached['body'] == b'album'
+    assert not cached['fresh']
+
+
+def test_cache_lookup_stale(monkeypatch):
+    hc.cache_store(CHART_PAGE, {'Last-Modified': 'Mon, 01 Aug 2022 00:00:00 GMT'}, b'chart')
+    monkeypatch.setitem(cfg.HTTP_CACHE_MAX_AGE, cfg.SITE_ADDRESS + '/browse/', -1)
+
+    cached = hc.cache_lookup(CHART_PAGE)
+    assert cached['body'] == b'chart'
+    assert not cached['fresh']
+
+
+def test_cache_hit_revalidated_is_fresh_again(monkeypatch):
+    hc.cache_store(CHART_PAGE, {'ETag': '"abc"'}, b'chart')
+    monkeypatch.setitem(cfg.HTTP_CACHE_MAX_AGE, cfg.SITE_ADDRESS + '/browse/', 1)
+    time.sleep(1.1)
+    assert not hc.cache_lookup(CHART_PAGE)['fresh']
+
+    hc.cache_hit(CHART_PAGE, b'chart', revalidated=True)
+
+    assert hc.cache_lookup(CHART_PAGE)['fresh']
+    assert hc.cache_stats()['revalidated'] == 1
+    assert hc.cache_stats()['bytes_saved'] == len(b'chart')
+
+
+def test_cache_store_ignores_uncached_urls():
+    hc.cache_store(cfg.BASE_URL + '/search', {}, b'{}')
+
+    assert hc.total_size() == 0
+
+
+def test_cache_store_evicts_least_recently_used(monkeypatch):
+    body = bytes(range(256)) * 4
+    hc.cache_store(ALBUM_PAGE + '1', {}, body)
+    time.sleep(0.01)
+    hc.cache_store(ALBUM_PAGE + '2', {}, body)
+    time.sleep(0.01)
+    hc.cache_hit(ALBUM_PAGE + '1', body)
+    time.sleep(0.01)
+    monkeypatch.setattr(cfg, 'HTTP_CACHE_MAX_BYTES', hc.total_size())
+    hc.cache_store(ALBUM_PAGE + '3', {}, body)
+
+    assert hc.cache_lookup(ALBUM_PAGE + '1') is not None
+    assert hc.cache_lookup(ALBUM_PAGE + '2') is None
+    assert hc.cache_lookup(ALBUM_PAGE + '3') is not None
+
+
+def test_cache_disabled(monkeypatch):
+    monkeypatch.setattr(cfg, 'HTTP_CACHE_ENABLED', False)
+    hc.cache_store(ALBUM_PAGE, {}, b'page')
+
+    assert hc.cache_lookup(ALBUM_PAGE) is None
@@ -0,0 +1,244 @@
+import http_client as http
+import http_cache as hc
+import pytest
+import config as cfg
+import time
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+
+# ---------------  get_session  --------------- #
+
+def test_get_session_is_shared():
+    assert http.get_session() is http.get_session()
+
+
+def test_get_session_headers():
+    headers = http.get_session().headers
+
+    assert headers['User-Agent'] == cfg.USER_AGENT
+    assert 'gzip' in headers['Accept-Encoding']
+
+
+# ---------------  connection_stats  --------------- #
+
+def test_connection_stats_reuses_connections(album_page_server, monkeypatch):
+    monkeypatch.setattr(cfg, 'HTTP_CACHE_ENABLED', False)
+    before = http.connection_stats()
+
+    for album in ['first', 'second', 'third']:
+        http.get_session().get(f'{album_page_server}/music/{album}/artist', timeout=cfg.HTTP_TIMEOUT)
+
+    after = http.connection_stats()
+    assert after['requests'] - before['requests'] == 3
+    assert after['opened'] - before['opened'] <= 1
+
+
+# ---------------  retries & circuit breaker  --------------- #
+
+def test_jitter_retry_backoff_is_randomized():
+    retry = http.JitterRetry(total=5, backoff_factor=1)
+    for _ in range(3):
+        retry = retry.increment(method='GET', url='/')
+
+    backoff_times = {retry.get_backoff_time() for _ in range(10)}
+    assert len(backoff_times) > 1
+    assert all(4 * (1 - cfg.HTTP_BACKOFF_JITTER) <= t <= 4 * (1 + cfg.HTTP_BACKOFF_JITTER) for t in backoff_times)
+
+
+def test_circuit_opens_after_consecutive_failures(monkeypatch):
+    monkeypatch.setattr(cfg, 'CIRCUIT_BREAKER_FAILURES', 3)
+    host = 'circuit.test'
+
+    for _ in range(3):
+        http.check_circuit(host)
+        http.record_result(host, False)
+
+    with pytest.raises(http.CircuitOpenError):
+        http.check_circuit(host)
+
+
+def test_circuit_half_open_after_cooldown(monkeypatch):
+    monkeypatch.setattr(cfg, 'CIRCUIT_BREAKER_FAILURES', 1)
+    monkeypatch.setattr(cfg, 'CIRCUIT_BREAKER_COOLDOWN', 0)
+    host = 'half-open.test'
+    http.record_result(host, False)
+
+    http.check_circuit(host)
+    http.record_result(host, True)
+    http.check_circuit(host)
+
+
+def test_circuit_success_resets_failures(monkeypatch):
+    monkeypatch.setattr(cfg, 'CIRCUIT_BREAKER_FAILURES', 2)
+    host = 'reset.test'
+
+    http.record_result(host, False)
+    http.record_result(host, True)
+    http.record_result(host, False)
+
+    http.check_circuit(host)
+
+
+# ---------------  rate limiter  --------------- #
+
+def test_acquire_spaces_requests(monkeypatch):
+    monkeypatch.setitem(cfg.RATE_LIMITS, 'spaced.test', 20.0)
+    host = 'spaced.test'
+
+    start = time.time()
+    for _ in range(5):
+        http.acquire(host)
+
+    # the first request uses the initial token, the next four wait 1/20 of a second each
+    assert time.time() - start >= 4 / 20 * 0.9
+
+
+def test_adapt_rate_slows_down_on_429(monkeypatch):
+    monkeypatch.setitem(cfg.RATE_LIMITS, 'slow-down.test', 4.0)
+    host = 'slow-down.test'
+
+    http.adapt_rate(host, 429)
+    assert http.current_rate(host) == 4.0 * cfg.RATE_LIMIT_DECREASE
+
+    for _ in range(100):
+        http.adapt_rate(host, 503)
+    assert http.current_rate(host) == cfg.RATE_LIMIT_MIN
+
+
+def test_adapt_rate_speeds_up_to_max(monkeypatch):
+    monkeypatch.setitem(cfg.RATE_LIMITS, 'speed-up.test', 1.0)
+    host = 'speed-up.test'
+
+    http.adapt_rate(host, 200)
+    assert http.current_rate(host) == 1.0 + cfg.RATE_LIMIT_INCREASE
+
+    for _ in range(1000):
+        http.adapt_rate(host, 200)
+    assert http.current_rate(host) == cfg.RATE_LIMIT_MAX_FACTOR
+
+
+class RateLimitedHandler(BaseHTTPRequestHandler):
+    """
+    Answers every request with 429 Too Many Requests, and counts the requests
+    """
+    requests_num = 0
+
+    def do_GET(self):
+        RateLimitedHandler.requests_num += 1
+        self.send_response(429)
+        self.send_header('Retry-After', '0')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def rate_limited_server(monkeypatch):
+    server = HTTPServer(('127.0.0.1', 0), RateLimitedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # the retries are not delayed, and the slowed down rate of the local host doesn't delay later tests
+    monkeypatch.setattr(http.JitterRetry, 'get_backoff_time', lambda self: 0)
+    monkeypatch.setattr(http, '_buckets', {})
+    monkeypatch.setattr(http, '_circuits', {})
+    RateLimitedHandler.requests_num = 0
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_retries_wait_for_rate_limiter(rate_limited_server, monkeypatch):
+    acquired = []
+    monkeypatch.setattr(http, 'acquire', acquired.append)
+    before = http.connection_stats()
+
+    response = http.get_session().get(rate_limited_server + '/limited', timeout=cfg.HTTP_TIMEOUT)
+
+    assert response.status_code == 429
+    assert RateLimitedHandler.requests_num == cfg.HTTP_RETRIES + 1
+    assert acquired == ['127.0.0.1'] * (cfg.HTTP_RETRIES + 1)
+    assert http.connection_stats()['requests'] - before['requests'] == cfg.HTTP_RETRIES + 1
+
+
+def test_adapt_rate_ignores_other_errors(monkeypatch):
+    monkeypatch.setitem(cfg.RATE_LIMITS, 'not-found.test', 2.0)
+    host = 'not-found.test'
+
+    http.adapt_rate(host, 404)
+    assert http.current_rate(host) == 2.0
+
+
+# ---------------  response cache  --------------- #
+
+class AlbumPageHandler(BaseHTTPRequestHandler):
+    """
+    Answers every page with an ETag, and with 304 Not Modified when the request has the same ETag.
+    Connections are kept alive between requests
+    """
+    protocol_version = 'HTTP/1.1'
+    conditional_requests = []
+
+    def do_GET(self):
+        self.conditional_requests.append(self.headers.get('If-None-Match'))
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.send_header('ETag', '"v1"')
+            self.end_headers()
+            return
+        body = b'<html>12 Ratings</html>'
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def album_page_server(tmp_path, monkeypatch):
+    server = HTTPServer(('127.0.0.1', 0), AlbumPageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    site_address = f'http://127.0.0.1:{server.server_port}'
+    monkeypatch.setattr(cfg, 'HTTP_CACHE_FILE', str(tmp_path / 'http_cache.sqlite'))
+    # the rate and circuit of the local host start afresh and don't carry over to later tests
+    monkeypatch.setattr(http, '_buckets', {})
+    monkeypatch.setattr(http, '_circuits', {})
+    # the local server's chart and album pages get the max age of Metacritic's chart and album pages
+    monkeypatch.setattr(cfg, 'HTTP_CACHE_MAX_AGE', {prefix.replace(cfg.SITE_ADDRESS, site_address): seconds
+                                                    for prefix, seconds in cfg.HTTP_CACHE_MAX_AGE.items()})
+    AlbumPageHandler.conditional_requests = []
+    yield site_address
+    # the server serves a kept alive connection until it is closed, so the pooled connections are closed first
+    http.get_session().close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_album_page_is_revalidated_on_every_run(album_page_server):
+    page_url = album_page_server + '/music/album/artist'
+    first = http.get_session().get(page_url, timeout=cfg.HTTP_TIMEOUT)
+    revalidated = hc.cache_stats()['revalidated']
+
+    second = http.get_session().get(page_url, timeout=cfg.HTTP_TIMEOUT)
+
+    assert AlbumPageHandler.conditional_requests == [None, '"v1"']
+    assert hc.cache_stats()['revalidated'] == revalidated + 1
+    assert second.status_code == 200
+    assert second.content == first.content
+
+
+def test_cached_page_is_not_requested_again(album_page_server):
+    page_url = album_page_server + '/browse/albums/score/metascore/all/filtered'
+    first = http.get_session().get(page_url, timeout=cfg.HTTP_TIMEOUT)
+    before = http.connection_stats()
+
+    second = http.get_session().get(page_url, timeout=cfg.HTTP_TIMEOUT)
+
+    assert AlbumPageHandler.conditional_requests == [None]
+    assert http.connection_stats()['requests'] == before['requests']
+    assert second.status_code == 200
+    assert second.content == first.content
@@ -1,7 +1,13 @@
 import metacritic_scraper as scrape
+import album_record as ar
 import pytest
 import pandas as pd
 import config as cfg
+import time
+import contextlib
+import requests
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
 
 
 # ---------------  save_csv  --------------- #
@@ -126,7 +132,7 @@ def test_scrape_album_page_batch_bigger_than_pages_url_length():
     args = scrape.parse_args(cfg.ARGS_4_TESTS + ['-b1000'])
     pages_url = cfg.TEST_PAGES
 
-    assert list(scrape.scrape_album_page(args, pages_url).keys()) == cfg.ALBUM_PAGE_COLUMNS
+    assert list(scrape.scrape_album_page(args, pages_url).keys()) == pages_url
 
 
 def test_scrape_album_page_exception_batch_negative_or_zero():
@@ -152,7 +158,10 @@ def test_scrape_album_page_creates_dictionary():
     args = scrape.parse_args(cfg.ARGS_4_TESTS)
     pages_url = [cfg.TEST_PAGES[0]]
 
-    assert list(scrape.scrape_album_page(args, pages_url).keys()) == cfg.ALBUM_PAGE_COLUMNS
+    album_pages = scrape.scrape_album_page(args, pages_url)
+
+    assert list(album_pages.keys()) == pages_url
+    assert isinstance(album_pages[pages_url[0]], ar.AlbumPage)
 
 
 def test_scrape_album_page_exception_not_album_page():
@@ -305,3 +314,612 @@ def test_scrape_albums_details_exception_not_chart_page():
 
     with pytest.raises(AttributeError):
         scrape.scrape_albums_details(args, soup)
+
+
+# ---------------  scrape_spotify_api_albums & scrape_spotify_api_artists  --------------- #
+
+def fake_spotify_search(query, search_type):
+    # answers slower for earlier queries, so the results complete out of order
+    time.sleep(0.01 * (10 - len(query) % 10))
+    if search_type == 'artist':
+        return {'artists': {'items': [{'id': query, 'popularity': len(query),
+                                       'followers': {'total': len(query) * 10}}]}}
+    return {'albums': {'items': [{'id': query, 'total_tracks': len(query), 'available_markets': ['IL']}]}}
+
+
+def test_scrape_spotify_api_artists_keeps_chart_order(monkeypatch):
+    monkeypatch.setattr(scrape, 'spotify_search', fake_spotify_search)
+    monkeypatch.setattr(scrape.sp, 'get_several', lambda item_type, spotify_ids: {})
+    args = scrape.parse_args(cfg.ARGS_4_TESTS + ['-w4'])
+    artist_names = ['a' * n for n in range(1, 10)]
+
+    result = scrape.scrape_spotify_api_artists(args, artist_names)
+
+    assert list(result.keys()) == artist_names
+    assert list(result.values()) == [(name, len(name), len(name) * 10) for name in artist_names]
+
+
+def test_scrape_spotify_api_albums_keeps_chart_order(monkeypatch):
+    monkeypatch.setattr(scrape, 'spotify_search', fake_spotify_search)
+    monkeypatch.setattr(scrape.sp, 'get_several', lambda item_type, spotify_ids: {})
+    args = scrape.parse_args(cfg.ARGS_4_TESTS + ['-w4'])
+    album_names = ['a' * n for n in range(1, 10)]
+    artist_names = ['b'] * 9
+
+    result = scrape.scrape_spotify_api_albums(args, album_names, artist_names)
+
+    assert list(result.keys()) == list(zip(album_names, artist_names))
+    assert [tracks for _, tracks, _ in result.values()] == [n + 2 for n in range(1, 10)]
+    assert [markets for _, _, markets in result.values()] == [('IL',)] * 9
+
+
+def test_scrape_spotify_api_artists_known_ids_refreshed_in_bulk(monkeypatch):
+    searched = []
+    requested = []
+
+    def search(query, search_type):
+        searched.append(query)
+        return fake_spotify_search(query, search_type)
+
+    def get_several(item_type, spotify_ids):
+        requested.append((item_type, list(spotify_ids)))
+        return {'id1': {'id': 'id1', 'popularity': 99, 'followers': {'total': 1000}}}
+
+    monkeypatch.setattr(scrape, 'spotify_search', search)
+    monkeypatch.setattr(scrape.sp, 'get_several', get_several)
+    args = scrape.parse_args(cfg.ARGS_4_TESTS)
+
+    result = scrape.scrape_spotify_api_artists(args, ['known', 'new'], {'known': 'id1'})
+
+    assert searched == ['new']
+    assert requested == [('artists', ['id1', 'new'])]
+    assert result == {'known': ('id1', 99, 1000), 'new': ('new', 3, 30)}
+
+
+def test_scrape_spotify_api_known_ids_keep_stored_details_when_refresh_fails(monkeypatch):
+    def spotify_get(url):
+        raise requests.ConnectionError('Spotify is unreachable')
+
+    monkeypatch.setattr(scrape.sp, 'spotify_get', spotify_get)
+    args = scrape.parse_args(cfg.ARGS_4_TESTS)
+
+    artists = scrape.scrape_spotify_api_artists(args, ['known'], {'known': 'id1'})
+    albums = scrape.scrape_spotify_api_albums(args, ['album'], ['known'], {('album', 'known'): 'id2'})
+
+    assert artists == {'known': ('id1', None, None)}
+    assert albums == {('album', 'known'): ('id2', None, ())}
+
+
+def test_scrape_spotify_api_artists_exception_workers_negative_or_zero():
+    args = scrape.parse_args(cfg.ARGS_4_TESTS + ['-w0'])
+    with pytest.raises(ValueError):
+        scrape.scrape_spotify_api_artists(args, ['artist'])
+
+
+# ---------------  scrape_album_page with parse workers  --------------- #
+
+def test_scrape_album_page_parse_workers_same_result(test_pages_server):
+    pages_url = [page_url.replace(cfg.SITE_ADDRESS, test_pages_server) for page_url in cfg.TEST_PAGE_FILES][:4]
+
+    args = scrape.parse_args(cfg.ARGS_4_TESTS + ['-b4'])
+    inline_details = scrape.scrape_album_page(args, pages_url)
+
+    args = scrape.parse_args(cfg.ARGS_4_TESTS + ['-b4', '-P2'])
+    assert scrape.scrape_album_page(args, pages_url) == inline_details
+
+
+class SavedPageHandler(BaseHTTPRequestHandler):
+    """
+    Answers the saved copies of the test chart and album pages by the path of their Metacritic url, and 404 Not Found
+    for any other path
+    """
+    pages = {page_url.replace(cfg.SITE_ADDRESS, ''): file_name
+             for page_url, file_name in [(cfg.TEST_CHART, cfg.TEST_CHART_FILE), *cfg.TEST_PAGE_FILES.items()]}
+
+    def do_GET(self):
+        if self.path not in self.pages:
+            self.send_error(404)
+            return
+        body = read_test_page(self.pages[self.path])
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def test_pages_server(tmp_path, monkeypatch):
+    server = HTTPServer(('127.0.0.1', 0), SavedPageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(cfg, 'HTTP_CACHE_FILE', str(tmp_path / 'http_cache.sqlite'))
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_scrape_album_page_parse_workers_no_thread_exception(test_pages_server, monkeypatch):
+    pages_url = [page_url.replace(cfg.SITE_ADDRESS, test_pages_server) for page_url in cfg.TEST_PAGE_FILES]
+    thread_exceptions = []
+    monkeypatch.setattr(threading, 'excepthook', thread_exceptions.append)
+
+    args = scrape.parse_args(cfg.ARGS_4_TESTS + ['-b2'])
+    inline_details = scrape.scrape_album_page(args, pages_url)
+    args = scrape.parse_args(cfg.ARGS_4_TESTS + ['-b2', '-P2'])
+    pool_details = scrape.scrape_album_page(args, pages_url)
+
+    assert thread_exceptions == []
+    assert pool_details == inline_details
+
+
+def test_scrape_album_page_parse_workers_reuse_pool(test_pages_server, monkeypatch):
+    pages_url = [page_url.replace(cfg.SITE_ADDRESS, test_pages_server) for page_url in cfg.TEST_PAGE_FILES]
+    monkeypatch.setattr(scrape, '_parse_pools', {})
+
+    args = scrape.parse_args(cfg.ARGS_4_TESTS + ['-b2', '-P2'])
+    try:
+        first_details = scrape.scrape_album_page(args, pages_url)
+        pool = scrape._parse_pools[2]
+        second_details = scrape.scrape_album_page(args, pages_url)
+        assert scrape._parse_pools == {2: pool}
+    finally:
+        scrape.shutdown_parse_pools()
+
+    assert second_details == first_details
+
+
+def test_scrape_album_page_exception_parse_workers_negative():
+    args = scrape.parse_args(cfg.ARGS_4_TESTS + ['-P-1'])
+    with pytest.raises(ValueError):
+        scrape.scrape_album_page(args, cfg.TEST_PAGES)
+
+
+# ---------------  parser backends parity  --------------- #
+
+def read_test_page(file_name):
+    with open(file_name, 'rb') as test_page:
+        return test_page.read()
+
+
+def parse_with(monkeypatch, parser, function, *args):
+    monkeypatch.setattr(cfg, 'HTML_PARSER', parser)
+    return function(*args)
+
+
+def test_html_parser_exception_unknown_parser(monkeypatch):
+    monkeypatch.setattr(cfg, 'HTML_PARSER', 'not_a_parser')
+    with pytest.raises(ValueError):
+        scrape.make_soup('<html></html>')
+
+
+@pytest.mark.parametrize('page_url', cfg.TEST_PAGE_FILES.keys())
+def test_parse_album_page_parsers_parity(monkeypatch, page_url):
+    pytest.importorskip('lxml')
+    content = read_test_page(cfg.TEST_PAGE_FILES[page_url])
+
+    assert parse_with(monkeypatch, 'lxml', scrape.parse_album_page, content, page_url) == \
+           parse_with(monkeypatch, 'html.parser', scrape.parse_album_page, content, page_url)
+
+
+def test_scrape_albums_details_and_scores_parsers_parity(monkeypatch):
+    pytest.importorskip('lxml')
+    args = scrape.parse_args(cfg.ARGS_4_TESTS)
+    content = read_test_page(cfg.TEST_CHART_FILE)
+
+    def scrape_chart(content):
+        return scrape.scrape_chart(args, scrape.make_soup(content))
+
+    assert parse_with(monkeypatch, 'lxml', scrape_chart, content) == \
+           parse_with(monkeypatch, 'html.parser', scrape_chart, content)
+
+
+# ---------------  scrape_chart  --------------- #
+
+TEST_CHART_ROWS = """
+<table class="clamp-list">
+<tr><td class="clamp-summary-wrap">
+    <div class="clamp-score-wrap"><div class="metascore_w large release positive">95</div></div>
+    <a href="/music/first-album/first-artist" class="title"><h3>First Album</h3></a>
+    <div class="artist">First Artist</div>
+    <div class="clamp-details"><span>December 3, 2021</span></div>
+    <span class="title numbered">1.</span>
+    <div class="summary">First summary</div>
+    <div class="clamp-metascore"><div class="metascore_w large release positive">95</div></div>
+    <div class="clamp-userscore"><div class="metascore_w user large release positive">8.5</div></div>
+</td></tr>
+<tr><td class="clamp-summary-wrap">
+    <a href="/music/second-album/second-artist" class="title"><h3>Second Album</h3></a>
+    <div class="artist">Second Artist</div>
+    <div class="clamp-details"><span>May 1, 2021</span></div>
+    <span class="title numbered">2.</span>
+    <div class="clamp-metascore"><div class="metascore_w large release positive">90</div></div>
+    <div class="clamp-userscore"><div class="metascore_w user large release tbd">tbd</div></div>
+</td></tr>
+</table>
+"""
+
+
+def test_scrape_chart_one_record_per_row():
+    args = scrape.parse_args(cfg.ARGS_4_TESTS)
+
+    records = scrape.scrape_chart(args, scrape.make_soup(TEST_CHART_ROWS))
+
+    assert [record.album for record in records] == ['First Album', 'Second Album']
+    assert [record.rank for record in records] == [1, 2]
+    assert [record.metascore for record in records] == [95, 90]
+    assert [record.user_score for record in records] == [8.5, 0.0]
+    # the missing summary of the second album doesn't shift the other albums' summaries
+    assert [record.summary for record in records] == ['First summary', '']
+    assert records[1].album_link == cfg.SITE_ADDRESS + '/music/second-album/second-artist'
+
+
+def test_scrape_chart_max():
+    args = scrape.parse_args(cfg.ARGS_4_TESTS + ['-m1'])
+
+    assert [record.album for record in scrape.scrape_chart(args, scrape.make_soup(TEST_CHART_ROWS))] == ['First Album']
+
+
+def test_scrape_chart_exception_not_chart_page():
+    args = scrape.parse_args(cfg.ARGS_4_TESTS)
+
+    with pytest.raises(AttributeError):
+        scrape.scrape_chart(args, scrape.make_soup('<html><body></body></html>'))
+
+
+def test_scrape_chart_with_chart_strainer():
+    args = scrape.parse_args(cfg.ARGS_4_TESTS + ['-m1'])
+    soup = scrape.make_soup('<html><head><script>var a;</script></head><body>' + TEST_CHART_ROWS + '</body></html>',
+                            scrape.chart_strainer())
+
+    assert soup.find('script') is None
+    assert [record.album for record in scrape.scrape_chart(args, soup)] == ['First Album']
+
+
+def test_chart_strainer_builds_only_max_rows():
+    content = read_test_page(cfg.TEST_CHART_FILE)
+    args = scrape.parse_args(cfg.ARGS_4_TESTS + ['-m5'])
+
+    full_soup = scrape.make_soup(content, scrape.chart_strainer())
+    soup = scrape.make_soup(content, scrape.chart_strainer(5))
+
+    assert len(soup.find_all('td', class_='clamp-summary-wrap')) == 5
+    assert len(soup.find_all(True)) < len(full_soup.find_all(True)) / 10
+    assert scrape.scrape_chart(args, soup) == scrape.scrape_chart(args, full_soup)
+    assert scrape.chart_page_count(soup) == scrape.chart_page_count(full_soup) == 5
+
+
+# ---------------  chart pagination  --------------- #
+
+def test_chart_page_url():
+    assert scrape.chart_page_url(cfg.TEST_CHART, 0) == cfg.TEST_CHART
+    assert scrape.chart_page_url(cfg.TEST_CHART, 2) == cfg.TEST_CHART + '&page=2'
+    assert scrape.chart_page_url('https://www.metacritic.com/chart', 1) == 'https://www.metacritic.com/chart?page=1'
+
+
+def test_chart_page_count():
+    navigation = '<ul class="pages"><li class="page first_page"><span class="page_num">1</span></li>' \
+                 '<li class="page last_page"><a class="page_num" href="/chart?page=4">5</a></li></ul>'
+
+    assert scrape.chart_page_count(scrape.make_soup(navigation, scrape.chart_strainer())) == 5
+    assert scrape.chart_page_count(scrape.make_soup(TEST_CHART_ROWS, scrape.chart_strainer())) == 1
+
+
+def saved_chart_pages(pages_url, size, failures=None):
+    # every page of every chart is the saved test chart
+    return ((index, read_test_page(cfg.TEST_CHART_FILE)) for index in range(len(pages_url)))
+
+
+def test_scrape_chart_pages_max_cuts_last_page(monkeypatch):
+    monkeypatch.setattr(scrape, 'stream_pages', saved_chart_pages)
+    args = scrape.parse_args(cfg.ARGS_4_TESTS + ['-m150'])
+
+    pages = {page_num: records for _, page_num, records in scrape.iter_chart_pages(args, [cfg.TEST_CHART])}
+
+    assert {page_num: len(records) for page_num, records in pages.items()} == {0: 100, 1: 50}
+
+
+def test_iter_chart_pages_skips_failed_and_empty_charts(test_pages_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(cfg, 'FAILED_PAGES_FILE', str(tmp_path / 'failed_pages.csv'))
+    args = scrape.parse_args(cfg.ARGS_4_TESTS + ['-m100', '-b3'])
+    charts_url = [test_pages_server + cfg.TEST_CHART.replace(cfg.SITE_ADDRESS, ''),
+                  test_pages_server + '/browse/albums/score/metascore/missing',
+                  list(cfg.TEST_PAGE_FILES.keys())[0].replace(cfg.SITE_ADDRESS, test_pages_server)]
+
+    pages = list(scrape.iter_chart_pages(args, charts_url))
+
+    assert [(chart_num, page_num, len(records)) for chart_num, page_num, records in pages] == [(0, 0, 100)]
+    with open(cfg.FAILED_PAGES_FILE) as openfile:
+        failed_pages = openfile.read()
+    assert charts_url[1] in failed_pages and charts_url[2] in failed_pages
+
+
+def test_iter_chart_pages_skips_and_reports_failed_page(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(cfg, 'FAILED_PAGES_FILE', str(tmp_path / 'failed_pages.csv'))
+    album_page = read_test_page(list(cfg.TEST_PAGE_FILES.values())[0])
+
+    def chart_pages_with_album_page(pages_url, size, failures=None):
+        # the third page of the chart is an album page
+        return ((index, album_page if 'page=2' in page_url else read_test_page(cfg.TEST_CHART_FILE))
+                for index, page_url in enumerate(pages_url))
+
+    monkeypatch.setattr(scrape, 'stream_pages', chart_pages_with_album_page)
+    args = scrape.parse_args(cfg.ARGS_4_TESTS + ['-m300'])
+
+    pages = list(scrape.iter_chart_pages(args, [cfg.TEST_CHART]))
+
+    assert [(chart_num, page_num) for chart_num, page_num, _ in pages] == [(0, 0), (0, 1)]
+    assert '1 of the 2 further chart pages could not be scraped, the albums of pages [3]' in caplog.text
+
+
+def test_iter_chart_pages_exception_no_chart_scraped(test_pages_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(cfg, 'FAILED_PAGES_FILE', str(tmp_path / 'failed_pages.csv'))
+    args = scrape.parse_args(cfg.ARGS_4_TESTS)
+
+    with pytest.raises(AttributeError):
+        list(scrape.iter_chart_pages(args, [test_pages_server + '/browse/albums/score/metascore/missing']))
+
+
+def test_scrape_chart_pages_max_across_pages(monkeypatch):
+    monkeypatch.setattr(scrape, 'stream_pages', saved_chart_pages)
+    args = scrape.parse_args(cfg.ARGS_4_TESTS + ['-m150', '-b2'])
+
+    records = scrape.scrape_chart_pages(args, cfg.TEST_CHART)
+
+    # every page is the saved first page of the chart, so the second page starts over from rank 1
+    assert len(records) == 150
+    assert [record.rank for record in records[:3]] == [1, 2, 3]
+    assert [record.rank for record in records[100:103]] == [1, 2, 3]
+    assert records[-1].rank == 50
+
+
+# ---------------  sweep mode  --------------- #
+
+def test_parse_args_exception_chart_not_chosen():
+    with pytest.raises(SystemExit):
+        scrape.parse_args(['update', '-f', 'year', '-y', '2022'])
+
+
+def test_parse_args_format_implies_save(monkeypatch):
+    monkeypatch.setattr(scrape.ce, 'ARROW_AVAILABLE', True)
+
+    assert (scrape.parse_args(cfg.ARGS_4_TESTS).save, scrape.parse_args(cfg.ARGS_4_TESTS).format) == (False, 'csv')
+    args = scrape.parse_args(cfg.ARGS_4_TESTS + ['--format', 'parquet'])
+    assert (args.save, args.format) == (True, 'parquet')
+
+
+def test_parse_args_exception_format_without_pyarrow(monkeypatch):
+    monkeypatch.setattr(scrape.ce, 'ARROW_AVAILABLE', False)
+
+    with pytest.raises(SystemExit):
+        scrape.parse_args(cfg.ARGS_4_TESTS + ['--format', 'arrow'])
+    assert scrape.parse_args(cfg.ARGS_4_TESTS + ['--format', 'csv']).save
+
+
+def test_plan_charts_single_chart():
+    args = scrape.parse_args(cfg.ARGS_4_TESTS)
+
+    assert scrape.plan_charts(args) == [('meta_score', 'year', '2022')]
+
+
+def test_plan_charts_years_range():
+    args = scrape.parse_args(['update', '--years', '2020-2021'])
+
+    assert scrape.plan_charts(args) == [('meta_score', 'year', '2020'), ('user_score', 'year', '2020'),
+                                        ('meta_score', 'year', '2021'), ('user_score', 'year', '2021')]
+
+
+def test_plan_charts_all_years_by_sort():
+    args = scrape.parse_args(['update', '--all', '-s', 'user_score'])
+
+    assert scrape.plan_charts(args) == [('user_score', 'year', year) for year in cfg.YEAR_RELEASE.keys()]
+
+
+def test_parse_years_exception_bad_range():
+    with pytest.raises(ValueError):
+        scrape.parse_years('1900-2000')
+    with pytest.raises(ValueError):
+        scrape.parse_years('2022-2010')
+    with pytest.raises(ValueError):
+        scrape.parse_years('twenty')
+
+
+# ---------------  skipping failed album pages  --------------- #
+
+def test_scrape_album_page_skips_and_records_failed_page(test_pages_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(cfg, 'FAILED_PAGES_FILE', str(tmp_path / 'failed_pages.csv'))
+    args = scrape.parse_args(cfg.ARGS_4_TESTS + ['-b2'])
+    good_urls = [page_url.replace(cfg.SITE_ADDRESS, test_pages_server) for page_url in cfg.TEST_PAGE_FILES][:2]
+    bad_url = f'{test_pages_server}/bad_link_for_testing'
+    pages_url = [good_urls[0], bad_url, good_urls[1]]
+
+    album_pages = scrape.scrape_album_page(args, pages_url)
+
+    assert list(album_pages.keys()) == pages_url
+    assert all(album_pages[page_url].publisher for page_url in good_urls)
+    assert album_pages[bad_url] == ar.missing(ar.AlbumPage)
+    with open(cfg.FAILED_PAGES_FILE) as openfile:
+        assert bad_url in openfile.read()
+
+
+def test_scrape_album_page_failed_page_has_missing_details(tmp_path, monkeypatch):
+    monkeypatch.setattr(cfg, 'FAILED_PAGES_FILE', str(tmp_path / 'failed_pages.csv'))
+    pages_url = list(cfg.TEST_PAGE_FILES.keys())[:2]
+    contents = [read_test_page(cfg.TEST_PAGE_FILES[pages_url[0]]), read_test_page(cfg.TEST_CHART_FILE)]
+    monkeypatch.setattr(scrape, 'stream_pages', lambda pages_url, size, failures=None: enumerate(contents))
+    args = scrape.parse_args(cfg.ARGS_4_TESTS + ['-b2'])
+
+    album_pages = scrape.scrape_album_page(args, pages_url)
+
+    assert album_pages[pages_url[0]].details_link is not None
+    assert album_pages[pages_url[1]] == ar.missing(ar.AlbumPage)
+
+
+# ---------------  incremental mode  --------------- #
+
+@pytest.mark.parametrize('page_url', cfg.TEST_PAGE_FILES.keys())
+def test_parse_review_counts_same_as_full_parse(page_url):
+    content = read_test_page(cfg.TEST_PAGE_FILES[page_url])
+
+    review_counts = scrape.parse_review_counts(content, page_url)
+    album_details = scrape.parse_album_page(content, page_url)
+
+    assert review_counts == tuple(getattr(album_details, field) for field in ar.ReviewCounts._fields)
+
+
+def test_scrape_album_pages_incremental_fetches_only_new_pages_in_full(monkeypatch):
+    args = scrape.parse_args(cfg.ARGS_4_TESTS + ['-I'])
+    pages_url = ['new1', 'stored', 'new2']
+    stored_page = ar.AlbumPage(publisher='stored', genres=('Rock',), scraped_at='2022-08-01 00:00:00')
+    calls = []
+
+    def scrape_album_page(args, pages_url, parse_page=scrape.parse_album_page):
+        calls.append((list(pages_url), parse_page))
+        if parse_page is scrape.parse_review_counts:
+            return {page_url: ar.ReviewCounts(7, 8) for page_url in pages_url}
+        return {page_url: ar.AlbumPage(publisher=page_url) for page_url in pages_url}
+
+    monkeypatch.setattr(scrape.ta, 'get_stored_albums', lambda login_info, links, days: {'stored': stored_page})
+    monkeypatch.setattr(scrape, 'scrape_album_page', scrape_album_page)
+
+    album_pages = scrape.scrape_album_pages_incremental(args, {}, pages_url)
+
+    assert calls == [(['new1', 'new2'], scrape.parse_album_page), (['stored'], scrape.parse_review_counts)]
+    assert list(album_pages.keys()) == pages_url
+    assert [album_page.publisher for album_page in album_pages.values()] == ['new1', 'stored', 'new2']
+    assert album_pages['stored'] == stored_page._replace(critic_reviews=7, user_reviews=8)
+    assert [album_page.scraped_at for album_page in album_pages.values()] == [None, '2022-08-01 00:00:00', None]
+
+
+def test_scrape_album_pages_incremental_failed_page_keeps_stored_details(monkeypatch):
+    args = scrape.parse_args(cfg.ARGS_4_TESTS + ['-I'])
+    stored_page = ar.AlbumPage(publisher='stored', details_link='details', scraped_at='2022-08-01 00:00:00')
+    monkeypatch.setattr(scrape.ta, 'get_stored_albums', lambda login_info, links, days: {'stored': stored_page})
+    monkeypatch.setattr(scrape, 'scrape_album_page',
+                        lambda args, pages_url, parse_page: {'stored': ar.missing(ar.ReviewCounts)})
+
+    album_pages = scrape.scrape_album_pages_incremental(args, {}, ['stored'])
+
+    assert album_pages['stored'] == stored_page._replace(critic_reviews=None, user_reviews=None)
+
+
+def test_scrape_album_pages_incremental_no_stored_page_scraped(monkeypatch):
+    args = scrape.parse_args(cfg.ARGS_4_TESTS + ['-I'])
+    stored_pages = {page_url: ar.AlbumPage(publisher=page_url, details_link='details') for page_url in ['s1', 's2']}
+
+    def scrape_album_page(args, pages_url, parse_page=scrape.parse_album_page):
+        if parse_page is scrape.parse_review_counts:
+            raise AttributeError(f'None of the {len(pages_url)} album pages could be scraped')
+        return {page_url: ar.AlbumPage(publisher=page_url) for page_url in pages_url}
+
+    monkeypatch.setattr(scrape.ta, 'get_stored_albums', lambda login_info, links, days: stored_pages)
+    monkeypatch.setattr(scrape, 'scrape_album_page', scrape_album_page)
+
+    album_pages = scrape.scrape_album_pages_incremental(args, {}, ['s1', 'new', 's2'])
+
+    assert album_pages['s1'] == stored_pages['s1']._replace(critic_reviews=None, user_reviews=None)
+    assert album_pages['s2'].publisher == 's2'
+    assert album_pages['new'] == ar.AlbumPage(publisher='new')
+
+
+# ---------------  streaming pipeline  --------------- #
+
+def fake_chart_page(chart_num, page_num, size=2):
+    """
+    Builds the albums of a chart page, the same album appears at the same position on every chart
+    """
+    return [ar.AlbumRecord(album=f'album{rank}', artist=f'artist{rank}', album_link=f'page{rank}', rank=rank)
+            for rank in range(page_num * size + 1, (page_num + 1) * size + 1)]
+
+
+def test_iter_chart_chunks_bounded(monkeypatch):
+    pages = [(0, 0, fake_chart_page(0, 0)), (1, 0, fake_chart_page(1, 0)), (0, 1, fake_chart_page(0, 1)),
+             (1, 1, fake_chart_page(1, 1)), (0, 2, fake_chart_page(0, 2))]
+    monkeypatch.setattr(scrape, 'iter_chart_pages', lambda args, charts_url: iter(pages))
+    monkeypatch.setattr(cfg, 'PIPELINE_CHUNK_SIZE', 4)
+
+    chunks = list(scrape.iter_chart_chunks(None, []))
+
+    assert [{chart_num: [record.rank for record in records] for chart_num, records in chunk.items()}
+            for chunk in chunks] == [{0: [1, 2], 1: [1, 2]}, {0: [3, 4], 1: [3, 4]}, {0: [5, 6]}]
+
+
+def test_scrape_writes_every_chunk_and_enriches_once(monkeypatch):
+    args = scrape.parse_args(['update', '--years', '2021-2022', '-s', 'meta_score'])
+    pages = [(0, 0, fake_chart_page(0, 0)), (1, 0, fake_chart_page(1, 0)), (0, 1, fake_chart_page(0, 1))]
+    searched, written = [], []
+
+    def scrape_spotify_api_albums(args, album_names, artist_names, known_ids=None):
+        searched.extend(album_names)
+        return {album: (f'id_{album[0]}', 10, ('IL',)) for album in zip(album_names, artist_names)}
+
+    def add_chart_data(connection, records, filter_by, year, sort, scrape_datetime=None):
+        written.append((year, [record.spotify_album_id for record in records], scrape_datetime))
+        return len(records)
+
+    monkeypatch.setattr(scrape, 'iter_chart_pages', lambda args, charts_url: iter(pages))
+    monkeypatch.setattr(cfg, 'PIPELINE_CHUNK_SIZE', 4)
+    monkeypatch.setattr(scrape.ta, 'get_spotify_ids', lambda login_info, albums, artists: ({}, {}))
+    monkeypatch.setattr(scrape, 'scrape_spotify_api_albums', scrape_spotify_api_albums)
+    monkeypatch.setattr(scrape, 'scrape_spotify_api_artists',
+                        lambda args, artist_names, known_ids=None: {name: (name, 1, 2) for name in artist_names})
+    monkeypatch.setattr(scrape, 'scrape_album_page',
+                        lambda args, pages_url: {url: ar.AlbumPage(publisher=f'publisher_{url}') for url in pages_url})
+    monkeypatch.setattr(scrape.ta, 'pooled_connection', lambda login_info: contextlib.nullcontext())
+    monkeypatch.setattr(scrape.ta, 'add_chart_data', add_chart_data)
+
+    scrape.scrape(args, {})
+
+    assert searched == ['album1', 'album2', 'album3', 'album4']
+    assert [(year, ids) for year, ids, _ in written] == \
+           [('2021', ['id_album1', 'id_album2']), ('2022', ['id_album1', 'id_album2']),
+            ('2021', ['id_album3', 'id_album4'])]
+    assert len({scrape_datetime for _, _, scrape_datetime in written}) == 1
+
+
+def test_enrich_chunk_fills_records_from_memos(monkeypatch):
+    args = scrape.parse_args(cfg.ARGS_4_TESTS)
+    records = fake_chart_page(0, 0)
+    memos = {'albums': {('album1', 'artist1'): ('a1', 10, ('IL',)), ('album2', 'artist2'): ('a2', 12, ())},
+             'artists': {'artist1': ('r1', 50, 1000), 'artist2': ('r2', 60, 2000)},
+             'pages': {'page1': ar.AlbumPage(publisher='p1', genres=('Rock',)), 'page2': ar.AlbumPage()}}
+    monkeypatch.setattr(scrape.ta, 'get_spotify_ids', None)
+
+    scrape.enrich_chunk(args, {}, records, memos)
+
+    assert (records[0].spotify_album_id, records[0].tracks, records[0].markets) == ('a1', 10, ('IL',))
+    assert (records[1].artist_popularity, records[1].followers) == (60, 2000)
+    assert (records[0].publisher, records[0].genres, records[0].details_scraped_at) == ('p1', ('Rock',), None)
+
+
+def test_enrich_chunk_memos_are_bounded(monkeypatch):
+    args = scrape.parse_args(cfg.ARGS_4_TESTS)
+    memos = {name: {} for name in ['albums', 'artists', 'pages']}
+    monkeypatch.setattr(cfg, 'PIPELINE_MEMO_SIZE', 3)
+    monkeypatch.setattr(scrape.ta, 'get_spotify_ids', lambda login_info, albums, artists: ({}, {}))
+    monkeypatch.setattr(scrape, 'scrape_spotify_api_albums', lambda args, album_names, artist_names, known_ids=None:
+                        {album: ('id', 10, ()) for album in zip(album_names, artist_names)})
+    monkeypatch.setattr(scrape, 'scrape_spotify_api_artists', lambda args, artist_names, known_ids=None:
+                        {name: ('id', 1, 2) for name in artist_names})
+    monkeypatch.setattr(scrape, 'scrape_album_page',
+                        lambda args, pages_url: {url: ar.AlbumPage(publisher=url) for url in pages_url})
+
+    scraped = [scrape.enrich_chunk(args, {}, fake_chart_page(0, page_num), memos) for page_num in range(3)]
+
+    assert scraped == [{'albums': 2, 'artists': 2, 'pages': 2}] * 3
+    assert list(memos['pages'].keys()) == ['page4', 'page5', 'page6']
+    assert all(len(memo) == 3 for memo in memos.values())
+
+
+# ---------------  compact page records  --------------- #
+
+def test_parse_album_page_returns_record_without_tree():
+    content = read_test_page(cfg.TEST_PAGE_FILES[cfg.TEST_PAGES[0]])
+
+    album_page = scrape.parse_album_page(content, cfg.TEST_PAGES[0])
+
+    assert isinstance(album_page, ar.AlbumPage)
+    assert all(type(value) in (str, int, tuple) for value in album_page[:-1])
+    assert album_page.scraped_at is None
+    assert all(type(genre) is str for genre in album_page.genres)
@@ -0,0 +1,147 @@
+import spotify_api as sp
+import http_client as http
+import pytest
+import time
+import config as cfg
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+
+@pytest.fixture(autouse=True)
+def token_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(cfg, 'SPOTIFY_TOKEN_FILE', str(tmp_path / 'spotify_token.json'))
+    sp.invalidate_token()
+    yield
+    sp.invalidate_token()
+
+
+def fake_request_token(calls):
+    def request_token():
+        calls.append(1)
+        return {'access_token': f'token{len(calls)}', 'expires_at': time.time() + 3600}
+    return request_token
+
+
+# ---------------  get_access_token  --------------- #
+
+def test_get_access_token_requests_only_once(monkeypatch):
+    calls = []
+    monkeypatch.setattr(sp, 'request_token', fake_request_token(calls))
+
+    assert sp.get_access_token() == 'token1'
+    assert sp.get_access_token() == 'token1'
+    assert len(calls) == 1
+
+
+def test_get_access_token_shared_through_file(monkeypatch):
+    calls = []
+    monkeypatch.setattr(sp, 'request_token', fake_request_token(calls))
+
+    sp.get_access_token()
+    # a new process starts with an empty memory cache but reads the token file
+    sp.invalidate_token()
+
+    assert sp.get_access_token() == 'token1'
+    assert len(calls) == 1
+
+
+def test_get_access_token_refreshes_before_expiry(monkeypatch):
+    calls = []
+    monkeypatch.setattr(sp, 'request_token', fake_request_token(calls))
+    sp.write_token_file({'access_token': 'old', 'expires_at': time.time() + cfg.SPOTIFY_TOKEN_MARGIN / 2})
+
+    assert sp.get_access_token() == 'token1'
+    assert sp.read_token_file()['access_token'] == 'token1'
+
+
+def test_get_access_token_force_refresh(monkeypatch):
+    calls = []
+    monkeypatch.setattr(sp, 'request_token', fake_request_token(calls))
+
+    sp.get_access_token()
+    assert sp.get_access_token(force_refresh=True) == 'token2'
+
+
+def test_read_token_file_corrupted():
+    with open(cfg.SPOTIFY_TOKEN_FILE, 'w') as outfile:
+        outfile.write('not json')
+
+    assert sp.read_token_file() == {}
+
+
+def test_get_headers(monkeypatch):
+    monkeypatch.setattr(sp, 'request_token', fake_request_token([]))
+
+    assert sp.get_headers() == {'Authorization': 'Bearer token1'}
+
+
+# ---------------  spotify_get  --------------- #
+
+class RateLimitedHandler(BaseHTTPRequestHandler):
+    """
+    Answers every request with 429 Too Many Requests, and counts the requests
+    """
+    requests_num = 0
+
+    def do_GET(self):
+        RateLimitedHandler.requests_num += 1
+        self.send_response(429)
+        self.send_header('Retry-After', '0')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def test_spotify_get_rate_limited_request_has_one_retry_layer(monkeypatch):
+    server = HTTPServer(('127.0.0.1', 0), RateLimitedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(sp, 'get_headers', lambda force_refresh=False: {'Authorization': 'Bearer token'})
+    monkeypatch.setattr(http.JitterRetry, 'get_backoff_time', lambda self: 0)
+    monkeypatch.setattr(http, 'acquire', lambda host: None)
+    monkeypatch.setattr(http, '_circuits', {})
+    RateLimitedHandler.requests_num = 0
+
+    try:
+        response = sp.spotify_get(f'http://127.0.0.1:{server.server_port}/v1/artists?ids=id')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # only the HTTP client retries, spotify_get() doesn't send the request again
+    assert response.status_code == 429
+    assert RateLimitedHandler.requests_num == cfg.HTTP_RETRIES + 1
+
+
+# ---------------  get_several  --------------- #
+
+class FakeResponse:
+    def __init__(self, item_type, ids):
+        self.status_code = 200
+        self.ids = ids
+        self.item_type = item_type
+
+    def json(self):
+        return {self.item_type: [{'id': spotify_id} if spotify_id != 'unknown' else None for spotify_id in self.ids]}
+
+
+def test_get_several_batches_ids(monkeypatch):
+    urls = []
+
+    def spotify_get(url):
+        urls.append(url)
+        return FakeResponse('artists', url.split('ids=')[1].split('%2C'))
+
+    monkeypatch.setattr(sp, 'spotify_get', spotify_get)
+    spotify_ids = [f'id{n}' for n in range(120)] + ['id0', None, 'unknown']
+
+    items = sp.get_several('artists', spotify_ids)
+
+    assert len(urls) == 3
+    assert set(items.keys()) == {f'id{n}' for n in range(120)}
+
+
+def test_get_several_exception_bad_item_type():
+    with pytest.raises(ValueError):
+        sp.get_several('tracks', ['id'])
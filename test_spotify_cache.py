@@ -0,0 +1,61 @@
+import spotify_cache as sc
+import pytest
+import time
+import config as cfg
+
+
+@pytest.fixture(autouse=True)
+def cache_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(cfg, 'SPOTIFY_CACHE_FILE', str(tmp_path / 'spotify_cache.sqlite'))
+    sc.reset_stats()
+
+
+# ---------------  normalize_query  --------------- #
+
+def test_normalize_query():
+    assert sc.normalize_query('  Kanye   WEST ') == 'kanye west'
+    assert sc.normalize_query('Ｂｊöｒｋ') == sc.normalize_query('björk')
+
+
+# ---------------  cache_get & cache_put  --------------- #
+
+def test_cache_get_miss():
+    assert sc.cache_get('artist', 'Robyn') is None
+    assert sc.cache_stats() == {'hits': 0, 'misses': 1}
+
+
+def test_cache_put_then_get_normalized():
+    sc.cache_put('artist', 'Robyn', {'artists': {'items': []}})
+
+    assert sc.cache_get('artist', ' robyn') == {'artists': {'items': []}}
+    assert sc.cache_get('album', 'robyn') is None
+    assert sc.cache_stats() == {'hits': 1, 'misses': 1}
+
+
+def test_cache_get_expired(monkeypatch):
+    sc.cache_put('artist', 'Robyn', {})
+    monkeypatch.setattr(cfg, 'SPOTIFY_CACHE_TTL', -1)
+
+    assert sc.cache_get('artist', 'Robyn') is None
+
+
+def test_cache_put_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(cfg, 'SPOTIFY_CACHE_MAX_ENTRIES', 2)
+    sc.cache_put('artist', 'first', {})
+    time.sleep(0.01)
+    sc.cache_put('artist', 'second', {})
+    time.sleep(0.01)
+    sc.cache_get('artist', 'first')
+    time.sleep(0.01)
+    sc.cache_put('artist', 'third', {})
+
+    assert sc.cache_get('artist', 'first') == {}
+    assert sc.cache_get('artist', 'second') is None
+    assert sc.cache_get('artist', 'third') == {}
+
+
+def test_cache_disabled(monkeypatch):
+    monkeypatch.setattr(cfg, 'SPOTIFY_CACHE_ENABLED', False)
+    sc.cache_put('artist', 'Robyn', {})
+
+    assert sc.cache_get('artist', 'Robyn') is None
@@ -0,0 +1,408 @@
+import top_albums_db as ta
+import album_record as ar
+import pytest
+import json
+import re
+
+
+@pytest.fixture(autouse=True)
+def dimension_ids():
+    ta.invalidate_dimension_ids()
+    yield
+    ta.invalidate_dimension_ids()
+
+
+class FakeCursor:
+    """
+    Records the statements sent to the database and answers the SELECT ... IN lookups from the rows inserted before.
+    It also plays the connection the cursor belongs to
+    """
+
+    def __init__(self):
+        self.statements = []
+        self.tables = {}
+        self.inserted = {}
+        self.result = []
+        self.lastrowid = 1
+        self.open = True
+
+    def cursor(self):
+        return self
+
+    def commit(self):
+        self.statements.append('COMMIT')
+
+    def rollback(self):
+        self.statements.append('ROLLBACK')
+
+    def ping(self, reconnect=False):
+        if not self.open:
+            raise ConnectionError('closed')
+
+    def close(self):
+        pass
+
+    def execute(self, query, args=None):
+        self.statements.append(query)
+        self.result = []
+        match = re.match(r'\s*SELECT (.+?) FROM (\w+) WHERE (\w+) IN', query)
+        if match:
+            columns, table = match.group(1).split(', '), match.group(2)
+            rows = self.tables.get(table, {})
+            self.result = [{columns[0]: list(rows.keys()).index(name) + 1, **rows[name]}
+                           for name in args if name in rows]
+            return
+
+        match = re.match(r'\s*SELECT (.+?) FROM (\w+) WHERE \((\w+), (\w+)\) IN', query)
+        if match:
+            columns, table = match.group(1).split(', '), match.group(2)
+            rows = self.tables.get(table, {})
+            keys = set(zip(args[::2], args[1::2]))
+            self.result = [{columns[0]: n + 1, **row} for n, row in enumerate(rows.values())
+                           if (row[match.group(3)], row[match.group(4)]) in keys]
+            return
+
+        match = re.match(r'\s*SELECT (\w+), \w+ FROM (\w+)$', query)
+        if match:
+            rows = self.tables.get(match.group(2), {})
+            self.result = [{match.group(1): n + 1, **row} for n, row in enumerate(rows.values())]
+
+    def executemany(self, query, args):
+        self.statements.append(query)
+        match = re.match(r'\s*INSERT INTO (\w+)\s*\(([^)]+)\)', query)
+        columns = [column.strip() for column in match.group(2).split(',')]
+        self.inserted.setdefault(match.group(1), []).extend(args)
+        update = query.split('ON DUPLICATE KEY UPDATE')[1] if 'ON DUPLICATE KEY UPDATE' in query else ''
+        assignments = re.findall(r'(\w+)\s*=\s*(COALESCE\(VALUES\(\w+\), \w+\)|VALUES\(\w+\)|\w+)', update)
+        rows = self.tables.setdefault(match.group(1), {})
+        for values in args:
+            row = dict(zip(columns, values))
+            if values[0] in rows:
+                # a duplicate key only updates the columns of the ON DUPLICATE KEY UPDATE clause
+                new_row, row = row, dict(rows[values[0]])
+                for column, expression in assignments:
+                    if expression.startswith('VALUES') or (expression.startswith('COALESCE') and
+                                                           new_row[column] is not None):
+                        row[column] = new_row[column]
+            rows[values[0]] = row
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return self.result
+
+
+def chart_records(albums_num):
+    records = []
+    for n in range(albums_num):
+        record = ar.AlbumRecord(album=f'album{n}', artist=f'artist{n % 3}', release_date='2022-01-01',
+                                summary=f'summary{n}', album_link=f'link{n}', rank=n + 1, metascore=90,
+                                user_score=8.5)
+        record.set_spotify_album(None, 10, tuple(f'M{m}' for m in range(100)))
+        record.set_spotify_artist(None, 50, 1000)
+        record.set_album_page(ar.AlbumPage(publisher=f'publisher{n % 2}', genres=('Rock', 'Pop'), critic_reviews=10,
+                                           user_reviews=20, artist_link='artist_link', publisher_link='publisher_link',
+                                           details_link='details_link'))
+        records.append(record)
+    return records
+
+
+# ---------------  add_chart_data  --------------- #
+
+def test_add_chart_data_constant_number_of_statements():
+    small_cursor = FakeCursor()
+    large_cursor = FakeCursor()
+
+    assert ta.add_chart_data(small_cursor, chart_records(5), 'year', '2022', 'meta_score') == 5
+    ta.invalidate_dimension_ids()
+    assert ta.add_chart_data(large_cursor, chart_records(50), 'year', '2022', 'meta_score') == 50
+
+    assert len(small_cursor.statements) == len(large_cursor.statements)
+    assert small_cursor.statements[-1] == 'COMMIT'
+
+
+def test_add_chart_data_writes_every_row():
+    cursor = FakeCursor()
+
+    ta.add_chart_data(cursor, chart_records(20), 'year', '2022', 'meta_score')
+
+    assert len(cursor.tables['artists']) == 3
+    assert len(cursor.tables['publishers']) == 2
+    assert len(cursor.tables['genres']) == 2
+    assert len(cursor.tables['markets']) == 100
+    assert len(cursor.tables['albums']) == 20
+    assert len(cursor.inserted['albums_to_genres']) == 20 * 2
+    assert len(cursor.inserted['albums_to_markets']) == 20 * 100
+    assert len(cursor.inserted['chart_history']) == 20
+
+
+def test_add_chart_data_keeps_spotify_details_that_were_not_refreshed():
+    cursor = FakeCursor()
+    ta.add_chart_data(cursor, chart_records(3), 'year', '2022', 'meta_score')
+    records = chart_records(3)
+    for record in records:
+        record.set_spotify_album('album_id', None, ())
+        record.set_spotify_artist('artist_id', None, None)
+
+    ta.add_chart_data(cursor, records, 'year', '2021', 'meta_score')
+
+    assert cursor.tables['albums']['album0']['num_of_tracks'] == 10
+    assert cursor.tables['albums']['album0']['spotify_id'] == 'album_id'
+    assert cursor.tables['artists']['artist0']['popularity'] == 50
+    assert cursor.tables['artists']['artist0']['followers_num'] == 1000
+
+
+def test_add_chart_data_failed_album_page_keeps_stored_album():
+    cursor = FakeCursor()
+    ta.add_chart_data(cursor, chart_records(3), 'year', '2022', 'meta_score', '2022-08-01 00:00:00')
+    stored_album = dict(cursor.tables['albums']['album0'])
+    stored_artist = dict(cursor.tables['artists']['artist0'])
+    cursor.inserted.clear()
+    records = chart_records(3)
+    records[0].set_album_page(ar.missing(ar.AlbumPage))
+
+    ta.add_chart_data(cursor, records, 'year', '2022', 'meta_score', '2022-08-02 00:00:00')
+
+    assert cursor.tables['albums']['album0'] == stored_album
+    assert cursor.tables['artists']['artist0'] == stored_artist
+    assert cursor.tables['albums']['album1']['details_scraped_at'] == '2022-08-02 00:00:00'
+    assert None not in cursor.tables['publishers']
+    assert cursor.inserted['chart_history'][0][-2:] == (None, None)
+    assert cursor.inserted['chart_history'][1][-2:] == (10, 20)
+
+
+def test_select_ids_ignores_case():
+    cursor = FakeCursor()
+    cursor.tables['genres'] = {'Rock': {'genre_name': 'Rock'}}
+
+    assert ta.select_ids(cursor, 'genres', 'genre_id', 'genre_name', ['Rock', 'rock', 'Pop']) == {'Rock': 1, 'rock': 1}
+
+
+# ---------------  dimension ids cache  --------------- #
+
+def test_add_chart_data_writes_only_new_dimension_names():
+    cursor = FakeCursor()
+    ta.add_chart_data(cursor, chart_records(5), 'year', '2022', 'meta_score')
+    cursor.inserted.clear()
+
+    ta.add_chart_data(cursor, chart_records(5), 'year', '2021', 'meta_score')
+
+    assert 'genres' not in cursor.inserted
+    assert 'markets' not in cursor.inserted
+    assert 'publishers' not in cursor.inserted
+
+
+def test_dimension_ids_loaded_once():
+    cursor = FakeCursor()
+    cursor.tables['genres'] = {'Rock': {'genre_name': 'Rock'}}
+
+    assert ta.get_dimension_ids(cursor, 'genres') == {'rock': 1}
+    cursor.tables['genres']['Pop'] = {'genre_name': 'Pop'}
+    assert ta.get_dimension_ids(cursor, 'genres') == {'rock': 1}
+
+
+def test_rolled_back_dimension_ids_are_not_cached():
+    cursor = FakeCursor()
+    ta.get_dimension_ids(cursor, 'genres')
+    new_ids = dict()
+
+    ids = ta.resolve_dimension_ids(cursor, 'genres', 'INSERT INTO genres (genre_name) VALUES (%s)',
+                                   {'Jazz': ('Jazz',)}, new_ids)
+
+    assert ids == {'Jazz': 1}
+    assert ta.get_dimension_ids(cursor, 'genres') == {}
+    ta.publish_dimension_ids(new_ids)
+    assert ta.get_dimension_ids(cursor, 'genres') == {'jazz': 1}
+
+
+# ---------------  schema indexes  --------------- #
+
+class SchemaCursor:
+    """
+    Answers the information_schema queries of upgrade_top_albums_db() with a given schema
+    """
+
+    def __init__(self, columns, indexes):
+        self.columns = columns
+        self.indexes = indexes
+        self.statements = []
+        self.result = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, query, args=None):
+        self.statements.append(query)
+        if 'information_schema.COLUMNS' in query:
+            self.result = [{'TABLE_NAME': table, 'COLUMN_NAME': name} for table, name in self.columns]
+        elif 'information_schema.STATISTICS' in query:
+            self.result = [{'TABLE_NAME': table, 'INDEX_NAME': name} for table, name in self.indexes]
+
+    def fetchall(self):
+        return self.result
+
+
+def test_upgrade_top_albums_db_old_schema(monkeypatch):
+    cursor = SchemaCursor(columns=[], indexes=[('albums', 'album_name')])
+    monkeypatch.setattr(ta, 'db_transaction', lambda login_info, database='doron_yair': cursor)
+
+    upgraded = ta.upgrade_top_albums_db({})
+
+    assert upgraded == [statement for _, _, _, statement in ta.schema_upgrades()]
+    assert upgraded.index("ALTER TABLE albums DROP INDEX album_name") > \
+        upgraded.index("ALTER TABLE albums ADD UNIQUE KEY albums_artist_album (artist_id, album_name)")
+
+
+def test_upgrade_top_albums_db_current_schema(monkeypatch):
+    cursor = SchemaCursor(columns=[(table, name) for table, kind, name, _ in ta.schema_upgrades() if kind == 'column'],
+                          indexes=[(table, name) for table, kind, name, _ in ta.schema_upgrades() if kind == 'index'])
+    monkeypatch.setattr(ta, 'db_transaction', lambda login_info, database='doron_yair': cursor)
+
+    assert ta.upgrade_top_albums_db({}) == []
+
+
+@pytest.fixture
+def db_cursor():
+    try:
+        with open("login.json", "r") as openfile:
+            login_info = json.load(openfile)
+        connection = ta.get_connection(login_info)
+    except Exception as e:
+        pytest.skip(f"doron_yair database is not available: {e}")
+    with ta.transaction(connection) as cursor:
+        yield cursor
+    ta.release_connection(login_info, connection)
+
+
+@pytest.mark.parametrize('query, params, index', [
+    ("SELECT album_id FROM albums WHERE artist_id = %s AND album_name = %s", (1, 'album'), 'albums_artist_album'),
+    ("SELECT album_id, artist_id, album_name FROM albums WHERE (artist_id, album_name) IN ((%s, %s), (%s, %s))",
+     (1, 'album', 2, 'album'), 'albums_artist_album'),
+    ("SELECT album_link FROM albums WHERE album_link IN (%s, %s)", ('link1', 'link2'), 'albums_album_link'),
+    ("SELECT chart_id FROM charts WHERE filter_by = %s AND year = %s AND sort_by = %s", ('year', 2022, 'meta_score'),
+     'charts_chart'),
+    ("SELECT * FROM chart_history WHERE album_id = %s ORDER BY scrape_datetime", (1,), 'chart_history_album_time'),
+    ("SELECT * FROM chart_history WHERE chart_id = %s AND scrape_datetime >= %s", (1, '2022-01-01'),
+     'chart_history_chart_time')])
+def test_hot_queries_use_indexes(db_cursor, query, params, index):
+    db_cursor.execute("EXPLAIN " + query, params)
+    plan = db_cursor.fetchone()
+
+    # a unique lookup of a row that doesn't exist is answered from the index before the plan is made
+    assert plan['key'] == index or index in (plan['possible_keys'] or '') or 'const table' in (plan['Extra'] or '')
+
+
+# ---------------  stored Spotify IDs  --------------- #
+
+class SpotifyIdsCursor(SchemaCursor):
+    """
+    Answers the Spotify IDs queries of get_spotify_ids() with an ID for every name, and fails on an empty IN () like
+    MySQL does
+    """
+
+    def __init__(self):
+        super().__init__(columns=[], indexes=[])
+
+    def execute(self, query, args=None):
+        self.statements.append(query)
+        if 'IN ()' in query:
+            raise ValueError('You have an error in your SQL syntax')
+        self.result = [{'artist_name': name, 'album_name': name, 'spotify_id': f'id_{name}'} for name in args]
+
+
+def test_get_spotify_ids_without_album_names_skips_album_query(monkeypatch, caplog):
+    cursor = SpotifyIdsCursor()
+    monkeypatch.setattr(ta, 'db_transaction', lambda login_info, database='doron_yair': cursor)
+
+    artist_ids, album_ids = ta.get_spotify_ids({}, [], ['artist0'])
+
+    assert artist_ids == {'artist0': 'id_artist0'}
+    assert album_ids == {}
+    assert len(cursor.statements) == 1
+    assert not caplog.records
+
+
+# ---------------  connection pool  --------------- #
+
+LOGIN_INFO = {'hostname': 'localhost', 'username': 'user', 'password': 'password'}
+
+
+@pytest.fixture
+def fake_connect(monkeypatch):
+    connections = []
+
+    def connect(**kwargs):
+        connections.append(FakeCursor())
+        return connections[-1]
+
+    ta.close_all_connections()
+    monkeypatch.setattr(ta.pymysql, 'connect', connect)
+    yield connections
+    ta.close_all_connections()
+
+
+def test_add_charts_data_reuses_pooled_connection(fake_connect):
+    ta.add_charts_data([(chart_records(3), 'year', '2022', 'meta_score')], LOGIN_INFO)
+    ta.add_charts_data([(chart_records(3), 'year', '2021', 'meta_score')], LOGIN_INFO)
+
+    assert len(fake_connect) == 1
+    assert fake_connect[0].statements.count('COMMIT') == 2
+
+
+def test_get_connection_replaces_connection_that_failed_health_check(fake_connect, monkeypatch):
+    monkeypatch.setattr(ta.cfg, 'DB_POOL_PING_AFTER', -1)
+    with ta.pooled_connection(LOGIN_INFO) as connection:
+        pass
+    connection.open = False
+
+    with ta.pooled_connection(LOGIN_INFO) as connection:
+        assert connection is fake_connect[1]
+
+
+def test_release_connection_keeps_pool_size(fake_connect, monkeypatch):
+    monkeypatch.setattr(ta.cfg, 'DB_POOL_SIZE', 1)
+    first = ta.get_connection(LOGIN_INFO)
+    second = ta.get_connection(LOGIN_INFO)
+    ta.release_connection(LOGIN_INFO, first)
+    ta.release_connection(LOGIN_INFO, second)
+
+    assert ta.get_connection(LOGIN_INFO) is first
+    assert ta.get_connection(LOGIN_INFO) is fake_connect[2]
+
+
+def test_add_chart_data_rolls_back_failed_chart():
+    cursor = FakeCursor()
+    records = chart_records(3)
+    for record in records:
+        record.markets = None
+
+    assert ta.add_chart_data(cursor, records, 'year', '2022', 'meta_score') == 0
+    assert cursor.statements[-1] == 'ROLLBACK'
+    # the fake cursor keeps the rolled back rows, so the cache itself is checked
+    assert 'genres' not in ta._dimension_ids
+
+
+def test_add_chart_data_reloads_dimension_ids_after_failed_chart(monkeypatch):
+    cursor = FakeCursor()
+    ta.add_chart_data(cursor, chart_records(3), 'year', '2022', 'meta_score')
+    # the genres are deleted behind the cached ids, and the next chart fails on them
+    del cursor.tables['genres']
+    write_chart_data = ta.write_chart_data
+    calls = []
+
+    def write_chart_data_failing_once(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise ValueError('Cannot add or update a child row: a foreign key constraint fails')
+        return write_chart_data(*args)
+
+    monkeypatch.setattr(ta, 'write_chart_data', write_chart_data_failing_once)
+
+    assert ta.add_chart_data(cursor, chart_records(3), 'year', '2021', 'meta_score') == 0
+    cursor.inserted.clear()
+    assert ta.add_chart_data(cursor, chart_records(3), 'year', '2021', 'meta_score') == 3
+    assert {values[0] for values in cursor.inserted['genres']} == {'Rock', 'Pop'}
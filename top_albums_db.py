@@ -3,8 +3,14 @@ File that contains functions related to creating, connecting to, and adding scra
 Authors: Yair Vagshal and Doron Reiffman
 """
 import config as cfg
+import album_record as ar
 import pymysql.cursors
 import logging
+import threading
+import atexit
+import time
+from contextlib import contextmanager
+from datetime import datetime
 
 # Logging definition
 if cfg.LOGFILE_DEBUG:
@@ -14,27 +20,181 @@ else:
     logging.basicConfig(filename=cfg.LOGFILE_NAME, format="%(asctime)s %(levelname)s: %(message)s",
                         level=logging.INFO)
 
+# ids of the small dimension tables, loaded once per process and shared by all the connections.
+# The names are case folded, as MySQL compares them case insensitively
+DIMENSION_TABLES = {'genres': ('genre_id', 'genre_name'), 'markets': ('market_id', 'market_code'),
+                    'publishers': ('publisher_id', 'publisher_name')}
+_dimension_ids = dict()
+_dimension_lock = threading.Lock()
+
+# idle connections of every database, as tuples of the connection and the time it was returned to the pool
+_pools = dict()
+_pools_lock = threading.Lock()
+_pool_stats = {'connects': 0, 'reuses': 0}
+
 
 def connect_to_db(login_info, database=''):
     """
     Connect to created database using login info given (username and password).
-    Returns the connection for use
+    Returns the connection for use, the caller is responsible for closing it
     :param login_info: a dictionary with the username and password information
     :param database: a string with the name of the database
     """
+    count_pool_stat('connects')
 
     if database == '':
         connect = pymysql.connect(host=login_info['hostname'],
                                   user=login_info['username'],
                                   password=login_info['password'],
+                                  connect_timeout=cfg.DB_CONNECT_TIMEOUT,
                                   cursorclass=pymysql.cursors.DictCursor)
     else:
         connect = pymysql.connect(host=login_info['hostname'],
                                   user=login_info['username'],
                                   password=login_info['password'],
                                   database=database,
+                                  connect_timeout=cfg.DB_CONNECT_TIMEOUT,
                                   cursorclass=pymysql.cursors.DictCursor)
-    return connect.cursor()
+    return connect
+
+
+def count_pool_stat(stat):
+    """
+    Increments one of the connection pool counters
+    :param stat: a string, 'connects' or 'reuses'
+    """
+    with _pools_lock:
+        _pool_stats[stat] += 1
+
+
+def pool_stats():
+    """
+    :return: a dictionary with the number of connections opened and the number of times an idle connection was reused
+    """
+    with _pools_lock:
+        return dict(_pool_stats)
+
+
+def get_connection(login_info, database='doron_yair'):
+    """
+    Takes an idle connection from the pool of the database, or opens a new one if there is none.
+    A connection that was idle for more than cfg.DB_POOL_PING_AFTER seconds is checked before it is handed out,
+    and replaced if the server closed it
+    :param login_info: a dictionary with the username and password information
+    :param database: a string with the name of the database
+    :return: a pymysql connection
+    """
+    key = (login_info['hostname'], login_info['username'], database)
+    while True:
+        with _pools_lock:
+            idle = _pools.get(key)
+            if not idle:
+                break
+            connection, released_at = idle.pop()
+
+        if time.time() - released_at <= cfg.DB_POOL_PING_AFTER:
+            count_pool_stat('reuses')
+            return connection
+        try:
+            connection.ping(reconnect=False)
+            count_pool_stat('reuses')
+            return connection
+        except Exception as e:
+            logging.info(f"Dropping a pooled database connection that failed its health check. {e}")
+            close_connection(connection)
+
+    return connect_to_db(login_info, database)
+
+
+def release_connection(login_info, connection, database='doron_yair'):
+    """
+    Returns a connection taken by get_connection() to the pool. Connections beyond cfg.DB_POOL_SIZE idle connections
+    and connections that were closed are not kept
+    :param login_info: a dictionary with the username and password information
+    :param connection: a pymysql connection
+    :param database: a string with the name of the database
+    """
+    key = (login_info['hostname'], login_info['username'], database)
+    with _pools_lock:
+        idle = _pools.setdefault(key, list())
+        if connection.open and len(idle) < cfg.DB_POOL_SIZE:
+            idle.append((connection, time.time()))
+            return
+
+    close_connection(connection)
+
+
+def close_connection(connection):
+    """
+    Closes a connection, ignoring errors of connections the server already closed
+    :param connection: a pymysql connection
+    """
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+def close_all_connections():
+    """
+    Closes all the idle connections of all the pools
+    """
+    with _pools_lock:
+        connections = [connection for idle in _pools.values() for connection, _ in idle]
+        _pools.clear()
+
+    for connection in connections:
+        close_connection(connection)
+
+
+atexit.register(close_all_connections)
+
+
+@contextmanager
+def pooled_connection(login_info, database='doron_yair'):
+    """
+    Context manager that lends a pooled connection and returns it to the pool when done
+    :param login_info: a dictionary with the username and password information
+    :param database: a string with the name of the database
+    :return: a pymysql connection
+    """
+    connection = get_connection(login_info, database)
+    try:
+        yield connection
+    finally:
+        release_connection(login_info, connection, database)
+
+
+@contextmanager
+def transaction(connection):
+    """
+    Context manager of a transaction: the changes made through the cursor are committed if the block succeeds, and
+    rolled back if it raises
+    :param connection: a pymysql connection
+    :return: a cursor of the connection
+    """
+    cursor = connection.cursor()
+    try:
+        yield cursor
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+@contextmanager
+def db_transaction(login_info, database='doron_yair'):
+    """
+    Context manager of a single transaction on a pooled connection
+    :param login_info: a dictionary with the username and password information
+    :param database: a string with the name of the database
+    :return: a cursor of the connection
+    """
+    with pooled_connection(login_info, database) as connection:
+        with transaction(connection) as cursor:
+            yield cursor
 
 
 def charts_table_description():
@@ -46,7 +206,8 @@ def charts_table_description():
                                       chart_id int PRIMARY KEY AUTO_INCREMENT, \
                                       filter_by varchar(255), \
                                       year int, \
-                                      sort_by varchar(255)\
+                                      sort_by varchar(255),\
+                                      UNIQUE KEY charts_chart (filter_by, year, sort_by)\
                                       );"}
 
 
@@ -82,7 +243,8 @@ def artists_table_description():
                                     artist_name varchar(255) UNIQUE,\
                                     artist_link varchar(255),\
                                     popularity INT,\
-                                    followers_num INT\
+                                    followers_num INT,\
+                                    spotify_id varchar(64)\
                                     );"}
 
 
@@ -116,7 +278,7 @@ def albums_table_description():
 
     return {"albums": "CREATE TABLE IF NOT EXISTS albums (\
                                   album_id int PRIMARY KEY AUTO_INCREMENT, \
-                                  album_name varchar(255) UNIQUE, \
+                                  album_name varchar(255), \
                                   album_link varchar(255), \
                                   details_and_credits_link varchar(255),\
                                   amazon_link TEXT,\
@@ -125,6 +287,10 @@ def albums_table_description():
                                   artist_id int,\
                                   publisher_id int, \
                                   num_of_tracks int, \
+                                  spotify_id varchar(64), \
+                                  details_scraped_at datetime, \
+                                  UNIQUE KEY albums_artist_album (artist_id, album_name),\
+                                  KEY albums_album_link (album_link),\
                                   FOREIGN KEY (summary_id) REFERENCES summaries(summary_id),\
                                   FOREIGN KEY (artist_id) REFERENCES artists(artist_id),\
                                   FOREIGN KEY (publisher_id) REFERENCES publishers(publisher_id)\
@@ -174,6 +340,8 @@ def chart_history_table_description():
                                   user_score float,\
                                   num_of_critic_reviews int,\
                                   num_of_user_reviews int,\
+                                  KEY chart_history_album_time (album_id, scrape_datetime),\
+                                  KEY chart_history_chart_time (chart_id, scrape_datetime),\
                                   FOREIGN KEY (chart_id) REFERENCES charts(chart_id),\
                                   FOREIGN KEY (album_id) REFERENCES albums(album_id)\
                                   );"}
@@ -188,11 +356,14 @@ def create_top_albums_db(login_info):
     :param login_info: a dictionary with the username and password information
     """
 
-    with connect_to_db(login_info) as cursor:
+    with connect_to_db(login_info) as connection, connection.cursor() as cursor:
 
-        # Delete doron_yair database if it exists, and then create doron_yair
+        # Delete doron_yair database if it exists, and then create doron_yair.
+        # Pooled connections and cached ids of the old database are dropped with it
         sql_drop = "DROP DATABASE IF EXISTS doron_yair"
         cursor.execute(sql_drop)
+        close_all_connections()
+        invalidate_dimension_ids()
         sql = "CREATE DATABASE doron_yair"
         cursor.execute(sql)
 
@@ -225,6 +396,150 @@ def create_top_albums_db(login_info):
             cursor.execute("rollback")
 
 
+def schema_upgrades():
+    """
+    :return: a list of tuples with the table, the kind ('column', 'index' or 'drop index') and the name of every
+    change made to the schema since the first version of doron_yair database, and the statement that makes it.
+    The changes are listed in the order they must be made
+    """
+
+    return [('artists', 'column', 'spotify_id', "ALTER TABLE artists ADD COLUMN spotify_id varchar(64)"),
+            ('albums', 'column', 'spotify_id', "ALTER TABLE albums ADD COLUMN spotify_id varchar(64)"),
+            ('albums', 'column', 'details_scraped_at', "ALTER TABLE albums ADD COLUMN details_scraped_at datetime"),
+            ('albums', 'index', 'albums_artist_album',
+             "ALTER TABLE albums ADD UNIQUE KEY albums_artist_album (artist_id, album_name)"),
+            ('albums', 'drop index', 'album_name', "ALTER TABLE albums DROP INDEX album_name"),
+            ('albums', 'index', 'albums_album_link', "ALTER TABLE albums ADD KEY albums_album_link (album_link)"),
+            ('charts', 'index', 'charts_chart',
+             "ALTER TABLE charts ADD UNIQUE KEY charts_chart (filter_by, year, sort_by)"),
+            ('chart_history', 'index', 'chart_history_album_time',
+             "ALTER TABLE chart_history ADD KEY chart_history_album_time (album_id, scrape_datetime)"),
+            ('chart_history', 'index', 'chart_history_chart_time',
+             "ALTER TABLE chart_history ADD KEY chart_history_chart_time (chart_id, scrape_datetime)")]
+
+
+def upgrade_top_albums_db(login_info):
+    """
+    Brings a doron_yair database created by an older version of the program up to the current schema: adds the
+    missing columns and the lookup indexes, and replaces the unique album name by a unique album name per artist.
+    Changes that were already made are skipped, so it can be run any number of times
+    :param login_info: a dictionary with the username and password information
+    :return: a list with the statements that were run
+    """
+    upgraded = list()
+
+    with db_transaction(login_info) as cursor:
+        cursor.execute("SELECT TABLE_NAME, COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE()")
+        columns = {(row['TABLE_NAME'], row['COLUMN_NAME']) for row in cursor.fetchall()}
+        cursor.execute("SELECT DISTINCT TABLE_NAME, INDEX_NAME FROM information_schema.STATISTICS "
+                       "WHERE TABLE_SCHEMA = DATABASE()")
+        indexes = {(row['TABLE_NAME'], row['INDEX_NAME']) for row in cursor.fetchall()}
+
+        for table, kind, name, statement in schema_upgrades():
+            exists = (table, name) in (columns if kind == 'column' else indexes)
+            if exists == (kind == 'drop index'):
+                try:
+                    cursor.execute(statement)
+                    upgraded.append(statement)
+                    logging.info(f"Database schema upgraded: {statement}")
+                except Exception as e:
+                    logging.critical(f"Failed upgrading database schema: {statement}.\n{e}")
+
+    return upgraded
+
+
+def get_spotify_ids(login_info, album_names, artist_names):
+    """
+    Finds the Spotify IDs already stored in doron_yair database for the given albums and artists, so they can be
+    refreshed with Spotify's multi-ID endpoints instead of being searched again
+    :param login_info: a dictionary with the username and password information
+    :param album_names: a list of albums in the searched chart
+    :param artist_names: a list of artists of the albums in the searched chart
+    :return: a dictionary from artist name to Spotify ID
+    :return: a dictionary from (album name, artist name) to Spotify ID
+    """
+    artist_ids = dict()
+    album_ids = dict()
+    if not artist_names:
+        return artist_ids, album_ids
+
+    try:
+        with db_transaction(login_info) as cursor:
+            placeholders = ', '.join(['%s'] * len(set(artist_names)))
+            query = f"SELECT artist_name, spotify_id FROM artists " \
+                    f"WHERE spotify_id IS NOT NULL AND artist_name IN ({placeholders})"
+            cursor.execute(query, list(set(artist_names)))
+            artist_ids = {row['artist_name']: row['spotify_id'] for row in cursor.fetchall()}
+
+            # an empty IN () is a syntax error, and there are no album IDs to find anyway
+            if album_names:
+                placeholders = ', '.join(['%s'] * len(set(album_names)))
+                query = f"SELECT album_name, artist_name, albums.spotify_id FROM albums " \
+                        f"JOIN artists ON albums.artist_id = artists.artist_id " \
+                        f"WHERE albums.spotify_id IS NOT NULL AND album_name IN ({placeholders})"
+                cursor.execute(query, list(set(album_names)))
+                album_ids = {(row['album_name'], row['artist_name']): row['spotify_id']
+                             for row in cursor.fetchall()}
+
+    except Exception as e:
+        logging.warning(f"Could not read Spotify IDs from the database. All albums and artists will be searched.\n{e}")
+
+    return artist_ids, album_ids
+
+
+def get_stored_albums(login_info, album_links, max_age_days):
+    """
+    Finds the albums whose album page details are already stored in doron_yair database and were scraped in the
+    last max_age_days days, so their album pages don't have to be scraped in full again
+    :param login_info: a dictionary with the username and password information
+    :param album_links: a list of links to album pages
+    :param max_age_days: an integer, albums whose details were scraped longer ago are considered stale
+    :return: a dictionary from link to album page to an AlbumPage with the stored details. The review counts are left
+    for the caller to scrape and the album cover image is not stored
+    """
+    stored_albums = dict()
+    if not album_links:
+        return stored_albums
+
+    try:
+        with db_transaction(login_info) as cursor:
+            placeholders = ', '.join(['%s'] * len(set(album_links)))
+            query = f"SELECT album_link, details_and_credits_link, amazon_link, details_scraped_at, artist_link, " \
+                    f"publisher_name, publisher_link FROM albums " \
+                    f"JOIN artists ON albums.artist_id = artists.artist_id " \
+                    f"LEFT JOIN publishers ON albums.publisher_id = publishers.publisher_id " \
+                    f"WHERE details_scraped_at >= NOW() - INTERVAL %s DAY AND album_link IN ({placeholders})"
+            cursor.execute(query, [max_age_days] + list(set(album_links)))
+            for row in cursor.fetchall():
+                stored_albums[row['album_link']] = ar.AlbumPage(
+                    publisher=row['publisher_name'] or '',
+                    artist_link=row['artist_link'],
+                    publisher_link=row['publisher_link'] or '',
+                    user_reviews_link=row['album_link'] + '/user-reviews',
+                    details_link=row['details_and_credits_link'],
+                    critic_reviews_link=row['album_link'] + '/critic-reviews',
+                    amazon_link=row['amazon_link'] or '',
+                    scraped_at=str(row['details_scraped_at']))
+
+            if stored_albums:
+                placeholders = ', '.join(['%s'] * len(stored_albums))
+                query = f"SELECT album_link, genre_name FROM albums " \
+                        f"JOIN albums_to_genres ON albums.album_id = albums_to_genres.album_id " \
+                        f"JOIN genres ON albums_to_genres.genre_id = genres.genre_id " \
+                        f"WHERE album_link IN ({placeholders})"
+                cursor.execute(query, list(stored_albums.keys()))
+                for row in cursor.fetchall():
+                    album_page = stored_albums[row['album_link']]
+                    stored_albums[row['album_link']] = album_page._replace(
+                        genres=album_page.genres + (row['genre_name'],))
+
+    except Exception as e:
+        logging.warning(f"Could not read stored albums from the database. All album pages will be scraped.\n{e}")
+        return dict()
+
+    return stored_albums
+
+
 def update_charts_table(cursor, filter_by_arg, year_arg, sort_by_arg):
     """
     Take dictionary of scraped data and add relevant information to charts table in doron_yair database
@@ -253,235 +568,278 @@ def update_charts_table(cursor, filter_by_arg, year_arg, sort_by_arg):
     return cursor, chart_id
 
 
-def update_albums_table(cursor, row, artist_id, publisher_id, summary_id):
+def select_ids(cursor, table, id_column, name_column, names):
     """
-    Take dictionary of scraped data and add relevant information to albums table in doron_yair database
+    Finds the ids of the given names in a table, cfg.DB_BATCH_SIZE names per query
     :param cursor: cursor of pymysql.connect
-    :param row: a Series with the scrapped information of an album from the chart
-    :param artist_id:
-    :param publisher_id:
-    :param summary_id:
-    :return: cursor: cursor of pymysql.connect
-    :return: album_id:
+    :param table: a string with the table name
+    :param id_column: a string with the name of the id column
+    :param name_column: a string with the name of the unique name column
+    :param names: an iterable of names
+    :return: a dictionary from name to id, names that are not in the table are missing from it
+    """
+    names = list(dict.fromkeys(names))
+    stored_ids = dict()
+    for i in range(0, len(names), cfg.DB_BATCH_SIZE):
+        batch = names[i:i + cfg.DB_BATCH_SIZE]
+        query = f"SELECT {id_column}, {name_column} FROM {table} " \
+                f"WHERE {name_column} IN ({', '.join(['%s'] * len(batch))})"
+        cursor.execute(query, batch)
+        stored_ids.update({row[name_column]: row[id_column] for row in cursor.fetchall()})
+
+    # MySQL compares names case insensitively, so a name may be stored with a different case than it was scraped
+    folded_ids = {name.casefold(): stored_id for name, stored_id in stored_ids.items()}
+    return {name: stored_ids[name] if name in stored_ids else folded_ids[name.casefold()] for name in names
+            if name in stored_ids or name.casefold() in folded_ids}
+
+
+def get_dimension_ids(cursor, table):
+    """
+    Returns the cached ids of a dimension table, loading the whole table on first use
+    :param cursor: cursor of pymysql.connect
+    :param table: a string with the table name, one of DIMENSION_TABLES
+    :return: a dictionary from case folded name to id
     """
+    with _dimension_lock:
+        if table not in _dimension_ids:
+            id_column, name_column = DIMENSION_TABLES[table]
+            cursor.execute(f"SELECT {id_column}, {name_column} FROM {table}")
+            _dimension_ids[table] = {row[name_column].casefold(): row[id_column] for row in cursor.fetchall()
+                                     if row[name_column] is not None}
+            logging.debug(f"Loaded {len(_dimension_ids[table])} {table} ids")
+        return dict(_dimension_ids[table])
 
-    # Find if album already exists
-    query = "SELECT album_id FROM albums WHERE artist_id = (%s) AND album_name = (%s)"
-    cursor.execute(query, (artist_id, row['Album']))
-    album_id = cursor.fetchone()
 
-    # Insert if not exists
-    if album_id is None:
-        # sql command to add a record into albums table with name, link to Metacritic album page, link to Metacritic
-        # page with more album details, link to purchase album on Amazon, and album release date.
-        query = "INSERT INTO albums (album_name, album_link, details_and_credits_link, amazon_link, " \
-                "release_date, num_of_tracks, artist_id, publisher_id, summary_id) " \
-                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) " \
-                "ON DUPLICATE KEY UPDATE album_name=album_name"
-        cursor.execute(query, (row['Album'], row['Link to Album Page'], row['Link to More Details and Album Credits'],
-                               row['Amazon Link'], row['Release Date'], row['Number of Tracks'],
-                               artist_id, publisher_id, summary_id))
-        album_id = cursor.lastrowid
-    else:
-        album_id = album_id['album_id']
-
-    return cursor, album_id
+def publish_dimension_ids(new_ids):
+    """
+    Adds the ids written by a committed transaction to the cache. Ids written by a transaction that is rolled back
+    are never published, so other connections never see ids that don't exist
+    :param new_ids: a dictionary from table name to a dictionary from name to id
+    """
+    with _dimension_lock:
+        for table, ids in new_ids.items():
+            if table in _dimension_ids:
+                _dimension_ids[table].update({name.casefold(): new_id for name, new_id in ids.items()})
 
 
-def update_artists_table(cursor, row):
+def invalidate_dimension_ids():
     """
-    Take dictionary of scraped data and add relevant information to artists table in doron_yair database
-    :param cursor: cursor of pymysql.connect
-    :param row: a Series with the scrapped information of an album from the chart
-    :return: cursor: cursor of pymysql.connect
-    :return: artist_id
+    Forgets all the cached ids, so they are loaded from the database again on next use
     """
+    with _dimension_lock:
+        _dimension_ids.clear()
 
-    # Find if artist already exists
-    query = "SELECT artist_id FROM artists WHERE artist_name = (%s)"
-    cursor.execute(query, (row['Artist']))
-    artist_id = cursor.fetchone()
 
-    # Insert if not exists
-    if artist_id is None:
-        # sql command to add a record into artists table with name and link to Metacritic artist page
-        query = "INSERT INTO artists (artist_name, artist_link, popularity, followers_num) VALUES (%s, %s, %s, %s)"
-        cursor.execute(query, (row['Artist'], row['Link to Artist Page'],
-                               row['Spotify Artist Popularity'], row['Number of Spotify Followers']))
-        artist_id = cursor.lastrowid
-    else:
-        artist_id = artist_id['artist_id']
+def resolve_dimension_ids(cursor, table, query, values, new_ids):
+    """
+    Finds the ids of names of a dimension table in the cache, and writes only the names that are missing from it.
+    Names written by another connection meanwhile are not duplicated, they are found by the insert's unique key
+    :param cursor: cursor of pymysql.connect
+    :param table: a string with the table name, one of DIMENSION_TABLES
+    :param query: a string with the INSERT ... ON DUPLICATE KEY UPDATE statement of the table
+    :param values: a dictionary from name to the parameters of the insert statement
+    :param new_ids: a dictionary from table name to the ids written by the current transaction, updated in place
+    :return: a dictionary from name to id
+    """
+    cached_ids = get_dimension_ids(cursor, table)
+    pending_ids = {name.casefold(): new_id for name, new_id in new_ids.get(table, dict()).items()}
+
+    ids = dict()
+    missing = dict()
+    for name, params in values.items():
+        new_id = cached_ids.get(name.casefold(), pending_ids.get(name.casefold()))
+        if new_id is None:
+            missing[name] = params
+        else:
+            ids[name] = new_id
+
+    if missing:
+        cursor.executemany(query, list(missing.values()))
+        id_column, name_column = DIMENSION_TABLES[table]
+        written_ids = select_ids(cursor, table, id_column, name_column, missing.keys())
+        new_ids.setdefault(table, dict()).update(written_ids)
+        ids.update(written_ids)
 
-    return cursor, artist_id
+    return ids
 
 
-def update_summaries_table(cursor, row):
+def update_artists_table(cursor, records):
     """
-    Take dictionary of scraped data and add relevant information to summaries table in doron_yair database
+    Take the scraped data and add relevant information to artists table in doron_yair database.
+    New artists are inserted and the popularity and followers of existing artists are refreshed in one statement.
+    Popularity and followers that Spotify did not return (None) keep their stored values
     :param cursor: cursor of pymysql.connect
-    :param row: a Series with the scrapped information of an album from the chart
+    :param records: a list with the AlbumRecords of the albums of the chart
     :return: cursor: cursor of pymysql.connect
-    :return: summary_id
+    :return: a dictionary from artist name to artist_id
     """
+    # the artist link comes from the album page, so records whose page was scraped are preferred
+    artists = {record.artist: record for record in sorted(records, key=ar.AlbumRecord.has_album_page)}
 
-    # Find if summary already exists
-    query = "SELECT summary_id FROM summaries WHERE summary = (%s)"
-    cursor.execute(query, (row['Summary']))
-    summary_id = cursor.fetchone()
+    query = "INSERT INTO artists (artist_name, artist_link, popularity, followers_num, spotify_id) " \
+            "VALUES (%s, %s, %s, %s, %s) " \
+            "ON DUPLICATE KEY UPDATE popularity = COALESCE(VALUES(popularity), popularity), " \
+            "followers_num = COALESCE(VALUES(followers_num), followers_num), " \
+            "spotify_id = COALESCE(VALUES(spotify_id), spotify_id)"
+    cursor.executemany(query, [(name, record.artist_link, record.artist_popularity, record.followers,
+                                record.spotify_artist_id) for name, record in artists.items()])
 
-    # Insert if not exists
-    if summary_id is None:
-        # sql command to add a record into summaries table with album's summary
-        query = "INSERT INTO summaries (summary) VALUES (%s)"
-        cursor.execute(query, (row['Summary']))
-        summary_id = cursor.lastrowid
-    else:
-        summary_id = summary_id['summary_id']
+    return cursor, select_ids(cursor, 'artists', 'artist_id', 'artist_name', artists.keys())
 
-    return cursor, summary_id
 
-
-def update_publishers_table(cursor, row):
+def update_summaries_table(cursor, records):
     """
-    Take dictionary of scraped data and add relevant information to publishers table in doron_yair database
+    Take the scraped data and add relevant information to summaries table in doron_yair database
     :param cursor: cursor of pymysql.connect
-    :param row: a Series with the scrapped information of an album from the chart
+    :param records: a list with the AlbumRecords of the albums of the chart
     :return: cursor: cursor of pymysql.connect
-    :return: publisher_id
+    :return: a dictionary from summary to summary_id
     """
+    summaries = list(dict.fromkeys(record.summary for record in records))
 
-    # Find if publisher already exists
-    query = "SELECT publisher_id FROM publishers WHERE publisher_name = (%s)"
-    cursor.execute(query, (row['Publisher']))
-    publisher_id = cursor.fetchone()
+    query = "INSERT INTO summaries (summary) VALUES (%s) ON DUPLICATE KEY UPDATE summary=summary"
+    cursor.executemany(query, [(summary,) for summary in summaries])
 
-    # Insert if not exists
-    if publisher_id is None:
-        # sql command to add a record into the publishers table with name and link to Metacritic publisher page
-        query = "INSERT INTO publishers (publisher_name, publisher_link) VALUES (%s, %s) " \
-                "ON DUPLICATE KEY UPDATE publisher_name=publisher_name"
-        cursor.execute(query, (row['Publisher'], row['Link to Publisher Page']))
-        publisher_id = cursor.lastrowid
-    else:
-        publisher_id = publisher_id['publisher_id']
+    return cursor, select_ids(cursor, 'summaries', 'summary_id', 'summary', summaries)
 
-    return cursor, publisher_id
 
-
-def update_genres_table(cursor, row):
+def update_publishers_table(cursor, records, new_ids):
     """
-    Take dictionary of scraped data and add relevant information to genres table in doron_yair database
+    Take the scraped data and add relevant information to publishers table in doron_yair database.
+    Only publishers missing from the cache are written, and albums whose page could not be scraped have none
     :param cursor: cursor of pymysql.connect
-    :param row: a Series with the scrapped information of an album from the chart
+    :param records: a list with the AlbumRecords of the albums of the chart
+    :param new_ids: a dictionary from table name to the ids written by the current transaction
     :return: cursor: cursor of pymysql.connect
-    :return: genre_id
-    """
-    genre_id_list = list()
-    for genre in row['Album Genres']:
-
-        # Find if genre already exists
-        query = "SELECT genre_id FROM genres WHERE genre_name = (%s)"
-        cursor.execute(query, genre)
-        genre_id = cursor.fetchone()
-
-        # Insert if not exists
-        if genre_id is None:
-            # sql command to add a genre into genres table
-            query = "INSERT INTO genres (genre_name) VALUES (%s) "
-            cursor.execute(query, genre)
-            genre_id_list.append(cursor.lastrowid)
-        else:
-            genre_id_list.append(genre_id['genre_id'])
+    :return: a dictionary from publisher name to publisher_id
+    """
+    publishers = {record.publisher: (record.publisher, record.publisher_link) for record in records
+                  if record.publisher is not None}
+
+    query = "INSERT INTO publishers (publisher_name, publisher_link) VALUES (%s, %s) " \
+            "ON DUPLICATE KEY UPDATE publisher_name=publisher_name"
 
-    return cursor, genre_id_list
+    return cursor, resolve_dimension_ids(cursor, 'publishers', query, publishers, new_ids)
 
 
-def update_markets_table(cursor, row):
+def update_genres_table(cursor, records, new_ids):
     """
-    Take dictionary of scraped data and add relevant information to markets table in doron_yair database
+    Take the scraped data and add relevant information to genres table in doron_yair database.
+    Only genres missing from the cache are written
     :param cursor: cursor of pymysql.connect
-    :param row: a Series with the scrapped information of an album from the chart
+    :param records: a list with the AlbumRecords of the albums of the chart
+    :param new_ids: a dictionary from table name to the ids written by the current transaction
     :return: cursor: cursor of pymysql.connect
-    :return: market_id
+    :return: a dictionary from genre name to genre_id
     """
-    market_id_list = list()
+    genres = {genre: (genre,) for record in records for genre in record.genres}
 
-    for market in row['Available Markets']:
+    query = "INSERT INTO genres (genre_name) VALUES (%s) ON DUPLICATE KEY UPDATE genre_name=genre_name"
 
-        # Find if market already exists
-        query = "SELECT market_id FROM markets WHERE market_code = (%s)"
-        cursor.execute(query, market)
-        market_id = cursor.fetchone()
-
-        # Insert if not exists
-        if market_id is None:
-            # sql command to add a genre into genres table
-            query = "INSERT INTO markets (market_code) VALUES (%s) "
-            cursor.execute(query, market)
-            market_id_list.append(cursor.lastrowid)
-        else:
-            market_id_list.append(market_id['market_id'])
+    return cursor, resolve_dimension_ids(cursor, 'genres', query, genres, new_ids)
 
-    return cursor, market_id_list
 
-
-def update_albums_to_markets(cursor, album_id, market_id_list):
+def update_markets_table(cursor, records, new_ids):
     """
-    Take dictionary of scraped data and add relevant information to markets table in doron_yair database
+    Take the scraped data and add relevant information to markets table in doron_yair database.
+    Only markets missing from the cache are written
     :param cursor: cursor of pymysql.connect
-    :param album_id:
-    :param market_id_list:
+    :param records: a list with the AlbumRecords of the albums of the chart
+    :param new_ids: a dictionary from table name to the ids written by the current transaction
     :return: cursor: cursor of pymysql.connect
+    :return: a dictionary from market code to market_id
     """
+    markets = {market: (market,) for record in records for market in record.markets}
 
-    for market_id in market_id_list:
-
-        # Find if album_id and market_id already exists
-        query = "SELECT * FROM albums_to_markets WHERE album_id = (%s) AND market_id = (%s)"
-        cursor.execute(query, (album_id, market_id))
-        market_album = cursor.fetchone()
+    query = "INSERT INTO markets (market_code) VALUES (%s) ON DUPLICATE KEY UPDATE market_code=market_code"
 
-        # Insert if not exists
-        if market_album is None:
-            # sql command to add album_id and market_id into market_to_genres table
-            query = "INSERT INTO albums_to_markets (album_id, market_id) VALUES (%s, %s)"
-            cursor.execute(query, (album_id, market_id))
-
-    return cursor
+    return cursor, resolve_dimension_ids(cursor, 'markets', query, markets, new_ids)
 
 
-def update_albums_to_genres(cursor, album_id, genre_id_list):
+def update_albums_table(cursor, records, artist_ids, publisher_ids, summary_ids, scrape_datetime):
     """
-    Take dictionary of scraped data and add relevant information to genres table in doron_yair database
+    Take the scraped data and add relevant information to albums table in doron_yair database.
+    New albums are inserted, and the details Spotify and the album page may have changed are refreshed for the
+    existing albums in the same statement. A number of tracks that Spotify did not return (None) keeps its stored value,
+    and albums whose page could not be scraped keep their stored page details and details_scraped_at
     :param cursor: cursor of pymysql.connect
-    :param album_id:
-    :param genre_id_list:
+    :param records: a list with the AlbumRecords of the albums of the chart
+    :param artist_ids: a dictionary from artist name to artist_id
+    :param publisher_ids: a dictionary from publisher name to publisher_id
+    :param summary_ids: a dictionary from summary to summary_id
+    :param scrape_datetime: a string with the time of the scrape, used for albums whose details were scraped in this
+    run. Details that were taken from the database in incremental mode keep the time they were scraped at
+    :return: cursor: cursor of pymysql.connect
+    :return: a dictionary from (artist_id, album name) to album_id
+    """
+    albums = {(artist_ids.get(record.artist), record.album): record for record in records}
+
+    query = "INSERT INTO albums (album_name, album_link, details_and_credits_link, amazon_link, release_date, " \
+            "num_of_tracks, spotify_id, details_scraped_at, artist_id, publisher_id, summary_id) " \
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) " \
+            "ON DUPLICATE KEY UPDATE num_of_tracks = COALESCE(VALUES(num_of_tracks), num_of_tracks), " \
+            "spotify_id = COALESCE(VALUES(spotify_id), spotify_id), album_link = VALUES(album_link), " \
+            "details_and_credits_link = COALESCE(VALUES(details_and_credits_link), details_and_credits_link), " \
+            "amazon_link = COALESCE(VALUES(amazon_link), amazon_link), " \
+            "publisher_id = COALESCE(VALUES(publisher_id), publisher_id), " \
+            "details_scraped_at = COALESCE(VALUES(details_scraped_at), details_scraped_at)"
+    cursor.executemany(query, [(album_name, record.album_link, record.details_link, record.amazon_link,
+                                record.release_date, record.tracks, record.spotify_album_id,
+                                record.details_scraped_at or (scrape_datetime if record.has_album_page() else None),
+                                artist_id,
+                                publisher_ids.get(record.publisher), summary_ids.get(record.summary))
+                               for (artist_id, album_name), record in albums.items()])
+
+    # the albums are looked up by the unique (artist_id, album_name) index
+    album_keys = list(albums.keys())
+    stored_ids = dict()
+    for i in range(0, len(album_keys), cfg.DB_BATCH_SIZE):
+        batch = album_keys[i:i + cfg.DB_BATCH_SIZE]
+        query = f"SELECT album_id, artist_id, album_name FROM albums " \
+                f"WHERE (artist_id, album_name) IN ({', '.join(['(%s, %s)'] * len(batch))})"
+        cursor.execute(query, [value for album_key in batch for value in album_key])
+        stored_ids.update({(row['artist_id'], row['album_name'].casefold()): row['album_id']
+                           for row in cursor.fetchall()})
+
+    album_ids = {(artist_id, album_name): stored_ids[(artist_id, album_name.casefold())]
+                 for artist_id, album_name in albums.keys() if (artist_id, album_name.casefold()) in stored_ids}
+    return cursor, album_ids
+
+
+def update_albums_to_genres(cursor, album_genres):
+    """
+    Take the scraped data and add relevant information to albums_to_genres table in doron_yair database
+    :param cursor: cursor of pymysql.connect
+    :param album_genres: a list of tuples of album_id and genre_id
     :return: cursor: cursor of pymysql.connect
     """
+    query = "INSERT INTO albums_to_genres (album_id, genre_id) VALUES (%s, %s) " \
+            "ON DUPLICATE KEY UPDATE genre_id=genre_id"
+    cursor.executemany(query, list(dict.fromkeys(album_genres)))
 
-    for genre_id in genre_id_list:
+    return cursor
 
-        # Find if album_id and genre_id already exists
-        query = "SELECT * FROM albums_to_genres WHERE album_id = (%s) AND genre_id = (%s)"
-        cursor.execute(query, (album_id, genre_id))
-        genre_album = cursor.fetchone()
 
-        # Insert if not exists
-        if genre_album is None:
-            # sql command to add album_id and genre_id into albums_to_genres table
-            query = "INSERT INTO albums_to_genres (album_id, genre_id) VALUES (%s, %s)"
-            cursor.execute(query, (album_id, genre_id))
+def update_albums_to_markets(cursor, album_markets):
+    """
+    Take the scraped data and add relevant information to albums_to_markets table in doron_yair database
+    :param cursor: cursor of pymysql.connect
+    :param album_markets: a list of tuples of album_id and market_id
+    :return: cursor: cursor of pymysql.connect
+    """
+    query = "INSERT INTO albums_to_markets (album_id, market_id) VALUES (%s, %s) " \
+            "ON DUPLICATE KEY UPDATE market_id=market_id"
+    cursor.executemany(query, list(dict.fromkeys(album_markets)))
 
     return cursor
 
 
-def update_chart_history_table(cursor, row, chart_id, album_id):
+def update_chart_history_table(cursor, history_rows):
     """
-    Take dictionary of scraped data and add relevant information to chart_history table in doron_yair database
+    Take the scraped data and add relevant information to chart_history table in doron_yair database
     :param cursor: cursor of pymysql.connect
-    :param row: a Series with the scrapped information of an album from the chart
-    :param chart_id:
-    :param album_id:
+    :param history_rows: a list of tuples of scrape datetime, chart_id, album_id, album rank, metascore, user score,
+    number of critic reviews and number of user reviews
     :return: cursor: cursor of pymysql.connect
     """
 
@@ -490,69 +848,124 @@ def update_chart_history_table(cursor, row, chart_id, album_id):
     sql_add_history = """INSERT INTO chart_history
                         (scrape_datetime, chart_id, album_id, album_rank, metascore, user_score,
                         num_of_critic_reviews, num_of_user_reviews)
-                        VALUES (NOW(), %s, %s, %s, %s, %s, %s, %s)"""
-
-    cursor.execute(sql_add_history, (chart_id, album_id, row['Album Rank'], row['Metascore'], row['User Score'],
-                                     row['No. of Critic Reviews'], row['No. of User Reviews']))
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"""
+    cursor.executemany(sql_add_history, history_rows)
 
     return cursor
 
 
-def add_data(albums_df, login_info, filter_by_arg, year_arg, sort_by_arg):
+def write_chart_data(cursor, records, filter_by_arg, year_arg, sort_by_arg, new_ids, scrape_datetime=None):
     """
-    main function, will execute all the necessary functions to add scraped data to database in the appropriate positions
-    :param albums_df:
-    :param login_info:
-    :param filter_by_arg:
-    :param year_arg:
-    :param sort_by_arg:
+    Writes the scraped data of a single chart to the database in the appropriate positions.
+    Every table is written with a constant number of statements, whatever the number of albums on the chart
+    :param cursor: cursor of pymysql.connect
+    :param records: a list with the AlbumRecords of the albums of the chart
+    :param filter_by_arg: a string with the filter method used
+    :param year_arg: a string with the year used in the filter
+    :param sort_by_arg: a string with the sorting method used
+    :param new_ids: a dictionary from table name to the dimension ids written by the current transaction
+    :param scrape_datetime: a string with the time of the scrape, the current time when not given
+    :return: the number of albums written
     """
+    if scrape_datetime is None:
+        scrape_datetime = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-    # Connect host
-    with connect_to_db(login_info, database='doron_yair') as cursor:
+    # Update charts table
+    cursor, chart_id = update_charts_table(cursor, filter_by_arg, year_arg, sort_by_arg)
 
-        # Use doron_yair database
-        sql_use = "USE doron_yair"
-        cursor.execute(sql_use)
-        cursor.execute("COMMIT")
+    # Update the tables the albums refer to
+    cursor, artist_ids = update_artists_table(cursor, records)
+    cursor, publisher_ids = update_publishers_table(cursor, records, new_ids)
+    cursor, summary_ids = update_summaries_table(cursor, records)
+    cursor, genre_ids = update_genres_table(cursor, records, new_ids)
+    cursor, market_ids = update_markets_table(cursor, records, new_ids)
 
-        try:
+    # Update albums table
+    cursor, album_ids = update_albums_table(cursor, records, artist_ids, publisher_ids, summary_ids, scrape_datetime)
+
+    album_genres, album_markets, history_rows = [], [], []
+    for record in records:
+        album_id = album_ids.get((artist_ids.get(record.artist), record.album))
+        if album_id is None:
+            logging.warning(f"Album {record.album} by {record.artist} was not found after it was written. "
+                            f"It was not added to chart {sort_by_arg} {filter_by_arg} {year_arg}.")
+            continue
 
-            # Update charts table
-            cursor, chart_id = update_charts_table(cursor, filter_by_arg, year_arg, sort_by_arg)
+        album_genres.extend((album_id, genre_ids[genre]) for genre in record.genres if genre in genre_ids)
+        album_markets.extend((album_id, market_ids[market]) for market in record.markets if market in market_ids)
+        history_rows.append((scrape_datetime, chart_id, album_id, record.rank, record.metascore, record.user_score,
+                             record.critic_reviews, record.user_reviews))
 
-            for index, row in albums_df.iterrows():
-                # Update artists table
-                cursor, artist_id = update_artists_table(cursor, row)
+    # Update albums_to_genres, albums_to_markets and chart_history tables
+    cursor = update_albums_to_genres(cursor, album_genres)
+    cursor = update_albums_to_markets(cursor, album_markets)
+    cursor = update_chart_history_table(cursor, history_rows)
+
+    return len(history_rows)
+
+
+def add_chart_data(connection, records, filter_by_arg, year_arg, sort_by_arg, scrape_datetime=None):
+    """
+    Adds the scraped data of a single chart to the database in a transaction of its own.
+    On failure the chart's changes are rolled back
+    :param connection: a pymysql connection
+    :param records: a list with the AlbumRecords of the albums of the chart
+    :param filter_by_arg: a string with the filter method used
+    :param year_arg: a string with the year used in the filter
+    :param sort_by_arg: a string with the sorting method used
+    :param scrape_datetime: a string with the time of the scrape, so all the parts of a chart written during one run
+    share their chart_history time. The current time when not given
+    :return: the number of albums written, 0 if the chart was rolled back
+    """
+    start = time.perf_counter()
 
-                # Update publishers table
-                cursor, publisher_id = update_publishers_table(cursor, row)
+    # dimension ids written by this transaction, they are cached only once it is committed
+    new_ids = dict()
 
-                # Update summaries table
-                cursor, summary_id = update_summaries_table(cursor, row)
+    try:
+        with transaction(connection) as cursor:
+            albums_num = write_chart_data(cursor, records, filter_by_arg, year_arg, sort_by_arg, new_ids,
+                                          scrape_datetime)
+        publish_dimension_ids(new_ids)
 
-                # Update genres table
-                cursor, genre_id_list = update_genres_table(cursor, row)
+    except Exception as e:
+        logging.critical(f"Failed updating database with chart {sort_by_arg} {filter_by_arg} {year_arg}.\n{e}")
+        # the cached ids may be why the chart failed, e.g. ids of rows that were deleted behind the cache
+        invalidate_dimension_ids()
+        return 0
 
-                # Update markets table
-                cursor, market_id_list = update_markets_table(cursor, row)
+    seconds = time.perf_counter() - start
+    logging.info(f"Database was updated successfully with chart {sort_by_arg} {filter_by_arg} {year_arg}: "
+                 f"{albums_num} albums in {seconds:.2f} seconds "
+                 f"({albums_num / seconds if seconds else 0:.0f} rows/sec).")
+    return albums_num
 
-                # Update albums table
-                cursor, album_id = update_albums_table(cursor, row, artist_id, publisher_id, summary_id)
 
-                # Update albums_to_genres table
-                cursor = update_albums_to_genres(cursor, album_id, genre_id_list)
+def add_charts_data(charts_data, login_info):
+    """
+    Adds the scraped data of several charts to the database through a single pooled connection, every chart in a
+    transaction of its own
+    :param charts_data: a list of tuples (records, filter_by_arg, year_arg, sort_by_arg), one for every chart
+    :param login_info: a dictionary with the username and password information
+    :return: a dictionary with the number of albums written ('rows') and the 'seconds' it took
+    """
+    start = time.perf_counter()
+    rows = 0
 
-                # Update albums_to_markets table
-                cursor = update_albums_to_markets(cursor, album_id, market_id_list)
+    with pooled_connection(login_info) as connection:
+        for records, filter_by_arg, year_arg, sort_by_arg in charts_data:
+            rows += add_chart_data(connection, records, filter_by_arg, year_arg, sort_by_arg)
 
-                # Update chart_history table
-                cursor = update_chart_history_table(cursor, row, chart_id, album_id)
+    return {'rows': rows, 'seconds': time.perf_counter() - start}
 
-            # Commit
-            cursor.execute("COMMIT")
-            logging.info("Database was updated successfully.")
 
-        except Exception as e:
-            logging.critical(f"Failed updating database. Exiting program.\n{e}")
-            cursor.execute("rollback")
+def add_data(records, login_info, filter_by_arg, year_arg, sort_by_arg):
+    """
+    main function, will execute all the necessary functions to add scraped data to database in the appropriate positions
+    :param records: a list with the AlbumRecords of the albums of the chart
+    :param login_info: a dictionary with the username and password information
+    :param filter_by_arg: a string with the filter method used
+    :param year_arg: a string with the year used in the filter
+    :param sort_by_arg: a string with the sorting method used
+    """
+    add_charts_data([(records, filter_by_arg, year_arg, sort_by_arg)], login_info)